@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class ScBuscaConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "sc_busca"
+
+    def ready(self):
+        # Mantém o índice de busca sincronizado com save/delete dos modelos
+        from . import sinais
+
+        sinais.conectar()
@@ -0,0 +1,218 @@
+"""
+Índice de busca textual unificado (matérias primas, lotes, produtos e fornecedores).
+
+No SQLite o índice é uma tabela virtual FTS5; no PostgreSQL é uma tabela com uma
+coluna tsvector gerada e índice GIN. Nos demais bancos o índice não é criado
+(com um aviso no log) e a busca fica indisponível. O texto é gravado sem acentos e em
+minúsculas, então a busca não diferencia "Ácido" de "acido".
+
+Cada linha usa como chave (rowid) o ID do objeto combinado com o código do
+recurso, de modo que atualizar ou remover um objeto é uma operação pela chave.
+"""
+
+import logging
+import re
+import unicodedata
+
+from django.apps import apps as apps_globais
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+TABELA = "busca_indice"
+
+# Bancos com suporte a busca textual
+BANCOS_SUPORTADOS = ("sqlite", "postgresql")
+
+# recurso: (código usado na chave, modelo, campos indexados)
+RECURSOS = {
+    "materia_prima": (1, "sc_materiasPrimas.MateriaPrima", ("nome",)),
+    "lote_materia_prima": (2, "sc_materiasPrimas.LoteMateriaPrima", ("numero_lote",)),
+    "produto": (3, "sc_produtos.Produto", ("nome",)),
+    "fornecedor": (4, "sc_fornecedores.Fornecedor", ("razao_social", "fantasia")),
+}
+
+# Espaço reservado para os códigos de recurso na chave (objeto_id * 8 + código)
+_MULTIPLICADOR_CHAVE = 8
+
+# Linhas gravadas por comando na reindexação completa
+BLOCO_REINDEXACAO = 5000
+
+# Palavras menores que isso só casam exatamente: um prefixo de 1-2 letras
+# casaria com boa parte do índice e todos os resultados teriam de ser ranqueados
+TAMANHO_MINIMO_PREFIXO = 3
+
+
+def normalizar(texto):
+    """Remove acentos e converte para minúsculas"""
+    decomposto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def _chave(recurso, objeto_id):
+    return objeto_id * _MULTIPLICADOR_CHAVE + RECURSOS[recurso][0]
+
+
+def recurso_do_modelo(modelo):
+    """Nome do recurso indexado para a classe de modelo, ou None"""
+    rotulo = modelo._meta.label
+    for recurso, (_, modelo_indexado, _) in RECURSOS.items():
+        if modelo_indexado == rotulo:
+            return recurso
+    return None
+
+
+def _linha(recurso, obj):
+    campos = RECURSOS[recurso][2]
+    valores = [str(getattr(obj, campo) or "") for campo in campos]
+    titulo = " - ".join(v for v in valores if v)
+    return (_chave(recurso, obj.pk), recurso, obj.pk, titulo, normalizar(titulo))
+
+
+def suportado(conexao=connection):
+    """Se o banco da conexão tem o índice de busca"""
+    return conexao.vendor in BANCOS_SUPORTADOS
+
+
+def criar_tabela(conexao=connection):
+    if not suportado(conexao):
+        logger.warning(
+            "Busca textual não suportada no banco %s: o índice não será criado",
+            conexao.vendor,
+        )
+        return
+    with conexao.cursor() as cursor:
+        if conexao.vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA} USING fts5("
+                "recurso UNINDEXED, objeto_id UNINDEXED, titulo UNINDEXED, texto, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '3')"
+            )
+        elif conexao.vendor == "postgresql":
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {TABELA} ("
+                "chave bigint PRIMARY KEY, recurso varchar(30) NOT NULL, "
+                "objeto_id integer NOT NULL, titulo text NOT NULL, "
+                "texto text NOT NULL, "
+                "documento tsvector GENERATED ALWAYS AS "
+                "(to_tsvector('simple', texto)) STORED)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {TABELA}_documento_idx "
+                f"ON {TABELA} USING GIN (documento)"
+            )
+
+
+def remover_tabela(conexao=connection):
+    with conexao.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABELA}")
+
+
+def indexar(recurso, objetos, conexao=connection):
+    """Insere ou atualiza os objetos do recurso no índice"""
+    if not suportado(conexao):
+        return
+    linhas = [_linha(recurso, obj) for obj in objetos]
+    if not linhas:
+        return
+    with conexao.cursor() as cursor:
+        if conexao.vendor == "sqlite":
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {TABELA} (rowid, recurso, objeto_id, "
+                "titulo, texto) VALUES (%s, %s, %s, %s, %s)",
+                linhas,
+            )
+        else:
+            cursor.executemany(
+                f"INSERT INTO {TABELA} (chave, recurso, objeto_id, titulo, texto) "
+                "VALUES (%s, %s, %s, %s, %s) ON CONFLICT (chave) DO UPDATE "
+                "SET titulo = EXCLUDED.titulo, texto = EXCLUDED.texto",
+                linhas,
+            )
+
+
+def remover(recurso, ids, conexao=connection):
+    """Remove do índice os objetos do recurso com os IDs informados"""
+    if not suportado(conexao):
+        return
+    chaves = [(_chave(recurso, pk),) for pk in ids]
+    if not chaves:
+        return
+    coluna = "rowid" if conexao.vendor == "sqlite" else "chave"
+    with conexao.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABELA} WHERE {coluna} = %s", chaves)
+
+
+def reindexar(apps=apps_globais, conexao=connection):
+    """Reconstrói o índice inteiro a partir das tabelas. Retorna o total indexado."""
+    if not suportado(conexao):
+        return 0
+    with conexao.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABELA}")
+
+    total = 0
+    for recurso, (_, rotulo, campos) in RECURSOS.items():
+        modelo = apps.get_model(rotulo)
+        bloco = []
+        for obj in modelo.objects.only("pk", *campos).iterator(
+            chunk_size=BLOCO_REINDEXACAO
+        ):
+            bloco.append(obj)
+            if len(bloco) >= BLOCO_REINDEXACAO:
+                indexar(recurso, bloco, conexao)
+                total += len(bloco)
+                bloco = []
+        indexar(recurso, bloco, conexao)
+        total += len(bloco)
+    return total
+
+
+def buscar(termo, recursos=None, limite=20, conexao=connection):
+    """
+    Busca os termos (todos, como prefixo) e retorna os resultados do mais
+    relevante para o menos relevante.
+    """
+
+    def prefixo(palavra):
+        return len(palavra) >= TAMANHO_MINIMO_PREFIXO
+
+    palavras = re.findall(r"\w+", normalizar(termo))
+    if not palavras:
+        return []
+
+    filtro_recurso, parametros_recurso = "", []
+    if recursos:
+        marcadores = ", ".join(["%s"] * len(recursos))
+        filtro_recurso = f" AND recurso IN ({marcadores})"
+        parametros_recurso = list(recursos)
+
+    if conexao.vendor == "sqlite":
+        consulta = " ".join(
+            f'"{palavra}"*' if prefixo(palavra) else f'"{palavra}"'
+            for palavra in palavras
+        )
+        sql = (
+            f"SELECT recurso, objeto_id, titulo, -rank FROM {TABELA} "
+            f"WHERE {TABELA} MATCH %s{filtro_recurso} ORDER BY rank LIMIT %s"
+        )
+    else:
+        consulta = " & ".join(
+            f"{palavra}:*" if prefixo(palavra) else palavra for palavra in palavras
+        )
+        sql = (
+            f"SELECT recurso, objeto_id, titulo, ts_rank(documento, consulta) "
+            f"FROM {TABELA}, to_tsquery('simple', %s) consulta "
+            f"WHERE documento @@ consulta{filtro_recurso} ORDER BY 4 DESC LIMIT %s"
+        )
+
+    with conexao.cursor() as cursor:
+        cursor.execute(sql, [consulta, *parametros_recurso, limite])
+        return [
+            {
+                "recurso": recurso,
+                "id": objeto_id,
+                "titulo": titulo,
+                "relevancia": relevancia,
+            }
+            for recurso, objeto_id, titulo, relevancia in cursor.fetchall()
+        ]
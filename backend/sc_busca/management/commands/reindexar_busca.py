@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from sc_busca.indice import reindexar
+
+
+class Command(BaseCommand):
+    help = "Reconstrói o índice de busca textual a partir das tabelas"
+
+    def handle(self, *args, **kwargs):
+        inicio = timezone.now()
+        with transaction.atomic():
+            total = reindexar()
+        duracao = (timezone.now() - inicio).total_seconds()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{total} registro(s) indexado(s) em {duracao:.2f}s")
+        )
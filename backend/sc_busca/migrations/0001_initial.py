@@ -0,0 +1,27 @@
+from django.db import migrations
+
+from sc_busca import indice
+
+
+def criar_indice(apps, schema_editor):
+    indice.criar_tabela(schema_editor.connection)
+    indice.reindexar(apps, schema_editor.connection)
+
+
+def remover_indice(apps, schema_editor):
+    indice.remover_tabela(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("sc_fornecedores", "0002_atualizado_em"),
+        ("sc_materiasPrimas", "0007_registro_exclusao"),
+        ("sc_produtos", "0002_atualizado_em"),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice, remover_indice),
+    ]
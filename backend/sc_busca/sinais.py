@@ -0,0 +1,32 @@
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save
+
+from . import indice
+
+
+def indexar_objeto(sender, instance, update_fields=None, raw=False, **kwargs):
+    recurso = indice.recurso_do_modelo(sender)
+    if raw:
+        return
+    # Saves parciais que não tocam nos campos indexados não mudam o índice
+    campos = indice.RECURSOS[recurso][2]
+    if update_fields is not None and not set(update_fields) & set(campos):
+        return
+    indice.indexar(recurso, [instance])
+
+
+def remover_objeto(sender, instance, **kwargs):
+    indice.remover(indice.recurso_do_modelo(sender), [instance.pk])
+
+
+def conectar():
+    """
+    Conecta os sinais apenas aos modelos indexados (receivers sem sender
+    impediriam o Django de fazer exclusões em massa nos demais modelos).
+    """
+    for _, rotulo, _ in indice.RECURSOS.values():
+        modelo = apps.get_model(rotulo)
+        post_save.connect(indexar_objeto, sender=modelo, dispatch_uid=f"busca_{rotulo}")
+        post_delete.connect(
+            remover_objeto, sender=modelo, dispatch_uid=f"busca_remover_{rotulo}"
+        )
@@ -0,0 +1,48 @@
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from .indice import RECURSOS, buscar, suportado
+
+LIMITE_PADRAO = 20
+LIMITE_MAXIMO = 100
+
+
+@csrf_exempt
+def busca(request):
+    """
+    Busca unificada em matérias primas, lotes, produtos e fornecedores.
+    Parâmetros: q (obrigatório), recursos (separados por vírgula) e limite.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    if not suportado():
+        return JsonResponse(
+            {"error": "Busca textual indisponível neste banco de dados"}, status=503
+        )
+
+    termo = request.GET.get("q", "").strip()
+    if not termo:
+        return JsonResponse({"error": "O parâmetro q é obrigatório"}, status=400)
+
+    recursos = [r for r in request.GET.get("recursos", "").split(",") if r]
+    invalidos = [r for r in recursos if r not in RECURSOS]
+    if invalidos:
+        return JsonResponse(
+            {
+                "error": f"Recursos inválidos: {', '.join(invalidos)}",
+                "recursos_validos": list(RECURSOS),
+            },
+            status=400,
+        )
+
+    try:
+        limite = min(int(request.GET.get("limite", LIMITE_PADRAO)), LIMITE_MAXIMO)
+        if limite < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse(
+            {"error": "O parâmetro limite deve ser um número positivo"}, status=400
+        )
+
+    return JsonResponse({"resultados": buscar(termo, recursos, limite)})
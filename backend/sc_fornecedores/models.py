@@ -5,3 +5,4 @@ class Fornecedor(models.Model):
     cnpj = models.CharField(max_length=18, unique=True)
     razao_social = models.CharField(max_length=200)
     fantasia = models.CharField(max_length=100)
+    atualizado_em = models.DateTimeField(auto_now=True, db_index=True)
@@ -1,3 +1,43 @@
 from django.test import TestCase
+from django.utils.http import http_date
 
-# Create your tests here.
+from .models import Fornecedor
+
+
+class GetCondicionalTests(TestCase):
+    """GET condicional das listagens, validado só pelo ETag"""
+
+    def setUp(self):
+        self.fornecedores = [
+            Fornecedor.objects.create(cnpj=str(i), razao_social=f"F{i}", fantasia=f"F{i}")
+            for i in range(3)
+        ]
+
+    def test_etag_inalterado_responde_304(self):
+        resposta = self.client.get("/api/fornecedores/")
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotIn("Last-Modified", resposta.headers)
+
+        resposta = self.client.get("/api/fornecedores/", HTTP_IF_NONE_MATCH=resposta["ETag"])
+
+        self.assertEqual(resposta.status_code, 304)
+
+    def test_exclusao_muda_o_etag(self):
+        etag = self.client.get("/api/fornecedores/")["ETag"]
+        # Não é o mais recente: MAX(atualizado_em) não muda
+        self.fornecedores[0].delete()
+
+        resposta = self.client.get("/api/fornecedores/", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(resposta.json()), 2)
+
+    def test_if_modified_since_sozinho_nao_responde_304(self):
+        self.fornecedores[0].delete()
+
+        resposta = self.client.get(
+            "/api/fornecedores/", HTTP_IF_MODIFIED_SINCE=http_date()
+        )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(len(resposta.json()), 2)
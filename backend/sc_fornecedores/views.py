@@ -2,10 +2,12 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.db.models import ProtectedError
 from .models import Fornecedor
+from sistema_capsulas.respostas import get_condicional
 import json
 
 
 @csrf_exempt
+@get_condicional(Fornecedor)
 def fornecedor_list(request):
     """Listar todos os fornecedores ou criar um novo"""
     if request.method == "GET":
@@ -34,6 +36,7 @@ def fornecedor_list(request):
 
 
 @csrf_exempt
+@get_condicional(lambda pk: Fornecedor.objects.filter(pk=pk))
 def fornecedor_detail(request, pk):
     """Recuperar, atualizar ou excluir um fornecedor"""
     try:
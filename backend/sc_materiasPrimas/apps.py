@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ScMateriasprimasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sc_materiasPrimas'
+
+    def ready(self):
+        # Registra no log de alterações o que os clientes precisam sincronizar
+        from . import sinais
+
+        sinais.conectar()
@@ -0,0 +1,248 @@
+"""
+Importação em massa de lotes de matéria prima (recebimento de carga).
+Aceita CSV (com cabeçalho) ou NDJSON (um objeto JSON por linha) com os mesmos
+campos do POST em /api/lotes/.
+"""
+
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Value, When
+from django.utils import timezone
+
+from sc_busca.indice import indexar
+from sc_fornecedores.models import Fornecedor
+from .models import (
+    LoteMateriaPrima,
+    MateriaPrima,
+    MovimentacaoEstoque,
+    RecursoSincronizadoEnum,
+    RegistroAlteracao,
+    TipoMovimentacaoEnum,
+    invalidar_cache_valor_estoque,
+)
+
+CAMPOS_OBRIGATORIOS = [
+    "materia_prima_id",
+    "numero_lote",
+    "data_fabricacao",
+    "data_validade",
+    "quant_recebida_kg",
+]
+
+VALORES_VERDADEIROS = {"1", "true", "sim", "s", "yes"}
+
+# Matérias primas atualizadas por UPDATE ao somar o estoque recebido
+BLOCO_ATUALIZACAO = 300
+
+
+def ler_registros(conteudo, formato):
+    """
+    Converte o conteúdo do arquivo em uma lista de (linha, registro, erro).
+    Linhas de NDJSON que não forem JSON válido voltam com o erro preenchido.
+    """
+    if formato == "csv":
+        leitor = csv.DictReader(io.StringIO(conteudo))
+        # A linha 1 é o cabeçalho
+        return [(numero, registro, None) for numero, registro in enumerate(leitor, 2)]
+
+    if formato == "ndjson":
+        registros = []
+        for numero, linha in enumerate(conteudo.splitlines(), 1):
+            if not linha.strip():
+                continue
+            try:
+                registros.append((numero, json.loads(linha), None))
+            except json.JSONDecodeError:
+                registros.append((numero, None, "Linha não é um JSON válido"))
+        return registros
+
+    raise ValueError("Formato inválido. Use 'csv' ou 'ndjson'")
+
+
+def _para_data(valor, campo):
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(str(valor), "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError(f"O campo {campo} deve estar no formato YYYY-MM-DD")
+
+
+def _para_int(valor, campo):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"O campo {campo} deve ser um ID numérico")
+
+
+def _para_bool(valor):
+    if isinstance(valor, bool):
+        return valor
+    return str(valor or "").strip().lower() in VALORES_VERDADEIROS
+
+
+def importar_lotes(registros):
+    """
+    Valida todos os registros de uma vez e grava os válidos com bulk_create.
+    O estoque das matérias primas recebe a soma das quantidades em UPDATEs agrupados.
+    Retorna {"criados": [...], "erros": [{"linha": n, "erro": "..."}]}.
+    """
+    erros = []
+    candidatos = []
+
+    # Uma consulta para as matérias primas e outra para os fornecedores referenciados
+    materias_ids, fornecedores_ids, numeros_lote = set(), set(), set()
+    for _, registro, _ in registros:
+        if not isinstance(registro, dict):
+            continue
+        numeros_lote.add(str(registro.get("numero_lote")))
+        try:
+            materias_ids.add(int(registro.get("materia_prima_id")))
+        except (TypeError, ValueError):
+            pass
+        try:
+            if registro.get("fornecedor_id"):
+                fornecedores_ids.add(int(registro["fornecedor_id"]))
+        except (TypeError, ValueError):
+            pass
+    materias = MateriaPrima.objects.only("id").in_bulk(materias_ids)
+    fornecedores = Fornecedor.objects.only("id").in_bulk(fornecedores_ids)
+
+    # Lotes que já existem para as matérias primas da carga
+    existentes = set(
+        LoteMateriaPrima.objects.filter(
+            materia_prima_id__in=materias, numero_lote__in=numeros_lote
+        ).values_list("materia_prima_id", "numero_lote")
+    )
+
+    for linha, registro, erro in registros:
+        if erro:
+            erros.append({"linha": linha, "erro": erro})
+            continue
+        if not isinstance(registro, dict):
+            erros.append({"linha": linha, "erro": "Registro deve ser um objeto"})
+            continue
+
+        try:
+            faltando = [c for c in CAMPOS_OBRIGATORIOS if not registro.get(c)]
+            if faltando:
+                raise ValueError(
+                    f"Campos obrigatórios não preenchidos: {', '.join(faltando)}"
+                )
+
+            materia_prima_id = _para_int(registro["materia_prima_id"], "materia_prima_id")
+            if materia_prima_id not in materias:
+                raise ValueError(
+                    f"Matéria prima com ID {materia_prima_id} não encontrada"
+                )
+
+            fornecedor_id = None
+            if registro.get("fornecedor_id"):
+                fornecedor_id = _para_int(registro["fornecedor_id"], "fornecedor_id")
+                if fornecedor_id not in fornecedores:
+                    raise ValueError(f"Fornecedor com ID {fornecedor_id} não encontrado")
+
+            try:
+                quantidade = float(registro["quant_recebida_kg"])
+            except (TypeError, ValueError):
+                raise ValueError("O campo quant_recebida_kg deve ser numérico")
+            if quantidade <= 0:
+                raise ValueError("A quantidade deve ser maior que zero")
+
+            numero_lote = str(registro["numero_lote"])
+            chave = (materia_prima_id, numero_lote)
+            if chave in existentes:
+                raise ValueError(
+                    f"Lote {numero_lote} já cadastrado para a matéria prima {materia_prima_id}"
+                )
+            existentes.add(chave)
+
+            candidatos.append(
+                LoteMateriaPrima(
+                    materia_prima_id=materia_prima_id,
+                    numero_lote=numero_lote,
+                    data_fabricacao=_para_data(
+                        registro["data_fabricacao"], "data_fabricacao"
+                    ),
+                    data_validade=_para_data(registro["data_validade"], "data_validade"),
+                    nota_fiscal=str(registro.get("nota_fiscal") or ""),
+                    quant_recebida_kg=quantidade,
+                    quant_disponivel_kg=quantidade,
+                    fornecedor_id=fornecedor_id,
+                    local_armazenamento=registro.get("local_armazenamento") or "",
+                    condicoes_armazenamento=registro.get("condicoes_armazenamento")
+                    or "",
+                    observacoes=registro.get("observacoes") or "",
+                    aprovado_controle_qualidade=_para_bool(
+                        registro.get("aprovado_controle_qualidade")
+                    ),
+                )
+            )
+        except ValueError as e:
+            erros.append({"linha": linha, "erro": str(e)})
+
+    if not candidatos:
+        return {"criados": [], "erros": erros}
+
+    incrementos = defaultdict(float)
+    for lote in candidatos:
+        incrementos[lote.materia_prima_id] += lote.quant_recebida_kg
+
+    with transaction.atomic():
+        lotes = LoteMateriaPrima.objects.bulk_create(candidatos, batch_size=500)
+
+        agora = timezone.now()
+        # Um UPDATE por bloco de matérias primas (limite de parâmetros do SQLite)
+        itens = list(incrementos.items())
+        for inicio in range(0, len(itens), BLOCO_ATUALIZACAO):
+            bloco = dict(itens[inicio : inicio + BLOCO_ATUALIZACAO])
+            MateriaPrima.objects.filter(pk__in=bloco).update(
+                quantidade_disponivel=F("quantidade_disponivel")
+                + Case(
+                    *[When(pk=pk, then=Value(total)) for pk, total in bloco.items()],
+                    output_field=FloatField(),
+                ),
+                _status_interno=Case(
+                    When(_status_interno="esgotado", then=Value("disponível")),
+                    default=F("_status_interno"),
+                ),
+                atualizado_em=agora,
+            )
+        invalidar_cache_valor_estoque()
+
+        # bulk_create não dispara os sinais que mantêm o índice de busca e o
+        # log de alterações da sincronização
+        indexar("lote_materia_prima", lotes)
+        RegistroAlteracao.registrar(
+            RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA, [lote.id for lote in lotes]
+        )
+        RegistroAlteracao.registrar(RecursoSincronizadoEnum.MATERIA_PRIMA, incrementos)
+
+        MovimentacaoEstoque.objects.bulk_create(
+            [
+                MovimentacaoEstoque(
+                    tipo=TipoMovimentacaoEnum.RECEBIMENTO,
+                    quantidade_kg=lote.quant_recebida_kg,
+                    materia_prima_id=lote.materia_prima_id,
+                    lote_id=lote.id,
+                    observacao=f"NF {lote.nota_fiscal}" if lote.nota_fiscal else "",
+                )
+                for lote in lotes
+            ],
+            batch_size=500,
+        )
+
+    criados = [
+        {
+            "id": lote.id,
+            "materia_prima_id": lote.materia_prima_id,
+            "numero_lote": lote.numero_lote,
+        }
+        for lote in lotes
+    ]
+    return {"criados": criados, "erros": erros}
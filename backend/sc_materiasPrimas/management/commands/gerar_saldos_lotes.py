@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sc_materiasPrimas.models import SaldoLote
+
+
+class Command(BaseCommand):
+    help = (
+        "Grava a fotografia do saldo dos lotes movimentados ao final de um dia "
+        "(padrão: ontem)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--data",
+            help="Data da fotografia no formato YYYY-MM-DD (padrão: ontem)",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs.get("data"):
+            try:
+                data = datetime.strptime(kwargs["data"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Formato de data inválido. Use YYYY-MM-DD")
+        else:
+            data = timezone.localdate() - timedelta(days=1)
+
+        try:
+            gravadas = SaldoLote.gerar_fotografias(data)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Saldos de {data:%d/%m/%Y} gravados: {gravadas} lote(s) movimentado(s)"
+            )
+        )
@@ -0,0 +1,44 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sc_materiasPrimas.importacao import importar_lotes, ler_registros
+
+
+class Command(BaseCommand):
+    help = "Importa lotes de matéria prima a partir de um arquivo CSV ou NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument("arquivo", help="Caminho do arquivo .csv ou .ndjson")
+        parser.add_argument(
+            "--formato",
+            choices=["csv", "ndjson"],
+            help="Formato do arquivo (padrão: deduzido pela extensão)",
+        )
+
+    def handle(self, *args, **kwargs):
+        arquivo = kwargs["arquivo"]
+        formato = kwargs.get("formato") or (
+            "csv" if arquivo.lower().endswith(".csv") else "ndjson"
+        )
+
+        try:
+            with open(arquivo, encoding="utf-8-sig") as f:
+                registros = ler_registros(f.read(), formato)
+        except OSError as e:
+            raise CommandError(f"Não foi possível ler o arquivo: {e}")
+        except (ValueError, csv.Error) as e:
+            raise CommandError(str(e))
+
+        resultado = importar_lotes(registros)
+
+        for erro in resultado["erros"]:
+            self.stdout.write(
+                self.style.WARNING(f"Linha {erro['linha']}: {erro['erro']}")
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(resultado['criados'])} lote(s) importado(s), "
+                f"{len(resultado['erros'])} linha(s) com erro"
+            )
+        )
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from sc_materiasPrimas.models import MateriaPrima
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula o status de todas as matérias primas (executar na virada do dia, "
+        "horário de America/Sao_Paulo)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--data",
+            help="Data de referência no formato YYYY-MM-DD (padrão: hoje no fuso do projeto)",
+        )
+
+    def handle(self, *args, **kwargs):
+        if kwargs.get("data"):
+            try:
+                hoje = datetime.strptime(kwargs["data"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Formato de data inválido. Use YYYY-MM-DD")
+        else:
+            hoje = timezone.localdate()
+
+        inicio = timezone.now()
+        atualizadas = MateriaPrima.recalcular_status_em_massa(hoje)
+        duracao = (timezone.now() - inicio).total_seconds()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Status recalculado para {hoje:%d/%m/%Y}: "
+                f"{atualizadas} matéria(s) prima(s) alterada(s) em {duracao:.2f}s"
+            )
+        )
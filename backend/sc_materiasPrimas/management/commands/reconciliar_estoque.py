@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sc_materiasPrimas.reconciliacao import CASAS_DECIMAIS_KG, reconciliar
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara o estoque de cada matéria prima com a soma do saldo dos seus "
+        "lotes e, opcionalmente, corrige as divergências"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Verificar apenas as matérias primas alteradas desde a última execução",
+        )
+        parser.add_argument(
+            "--corrigir",
+            action="store_true",
+            help=(
+                "Igualar o estoque das matérias primas divergentes à soma dos lotes "
+                "(desfaz também ajustes legítimos: avalie o relatório antes)"
+            ),
+        )
+
+    def handle(self, *args, **kwargs):
+        inicio = timezone.now()
+        resultado = reconciliar(
+            incremental=kwargs["incremental"], corrigir=kwargs["corrigir"]
+        )
+        duracao = (timezone.now() - inicio).total_seconds()
+
+        casas = CASAS_DECIMAIS_KG
+        for item in resultado["divergencias"]:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{item['nome']} (ID {item['id']}): estoque "
+                    f"{item['quantidade_disponivel']:.{casas}f}kg, lotes "
+                    f"{item['total_lotes']:.{casas}f}kg, "
+                    f"diferença {item['diferenca_kg']:+.{casas}f}kg"
+                )
+            )
+
+        verificadas = resultado["materias_verificadas"]
+        escopo = (
+            f"{verificadas} matéria(s) prima(s) alterada(s)"
+            if resultado["incremental"]
+            else "todas as matérias primas"
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reconciliação de {escopo} em {duracao:.2f}s: "
+                f"{len(resultado['divergencias'])} divergência(s), "
+                f"{resultado['corrigidas']} corrigida(s)"
+            )
+        )
@@ -0,0 +1,50 @@
+# Generated by Django 5.2 on 2026-10-18 13:12
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def preencher_data_validade_efetiva(apps, schema_editor):
+    """Preenche a validade efetiva das matérias primas já cadastradas"""
+    MateriaPrima = apps.get_model("sc_materiasPrimas", "MateriaPrima")
+
+    # Embalagens fechadas (ou sem data de abertura) usam a validade original
+    MateriaPrima.objects.update(data_validade_efetiva=models.F("data_validade"))
+
+    # Embalagens abertas dependem de aritmética de datas; processar em blocos
+    abertas = MateriaPrima.objects.filter(
+        embalagem_aberta=True,
+        data_abertura_embalagem__isnull=False,
+        data_validade__isnull=False,
+    ).only("id", "data_abertura_embalagem", "dias_validade_apos_aberto")
+
+    pendentes = []
+    for mp in abertas.iterator(chunk_size=2000):
+        mp.data_validade_efetiva = mp.data_abertura_embalagem + timedelta(
+            days=mp.dias_validade_apos_aberto or 30
+        )
+        pendentes.append(mp)
+        if len(pendentes) >= 2000:
+            MateriaPrima.objects.bulk_update(pendentes, ["data_validade_efetiva"])
+            pendentes = []
+    if pendentes:
+        MateriaPrima.objects.bulk_update(pendentes, ["data_validade_efetiva"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materiaprima',
+            name='data_validade_efetiva',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(
+            preencher_data_validade_efetiva, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+def zerar_quantidades_negativas(apps, schema_editor):
+    """Corrige saldos negativos antigos para que as constraints possam ser criadas"""
+    MateriaPrima = apps.get_model("sc_materiasPrimas", "MateriaPrima")
+    LoteMateriaPrima = apps.get_model("sc_materiasPrimas", "LoteMateriaPrima")
+
+    MateriaPrima.objects.filter(quantidade_disponivel__lt=0).update(
+        quantidade_disponivel=0
+    )
+    LoteMateriaPrima.objects.filter(quant_disponivel_kg__lt=0).update(
+        quant_disponivel_kg=0
+    )
+    LoteMateriaPrima.objects.filter(quant_recebida_kg__lt=0).update(
+        quant_recebida_kg=0
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_fornecedores', '0001_initial'),
+        ('sc_materiasPrimas', '0002_materiaprima_data_validade_efetiva'),
+    ]
+
+    operations = [
+        migrations.RunPython(zerar_quantidades_negativas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='lotemateriaprima',
+            constraint=models.CheckConstraint(condition=models.Q(('quant_disponivel_kg__gte', 0)), name='lote_mp_quant_disponivel_nao_negativa'),
+        ),
+        migrations.AddConstraint(
+            model_name='lotemateriaprima',
+            constraint=models.CheckConstraint(condition=models.Q(('quant_recebida_kg__gte', 0)), name='lote_mp_quant_recebida_nao_negativa'),
+        ),
+        migrations.AddConstraint(
+            model_name='materiaprima',
+            constraint=models.CheckConstraint(condition=models.Q(('quantidade_disponivel__gte', 0)), name='materia_prima_quantidade_nao_negativa'),
+        ),
+    ]
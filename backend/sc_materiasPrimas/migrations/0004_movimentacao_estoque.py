@@ -0,0 +1,76 @@
+# Generated by Django 5.2 on 2026-10-18 13:16
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def registrar_saldos_iniciais(apps, schema_editor):
+    """Cria uma movimentação de saldo inicial para cada lote já existente"""
+    LoteMateriaPrima = apps.get_model("sc_materiasPrimas", "LoteMateriaPrima")
+    MovimentacaoEstoque = apps.get_model("sc_materiasPrimas", "MovimentacaoEstoque")
+
+    lotes = (
+        LoteMateriaPrima.objects.filter(quant_disponivel_kg__gt=0)
+        .values_list("id", "materia_prima_id", "quant_disponivel_kg")
+        .iterator(chunk_size=2000)
+    )
+    pendentes = []
+    for lote_id, materia_prima_id, quantidade in lotes:
+        pendentes.append(
+            MovimentacaoEstoque(
+                tipo="ajuste",
+                quantidade_kg=quantidade,
+                materia_prima_id=materia_prima_id,
+                lote_id=lote_id,
+                observacao="Saldo inicial",
+            )
+        )
+        if len(pendentes) >= 2000:
+            MovimentacaoEstoque.objects.bulk_create(pendentes)
+            pendentes = []
+    if pendentes:
+        MovimentacaoEstoque.objects.bulk_create(pendentes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0003_estoque_nao_negativo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovimentacaoEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('recebimento', 'Recebimento'), ('consumo', 'Consumo'), ('ajuste', 'Ajuste'), ('exclusão de lote', 'Exclusao Lote')], max_length=20)),
+                ('quantidade_kg', models.FloatField()),
+                ('data_hora', models.DateTimeField(default=django.utils.timezone.now)),
+                ('observacao', models.CharField(blank=True, max_length=255)),
+                ('lote', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movimentacoes', to='sc_materiasPrimas.lotemateriaprima')),
+                ('materia_prima', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='movimentacoes', to='sc_materiasPrimas.materiaprima')),
+            ],
+            options={
+                'verbose_name': 'Movimentação de Estoque',
+                'verbose_name_plural': 'Movimentações de Estoque',
+                'indexes': [models.Index(fields=['data_hora'], name='mov_estoque_data_hora_idx'), models.Index(fields=['lote', 'data_hora'], name='mov_estoque_lote_data_idx'), models.Index(fields=['materia_prima', 'data_hora'], name='mov_estoque_mp_data_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoLote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('saldo_kg', models.FloatField()),
+                ('lote', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='saldos', to='sc_materiasPrimas.lotemateriaprima')),
+                ('materia_prima', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='saldos_lotes', to='sc_materiasPrimas.materiaprima')),
+            ],
+            options={
+                'verbose_name': 'Saldo de Lote',
+                'verbose_name_plural': 'Saldos de Lotes',
+                'constraints': [models.UniqueConstraint(fields=('lote', 'data'), name='saldo_lote_data_unico')],
+            },
+        ),
+        migrations.RunPython(registrar_saldos_iniciais, migrations.RunPython.noop),
+    ]
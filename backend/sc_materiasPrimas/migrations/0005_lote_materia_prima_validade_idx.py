@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_fornecedores', '0001_initial'),
+        ('sc_materiasPrimas', '0004_movimentacao_estoque'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lotemateriaprima',
+            index=models.Index(fields=['materia_prima', 'data_validade'], name='lote_mp_validade_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0005_lote_materia_prima_validade_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lotemateriaprima',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='materiaprima',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
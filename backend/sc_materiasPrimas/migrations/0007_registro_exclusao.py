@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 13:26
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0006_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroExclusao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recurso', models.CharField(choices=[('materia_prima', 'Materia Prima'), ('lote_materia_prima', 'Lote Materia Prima'), ('produto', 'Produto'), ('lote_producao', 'Lote Producao')], max_length=30)),
+                ('objeto_id', models.IntegerField()),
+                ('excluido_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['recurso', 'excluido_em'], name='registro_exclusao_idx')],
+            },
+        ),
+    ]
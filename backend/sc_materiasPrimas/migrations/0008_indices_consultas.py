@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_fornecedores', '0002_atualizado_em'),
+        ('sc_materiasPrimas', '0007_registro_exclusao'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lotemateriaprima',
+            index=models.Index(condition=models.Q(('aprovado_controle_qualidade', True)), fields=['materia_prima', 'data_validade'], name='lote_mp_aprovado_validade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lotemateriaprima',
+            index=models.Index(fields=['data_validade'], name='lote_mp_data_validade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lotemateriaprima',
+            index=models.Index(fields=['codigo_rastreabilidade'], name='lote_mp_rastreabilidade_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materiaprima',
+            index=models.Index(fields=['_status_interno', 'data_validade_efetiva'], name='materia_prima_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='materiaprima',
+            index=models.Index(fields=['fornecedor', 'data_validade_efetiva'], name='materia_prima_fornecedor_idx'),
+        ),
+    ]
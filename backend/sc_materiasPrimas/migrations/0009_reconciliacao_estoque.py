@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0008_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExecucaoReconciliacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('iniciada_em', models.DateTimeField(db_index=True)),
+                ('incremental', models.BooleanField(default=False)),
+                ('materias_verificadas', models.IntegerField(blank=True, null=True)),
+                ('divergencias', models.IntegerField(default=0)),
+                ('corrigidas', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Execução de Reconciliação',
+                'verbose_name_plural': 'Execuções de Reconciliação',
+            },
+        ),
+        migrations.AlterField(
+            model_name='movimentacaoestoque',
+            name='tipo',
+            field=models.CharField(choices=[('recebimento', 'Recebimento'), ('consumo', 'Consumo'), ('ajuste', 'Ajuste'), ('exclusão de lote', 'Exclusao Lote'), ('reconciliação', 'Reconciliacao')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_fornecedores', '0002_atualizado_em'),
+        ('sc_materiasPrimas', '0009_reconciliacao_estoque'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lotemateriaprima',
+            index=models.Index(fields=['numero_lote'], name='lote_mp_numero_lote_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lotemateriaprima',
+            index=models.Index(fields=['nota_fiscal'], name='lote_mp_nota_fiscal_idx'),
+        ),
+    ]
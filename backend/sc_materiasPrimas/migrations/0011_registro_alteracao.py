@@ -0,0 +1,92 @@
+# Generated by Django 5.2 on 2026-10-18 14:06
+
+import heapq
+
+import django.utils.timezone
+from django.db import migrations, models
+
+# recurso: (app, modelo)
+RECURSOS = {
+    "materia_prima": ("sc_materiasPrimas", "MateriaPrima"),
+    "lote_materia_prima": ("sc_materiasPrimas", "LoteMateriaPrima"),
+    "produto": ("sc_produtos", "Produto"),
+    "lote_producao": ("sc_producao", "LoteProducao"),
+}
+
+
+def alteracoes_existentes(apps, recurso):
+    """(instante, recurso, id, excluido) de cada objeto do recurso, por atualizado_em"""
+    app, modelo = RECURSOS[recurso]
+    for objeto_id, instante in (
+        apps.get_model(app, modelo)
+        .objects.order_by("atualizado_em", "pk")
+        .values_list("pk", "atualizado_em")
+        .iterator(chunk_size=2000)
+    ):
+        yield instante, recurso, objeto_id, False
+
+
+def popular_registro_alteracao(apps, schema_editor):
+    """
+    Cria o log a partir do estado atual: um registro por objeto existente
+    (atualizado_em) e por exclusão já registrada (excluido_em), na ordem em que
+    aconteceram, para que os cursores antigos (instantes) continuem valendo
+    """
+    RegistroAlteracao = apps.get_model("sc_materiasPrimas", "RegistroAlteracao")
+    RegistroExclusao = apps.get_model("sc_materiasPrimas", "RegistroExclusao")
+
+    fontes = [alteracoes_existentes(apps, recurso) for recurso in RECURSOS]
+    fontes.append(
+        (instante, recurso, objeto_id, True)
+        for recurso, objeto_id, instante in RegistroExclusao.objects.order_by(
+            "excluido_em", "pk"
+        )
+        .values_list("recurso", "objeto_id", "excluido_em")
+        .iterator(chunk_size=2000)
+    )
+
+    pendentes = []
+    for instante, recurso, objeto_id, excluido in heapq.merge(*fontes):
+        pendentes.append(
+            RegistroAlteracao(
+                recurso=recurso,
+                objeto_id=objeto_id,
+                excluido=excluido,
+                registrado_em=instante,
+            )
+        )
+        if len(pendentes) >= 2000:
+            RegistroAlteracao.objects.bulk_create(pendentes)
+            pendentes = []
+    if pendentes:
+        RegistroAlteracao.objects.bulk_create(pendentes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0010_genealogia_lotes'),
+        ('sc_producao', '0005_genealogia_lotes'),
+        ('sc_produtos', '0003_versao_formula'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroAlteracao',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('recurso', models.CharField(choices=[('materia_prima', 'Materia Prima'), ('lote_materia_prima', 'Lote Materia Prima'), ('produto', 'Produto'), ('lote_producao', 'Lote Producao')], max_length=30)),
+                ('objeto_id', models.IntegerField()),
+                ('excluido', models.BooleanField(default=False)),
+                ('registrado_em', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='registroalteracao',
+            index=models.Index(fields=['recurso', 'id'], name='registro_alteracao_idx'),
+        ),
+        migrations.RunPython(popular_registro_alteracao, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='RegistroExclusao',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0011_registro_alteracao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='execucaoreconciliacao',
+            name='ultimo_registro',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
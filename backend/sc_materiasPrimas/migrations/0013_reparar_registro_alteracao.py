@@ -0,0 +1,43 @@
+from django.db import migrations
+
+# recurso: (app, modelo)
+RECURSOS = {
+    "materia_prima": ("sc_materiasPrimas", "MateriaPrima"),
+    "lote_materia_prima": ("sc_materiasPrimas", "LoteMateriaPrima"),
+    "produto": ("sc_produtos", "Produto"),
+    "lote_producao": ("sc_producao", "LoteProducao"),
+}
+
+
+def reparar_registro_alteracao(apps, schema_editor):
+    """
+    A 0011 registrava todos os objetos existentes com o recurso lote_producao.
+    Cada objeto existente é registrado de novo com o recurso certo: na próxima
+    sincronização os clientes recebem uma vez todos os objetos.
+    """
+    RegistroAlteracao = apps.get_model("sc_materiasPrimas", "RegistroAlteracao")
+    for recurso, (app, modelo) in RECURSOS.items():
+        pendentes = []
+        for objeto_id in (
+            apps.get_model(app, modelo)
+            .objects.order_by("pk")
+            .values_list("pk", flat=True)
+            .iterator(chunk_size=2000)
+        ):
+            pendentes.append(RegistroAlteracao(recurso=recurso, objeto_id=objeto_id))
+            if len(pendentes) >= 2000:
+                RegistroAlteracao.objects.bulk_create(pendentes)
+                pendentes = []
+        if pendentes:
+            RegistroAlteracao.objects.bulk_create(pendentes)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0012_reconciliacao_ultimo_registro'),
+    ]
+
+    operations = [
+        migrations.RunPython(reparar_registro_alteracao, migrations.RunPython.noop),
+    ]
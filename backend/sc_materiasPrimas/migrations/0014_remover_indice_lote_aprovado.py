@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 14:26
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0013_reparar_registro_alteracao'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lotemateriaprima',
+            name='lote_mp_aprovado_validade_idx',
+        ),
+    ]
@@ -1,10 +1,31 @@
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Sum, Value, When
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
 from sc_fornecedores.models import Fornecedor
+from .unidade_trabalho import GravacaoParcialMixin
 
 
-class MateriaPrima(models.Model):
+CHAVE_CACHE_VALOR_ESTOQUE = "materias_primas:valor_estoque"
+
+
+def invalidar_cache_valor_estoque():
+    """Descarta a valoração do estoque em cache quando a transação atual confirmar"""
+    transaction.on_commit(lambda: cache.delete(CHAVE_CACHE_VALOR_ESTOQUE))
+
+
+def _converter_data(valor):
+    """Converte strings no formato YYYY-MM-DD em date (as views atribuem o JSON cru)"""
+    if isinstance(valor, str):
+        try:
+            return datetime.strptime(valor, "%Y-%m-%d").date()
+        except ValueError:
+            return None
+    return valor
+
+
+class MateriaPrima(GravacaoParcialMixin, models.Model):
     id = models.AutoField(primary_key=True)
     cod_interno = models.IntegerField(unique=True, default=0, auto_created=True)
     nome = models.CharField(max_length=255)
@@ -23,6 +44,9 @@ class MateriaPrima(models.Model):
     data_abertura_embalagem = models.DateField(
         null=True, blank=True
     )  # Data de abertura
+    # Validade considerando a abertura da embalagem. Mantida pelo save() para
+    # que filtros e ordenações por vencimento sejam feitos no banco.
+    data_validade_efetiva = models.DateField(null=True, blank=True, db_index=True)
 
     # Campos adicionados para o MVP
     quantidade_disponivel = models.FloatField(default=0)
@@ -38,129 +62,218 @@ class MateriaPrima(models.Model):
     _status_interno = models.CharField(
         max_length=50, default="disponível", db_column="status"
     )
+    # Data da última alteração (usada pelo GET condicional da API)
+    atualizado_em = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Listagens por status ordenadas/filtradas por vencimento
+            models.Index(
+                fields=["_status_interno", "data_validade_efetiva"],
+                name="materia_prima_status_idx",
+            ),
+            # Matérias primas de um fornecedor por vencimento
+            models.Index(
+                fields=["fornecedor", "data_validade_efetiva"],
+                name="materia_prima_fornecedor_idx",
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(quantidade_disponivel__gte=0),
+                name="materia_prima_quantidade_nao_negativa",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.nome} - Lote: {self.lote}"
 
-    def abrir_embalagem(self):
-        """Marca a embalagem como aberta e registra a data de abertura"""
+    def abrir_embalagem(self, unidade=None):
+        """
+        Marca a embalagem como aberta, registra a data de abertura e recalcula a
+        validade efetiva, gravando os três campos em um único UPDATE
+        """
         self.embalagem_aberta = True
         self.definir_data_abertura_embalagem()
         self.definir_data_validade_efetiva()
-        self.save()
+        self.gravar_campos(
+            ["embalagem_aberta", "data_abertura_embalagem", "data_validade_efetiva"],
+            unidade,
+        )
         return self.embalagem_aberta
 
     def definir_data_validade_efetiva(self):
-        """Define a data útil com base na validade regular ou do produto aberto"""
-        if self.embalagem_aberta and self.data_abertura_embalagem:
-            self.data_validade_efetiva = self.data_abertura_embalagem + timedelta(
-                days=self.dias_validade_apos_aberto
-            )
-        else:
-            self.data_validade_efetiva = self.data_validade
-        self.save()
+        """Define a data útil com base na validade ou na abertura (sem salvar)"""
+        self.data_validade_efetiva = self.calcular_data_validade_efetiva()
         return self.data_validade_efetiva
 
+    def calcular_data_validade_efetiva(self):
+        """Calcula a validade considerando abertura da embalagem (sem salvar)"""
+        data_validade = _converter_data(self.data_validade)
+
+        # Se não tiver data de validade, não há validade efetiva
+        if not data_validade:
+            return None
+
+        # Se não estiver aberto ou não tiver data de abertura, vale a validade original
+        data_abertura = _converter_data(self.data_abertura_embalagem)
+        if not self.embalagem_aberta or not data_abertura:
+            return data_validade
+
+        return data_abertura + timedelta(days=int(self.dias_validade_apos_aberto or 30))
+
     def definir_data_abertura_embalagem(self):
-        """Registra a data de abertura da embalagem como hoje"""
+        """Registra a data de abertura da embalagem como hoje (sem salvar)"""
         if not self.data_abertura_embalagem and self.embalagem_aberta:
             self.data_abertura_embalagem = timezone.now().date()
-            self.save()
         return self.data_abertura_embalagem
 
-    def verificar_validade(self):
-        """Verifica se a matéria prima está dentro do prazo de validade"""
+    def verificar_validade(self, unidade=None):
+        """
+        Verifica se a matéria prima está dentro do prazo de validade.
+        O status só é gravado quando muda.
+        """
         hoje = timezone.now().date()
-        data_referencia = (
-            self.data_validade_efetiva if self.embalagem_aberta else self.data_validade
-        )
+        data_referencia = self.calcular_data_validade_efetiva()
 
+        valida = True
         if data_referencia < hoje:
-            self.status = "vencido"
-            self.save()
-            return False
+            novo_status = "vencido"
+            valida = False
         elif (data_referencia - hoje).days <= 30:
-            self.status = "próximo ao vencimento"
-            self.save()
-        return True
+            novo_status = "próximo ao vencimento"
+        else:
+            novo_status = self.status
 
-    def atualizar_quantidade(self, quantidade_usada):
-        """Atualiza a quantidade disponível após uso"""
-        if quantidade_usada > self.quantidade_disponivel:
-            raise ValueError("Quantidade insuficiente em estoque")
+        if novo_status != self.status:
+            self.status = novo_status
+            self.gravar_campos(["_status_interno"], unidade)
+        return valida
 
-        self.quantidade_disponivel -= quantidade_usada
+    def atualizar_quantidade(self, quantidade_usada):
+        """
+        Atualiza a quantidade disponível após uso.
+        A baixa é um UPDATE condicional no banco, então consumos concorrentes
+        não conseguem deixar o estoque negativo.
+        """
+        if quantidade_usada <= 0:
+            raise ValueError("A quantidade deve ser maior que zero")
 
-        if self.quantidade_disponivel <= 0:
-            self.status = "esgotado"
+        atualizadas = MateriaPrima.objects.filter(
+            pk=self.pk, quantidade_disponivel__gte=quantidade_usada
+        ).update(
+            quantidade_disponivel=F("quantidade_disponivel") - quantidade_usada,
+            atualizado_em=timezone.now(),
+            _status_interno=Case(
+                When(
+                    quantidade_disponivel__lte=quantidade_usada,
+                    then=Value("esgotado"),
+                ),
+                default=F("_status_interno"),
+            ),
+        )
+        self.refresh_from_db(
+            fields=["quantidade_disponivel", "_status_interno", "atualizado_em"]
+        )
 
-        self.save()
+        if not atualizadas:
+            raise ValueError("Quantidade insuficiente em estoque")
+        RegistroAlteracao.registrar(RecursoSincronizadoEnum.MATERIA_PRIMA, [self.pk])
+        invalidar_cache_valor_estoque()
         return self.quantidade_disponivel
 
     def adicionar_estoque(self, quantidade):
-        """Adiciona quantidade ao estoque existente"""
+        """Adiciona quantidade ao estoque existente (incremento atômico no banco)"""
         if quantidade <= 0:
             raise ValueError("A quantidade deve ser maior que zero")
 
-        self.quantidade_disponivel += quantidade
-
-        if self.status == "esgotado":
-            self.status = "disponível"
-
-        self.save()
+        MateriaPrima.objects.filter(pk=self.pk).update(
+            quantidade_disponivel=F("quantidade_disponivel") + quantidade,
+            atualizado_em=timezone.now(),
+            _status_interno=Case(
+                When(_status_interno="esgotado", then=Value("disponível")),
+                default=F("_status_interno"),
+            ),
+        )
+        self.refresh_from_db(
+            fields=["quantidade_disponivel", "_status_interno", "atualizado_em"]
+        )
+        RegistroAlteracao.registrar(RecursoSincronizadoEnum.MATERIA_PRIMA, [self.pk])
+        invalidar_cache_valor_estoque()
         return self.quantidade_disponivel
 
-    def transferir_para_quarentena(self, motivo=""):
+    def transferir_para_quarentena(self, motivo="", unidade=None):
         """Transfere a matéria prima para quarentena"""
         self.status = "em quarentena"
-        self.save()
+        self.gravar_campos(["_status_interno"], unidade)
         return {"status": self.status, "motivo": motivo}
 
     def calcular_valor_em_estoque(self):
         """Calcula o valor total da matéria prima em estoque"""
         return self.quantidade_disponivel * self.preco_unitario
 
-    @property
-    def data_validade_efetiva(self):
-        """Retorna a data de validade considerando abertura da embalagem"""
-        import datetime
-
-        # Se não tiver data de validade, retorna None
-        if not self.data_validade:
-            return None
-
-        # Garantir que data_validade seja um objeto date
-        data_validade = self.data_validade
-        if isinstance(data_validade, str):
-            try:
-                data_validade = datetime.datetime.strptime(
-                    data_validade, "%Y-%m-%d"
-                ).date()
-            except ValueError:
-                return None
-
-        # Se não estiver aberto ou não tiver data de abertura, retorna a validade original
-        if not self.embalagem_aberta or not self.data_abertura_embalagem:
-            return data_validade
-
-        # Garantir que data_abertura seja objeto date
-        data_abertura = self.data_abertura_embalagem
-        if isinstance(data_abertura, str):
-            try:
-                data_abertura = datetime.datetime.strptime(
-                    data_abertura, "%Y-%m-%d"
-                ).date()
-            except ValueError:
-                return data_validade
+    @classmethod
+    def valor_estoque_agrupado(cls):
+        """
+        Valor total do estoque (quantidade x preço) agrupado por categoria,
+        fornecedor e localização. Calculado no banco em uma única consulta
+        e mantido em cache até a próxima alteração de quantidade ou preço.
+        """
+        resultado = cache.get(CHAVE_CACHE_VALOR_ESTOQUE)
+        if resultado is not None:
+            return resultado
+
+        grupos = cls.objects.values(
+            "categoria", "fornecedor_id", "fornecedor__razao_social", "localizacao"
+        ).annotate(
+            valor=Sum(
+                F("quantidade_disponivel") * F("preco_unitario"),
+                output_field=models.FloatField(),
+            ),
+            quantidade=Sum("quantidade_disponivel"),
+        )
 
-        # Calcular nova data
-        try:
-            return data_abertura + datetime.timedelta(
-                days=self.dias_validade_apos_aberto or 30
+        total = 0.0
+        por_categoria, por_fornecedor, por_localizacao = {}, {}, {}
+        for grupo in grupos:
+            valor = grupo["valor"] or 0.0
+            total += valor
+            for destino, chave, extra in (
+                (por_categoria, grupo["categoria"], {"categoria": grupo["categoria"]}),
+                (
+                    por_fornecedor,
+                    grupo["fornecedor_id"],
+                    {
+                        "fornecedor_id": grupo["fornecedor_id"],
+                        "razao_social": grupo["fornecedor__razao_social"],
+                    },
+                ),
+                (
+                    por_localizacao,
+                    grupo["localizacao"],
+                    {"localizacao": grupo["localizacao"]},
+                ),
+            ):
+                item = destino.setdefault(chave, {**extra, "valor": 0.0, "quantidade": 0.0})
+                item["valor"] += valor
+                item["quantidade"] += grupo["quantidade"] or 0.0
+
+        def ordenar(itens):
+            return sorted(
+                ({**i, "valor": round(i["valor"], 2)} for i in itens.values()),
+                key=lambda i: i["valor"],
+                reverse=True,
             )
-        except Exception as e:
-            print(f"Erro ao calcular data_validade_efetiva: {e}")
-            return data_validade  # Fallback para validade original
+
+        resultado = {
+            "valor_total": round(total, 2),
+            "por_categoria": ordenar(por_categoria),
+            "por_fornecedor": ordenar(por_fornecedor),
+            "por_localizacao": ordenar(por_localizacao),
+            "calculado_em": timezone.now().isoformat(),
+        }
+        cache.set(CHAVE_CACHE_VALOR_ESTOQUE, resultado, None)
+        return resultado
 
     @property
     def status(self):
@@ -182,7 +295,7 @@ class MateriaPrima(models.Model):
         hoje = timezone.now().date()
 
         # Determinar qual data de validade usar
-        data_validade = self.data_validade_efetiva
+        data_validade = self.calcular_data_validade_efetiva()
 
         if not data_validade:
             novo_status = "sem validade"
@@ -215,15 +328,91 @@ class MateriaPrima(models.Model):
         self._status_interno = novo_status
         return novo_status
 
+    # Status definidos manualmente que o recálculo automático não deve sobrescrever
+    STATUS_MANUAIS = ("em quarentena",)
+
+    @staticmethod
+    def expressao_status(hoje):
+        """Expressão SQL equivalente a calcular_status() para a data informada"""
+        return Case(
+            When(data_validade_efetiva__isnull=True, then=Value("sem validade")),
+            When(quantidade_disponivel__lte=0, then=Value("esgotado")),
+            When(data_validade_efetiva__lt=hoje, then=Value("vencido")),
+            When(
+                data_validade_efetiva__lte=hoje + timedelta(days=30),
+                then=Value("próximo ao vencimento"),
+            ),
+            default=Value("disponível"),
+            output_field=models.CharField(),
+        )
+
+    @classmethod
+    def recalcular_status_em_massa(cls, hoje=None):
+        """
+        Recalcula o status de todas as matérias primas em um único UPDATE,
+        alterando apenas as linhas cujo status realmente mudou.
+        Retorna a quantidade de linhas atualizadas.
+        """
+        if hoje is None:
+            hoje = timezone.localdate()
+
+        novo_status = cls.expressao_status(hoje)
+        alteradas = (
+            cls.objects.exclude(_status_interno__in=cls.STATUS_MANUAIS)
+            .alias(novo_status=novo_status)
+            .filter(~Q(_status_interno=F("novo_status")))
+        )
+        with transaction.atomic():
+            ids = list(alteradas.select_for_update().values_list("pk", flat=True))
+            if not ids:
+                return 0
+            RegistroAlteracao.registrar(RecursoSincronizadoEnum.MATERIA_PRIMA, ids)
+            return alteradas.filter(pk__in=ids).update(
+                _status_interno=novo_status, atualizado_em=timezone.now()
+            )
+
+    # Campos dos quais a validade efetiva depende
+    CAMPOS_VALIDADE_EFETIVA = (
+        "data_validade",
+        "embalagem_aberta",
+        "data_abertura_embalagem",
+        "dias_validade_apos_aberto",
+    )
+
+    # Campos que entram na valoração do estoque em cache
+    CAMPOS_VALOR_ESTOQUE = (
+        "quantidade_disponivel",
+        "preco_unitario",
+        "categoria",
+        "localizacao",
+        "fornecedor",
+    )
+
     def save(self, *args, **kwargs):
         """Sobrescreve método save para recalcular status se necessário"""
         # Calcular o status antes de salvar
         # Descomente se desejar atualizar o status automaticamente
         # self.calcular_status()
+
+        # Manter a validade efetiva sincronizada com os campos de origem
+        self.data_validade_efetiva = self.calcular_data_validade_efetiva()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            update_fields = set(update_fields) | {"atualizado_em"}
+            if update_fields & set(self.CAMPOS_VALIDADE_EFETIVA):
+                update_fields.add("data_validade_efetiva")
+            kwargs["update_fields"] = update_fields
         super().save(*args, **kwargs)
+        if update_fields is None or update_fields & set(self.CAMPOS_VALOR_ESTOQUE):
+            invalidar_cache_valor_estoque()
 
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        invalidar_cache_valor_estoque()
+        return resultado
 
-class LoteMateriaPrima(models.Model):
+
+class LoteMateriaPrima(GravacaoParcialMixin, models.Model):
     """
     Modelo para gerenciar lotes específicos de matérias-primas
     Permite rastrear informações mais detalhadas sobre cada lote recebido
@@ -264,21 +453,58 @@ class LoteMateriaPrima(models.Model):
         null=True,
         default=None,
     )
+    atualizado_em = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = "Lote de Matéria Prima"
         verbose_name_plural = "Lotes de Matérias Primas"
         unique_together = ["materia_prima", "numero_lote"]
+        indexes = [
+            # Alocação FEFO e lotes de uma matéria prima por ordem de vencimento
+            # (aprovados ou não: um índice parcial só dos aprovados duplicaria este)
+            models.Index(
+                fields=["materia_prima", "data_validade"],
+                name="lote_mp_validade_idx",
+            ),
+            # Calendário de vencimento e filtro vence_antes (sem matéria prima)
+            models.Index(fields=["data_validade"], name="lote_mp_data_validade_idx"),
+            # Consulta pelo código de rastreabilidade
+            models.Index(
+                fields=["codigo_rastreabilidade"],
+                name="lote_mp_rastreabilidade_idx",
+            ),
+            # Recall por número de lote ou nota fiscal do fornecedor
+            models.Index(fields=["numero_lote"], name="lote_mp_numero_lote_idx"),
+            models.Index(fields=["nota_fiscal"], name="lote_mp_nota_fiscal_idx"),
+        ]
+        constraints = [
+            models.CheckConstraint(
+                condition=Q(quant_disponivel_kg__gte=0),
+                name="lote_mp_quant_disponivel_nao_negativa",
+            ),
+            models.CheckConstraint(
+                condition=Q(quant_recebida_kg__gte=0),
+                name="lote_mp_quant_recebida_nao_negativa",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.materia_prima.nome} - Lote: {self.numero_lote}"
 
-    def abrir_embalagem(self):
+    def marcar_embalagem_aberta(self):
+        """
+        Registra a abertura da embalagem original apenas em memória.
+        Retorna os campos alterados (vazio se já estava aberta).
+        """
+        if self.embalagem_original_aberta:
+            return []
+        self.embalagem_original_aberta = True
+        self.data_abertura_embalagem = timezone.now().date()
+        return ["embalagem_original_aberta", "data_abertura_embalagem"]
+
+    def abrir_embalagem(self, unidade=None):
         """Registra a abertura da embalagem original"""
-        if not self.embalagem_original_aberta:
-            self.embalagem_original_aberta = True
-            self.data_abertura_embalagem = timezone.now().date()
-            self.save()
+        self.gravar_campos(self.marcar_embalagem_aberta(), unidade)
         return self.embalagem_original_aberta
 
     def calcular_dias_ate_vencimento(self):
@@ -287,26 +513,60 @@ class LoteMateriaPrima(models.Model):
         return (self.data_validade - hoje).days
 
     def consumir_quantidade(self, quantidade):
-        """Remove uma quantidade do lote e atualiza o disponível"""
-        if quantidade > self.quant_disponivel_kg:
+        """
+        Remove uma quantidade do lote e atualiza o disponível.
+        A baixa é um UPDATE condicional no banco, então consumos concorrentes
+        não conseguem consumir mais do que o lote possui.
+        """
+        if quantidade <= 0:
+            raise ValueError("A quantidade deve ser maior que zero")
+
+        atualizados = LoteMateriaPrima.objects.filter(
+            pk=self.pk, quant_disponivel_kg__gte=quantidade
+        ).update(
+            quant_disponivel_kg=F("quant_disponivel_kg") - quantidade,
+            atualizado_em=timezone.now(),
+        )
+        self.refresh_from_db(fields=["quant_disponivel_kg", "atualizado_em"])
+
+        if not atualizados:
             raise ValueError(
                 f"Quantidade insuficiente no lote. Disponível: {self.quant_disponivel_kg}kg"
             )
-
-        self.quant_disponivel_kg -= quantidade
-        self.save()
+        RegistroAlteracao.registrar(RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA, [self.pk])
         return self.quant_disponivel_kg
 
     def adicionar_quantidade(self, quantidade):
-        """Adiciona uma quantidade ao lote"""
+        """Adiciona uma quantidade ao lote (incremento atômico no banco)"""
         if quantidade <= 0:
             raise ValueError("A quantidade deve ser maior que zero")
 
-        self.quant_disponivel_kg += quantidade
-        self.quant_recebida_kg += quantidade
-        self.save()
+        LoteMateriaPrima.objects.filter(pk=self.pk).update(
+            quant_disponivel_kg=F("quant_disponivel_kg") + quantidade,
+            quant_recebida_kg=F("quant_recebida_kg") + quantidade,
+            atualizado_em=timezone.now(),
+        )
+        self.refresh_from_db(
+            fields=["quant_disponivel_kg", "quant_recebida_kg", "atualizado_em"]
+        )
+        RegistroAlteracao.registrar(RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA, [self.pk])
         return self.quant_disponivel_kg
 
+    @staticmethod
+    def expressao_status(hoje):
+        """Expressão SQL equivalente à propriedade status para a data informada"""
+        return Case(
+            When(data_validade__lt=hoje, then=Value("vencido")),
+            When(quant_disponivel_kg__lte=0, then=Value("esgotado")),
+            When(
+                data_validade__lte=hoje + timedelta(days=30),
+                then=Value("próximo ao vencimento"),
+            ),
+            When(aprovado_controle_qualidade=False, then=Value("aguardando aprovação")),
+            default=Value("disponível"),
+            output_field=models.CharField(),
+        )
+
     @property
     def status(self):
         """Retorna o status atual do lote baseado na validade e quantidade"""
@@ -326,3 +586,288 @@ class LoteMateriaPrima(models.Model):
             return "aguardando aprovação"
 
         return "disponível"
+
+
+class UnidadeMedidaEnum(models.TextChoices):
+    KG = "kg", "Quilograma (kg)"
+    G = "g", "Grama (g)"
+    L = "l", "Litro (l)"
+    ML = "ml", "Mililitro (ml)"
+    UNIDADE = "unidade", "Unidade"
+
+
+class TipoMovimentacaoEnum(models.TextChoices):
+    RECEBIMENTO = "recebimento"
+    CONSUMO = "consumo"
+    AJUSTE = "ajuste"
+    EXCLUSAO_LOTE = "exclusão de lote"
+    RECONCILIACAO = "reconciliação"
+
+
+class MovimentacaoEstoque(models.Model):
+    """
+    Registro imutável (append-only) de cada movimentação de estoque.
+    quantidade_kg é assinada: positiva para entradas e negativa para saídas.
+    As referências não usam constraint no banco para que o histórico
+    sobreviva à exclusão do lote ou da matéria prima.
+    """
+
+    materia_prima = models.ForeignKey(
+        MateriaPrima,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="movimentacoes",
+    )
+    lote = models.ForeignKey(
+        LoteMateriaPrima,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="movimentacoes",
+        null=True,
+        blank=True,
+    )
+    tipo = models.CharField(max_length=20, choices=TipoMovimentacaoEnum.choices)
+    quantidade_kg = models.FloatField()
+    data_hora = models.DateTimeField(default=timezone.now)
+    observacao = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        verbose_name = "Movimentação de Estoque"
+        verbose_name_plural = "Movimentações de Estoque"
+        indexes = [
+            models.Index(fields=["data_hora"], name="mov_estoque_data_hora_idx"),
+            models.Index(fields=["lote", "data_hora"], name="mov_estoque_lote_data_idx"),
+            models.Index(
+                fields=["materia_prima", "data_hora"], name="mov_estoque_mp_data_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} de {self.quantidade_kg}kg em {self.data_hora:%d/%m/%Y %H:%M}"
+
+    @classmethod
+    def registrar(cls, tipo, quantidade_kg, materia_prima_id, lote_id=None, observacao=""):
+        """Grava uma movimentação (deve ser chamado dentro da mesma transação da alteração)"""
+        return cls.objects.create(
+            tipo=tipo,
+            quantidade_kg=quantidade_kg,
+            materia_prima_id=materia_prima_id,
+            lote_id=lote_id,
+            observacao=observacao[:255],
+        )
+
+    def save(self, *args, **kwargs):
+        """Movimentações só podem ser inseridas, nunca alteradas"""
+        if not self._state.adding:
+            raise ValueError("Movimentações de estoque não podem ser alteradas")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Movimentações de estoque não podem ser excluídas")
+
+
+def _inicio_do_dia(data):
+    """Primeiro instante da data no fuso do projeto"""
+    return timezone.make_aware(datetime.combine(data, datetime.min.time()))
+
+
+class SaldoLote(models.Model):
+    """
+    Fotografia do saldo de um lote ao final de um dia.
+    O saldo em qualquer data é a última fotografia anterior somada às
+    movimentações posteriores a ela, sem percorrer todo o histórico.
+    """
+
+    lote = models.ForeignKey(
+        LoteMateriaPrima,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="saldos",
+    )
+    materia_prima = models.ForeignKey(
+        MateriaPrima,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="saldos_lotes",
+    )
+    data = models.DateField()
+    saldo_kg = models.FloatField()
+
+    class Meta:
+        verbose_name = "Saldo de Lote"
+        verbose_name_plural = "Saldos de Lotes"
+        constraints = [
+            models.UniqueConstraint(fields=["lote", "data"], name="saldo_lote_data_unico")
+        ]
+
+    def __str__(self):
+        return f"Lote {self.lote_id} em {self.data:%d/%m/%Y}: {self.saldo_kg}kg"
+
+    @classmethod
+    def saldo_em(cls, lote_id, data):
+        """Saldo do lote ao final da data informada"""
+        fotografia = (
+            cls.objects.filter(lote_id=lote_id, data__lte=data).order_by("-data").first()
+        )
+
+        movimentacoes = MovimentacaoEstoque.objects.filter(
+            lote_id=lote_id, data_hora__lt=_inicio_do_dia(data + timedelta(days=1))
+        )
+        saldo = 0.0
+        if fotografia:
+            saldo = fotografia.saldo_kg
+            movimentacoes = movimentacoes.filter(
+                data_hora__gte=_inicio_do_dia(fotografia.data + timedelta(days=1))
+            )
+
+        delta = movimentacoes.aggregate(total=models.Sum("quantidade_kg"))["total"]
+        return saldo + (delta or 0.0)
+
+    @classmethod
+    def gerar_fotografias(cls, data):
+        """
+        Grava o saldo ao final da data para os lotes que tiveram movimentação
+        desde a fotografia anterior. Deve ser executado em ordem cronológica.
+        Retorna a quantidade de fotografias gravadas.
+        """
+        if data >= timezone.localdate():
+            raise ValueError("Só é possível fotografar o saldo de dias já encerrados")
+
+        anterior = cls.objects.filter(data__lt=data).aggregate(models.Max("data"))[
+            "data__max"
+        ]
+
+        movimentacoes = MovimentacaoEstoque.objects.filter(
+            lote__isnull=False,
+            data_hora__lt=_inicio_do_dia(data + timedelta(days=1)),
+        )
+        if anterior:
+            movimentacoes = movimentacoes.filter(
+                data_hora__gte=_inicio_do_dia(anterior + timedelta(days=1))
+            )
+        deltas = movimentacoes.values("lote_id", "materia_prima_id").annotate(
+            total=models.Sum("quantidade_kg")
+        )
+
+        deltas = list(deltas)
+        if not deltas:
+            return 0
+
+        # Última fotografia de cada lote envolvido, em uma única consulta
+        saldos_anteriores = {}
+        if anterior:
+            ultima_data = (
+                cls.objects.filter(
+                    lote_id=models.OuterRef("lote_id"), data__lte=anterior
+                )
+                .order_by("-data")
+                .values("data")[:1]
+            )
+            saldos_anteriores = dict(
+                cls.objects.filter(
+                    lote_id__in=[d["lote_id"] for d in deltas],
+                    data=models.Subquery(ultima_data),
+                ).values_list("lote_id", "saldo_kg")
+            )
+
+        fotografias = [
+            cls(
+                lote_id=d["lote_id"],
+                materia_prima_id=d["materia_prima_id"],
+                data=data,
+                saldo_kg=saldos_anteriores.get(d["lote_id"], 0.0) + d["total"],
+            )
+            for d in deltas
+        ]
+        cls.objects.bulk_create(
+            fotografias,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["lote", "data"],
+            update_fields=["saldo_kg", "materia_prima"],
+        )
+        return len(fotografias)
+
+
+class RecursoSincronizadoEnum(models.TextChoices):
+    MATERIA_PRIMA = "materia_prima"
+    LOTE_MATERIA_PRIMA = "lote_materia_prima"
+    PRODUTO = "produto"
+    LOTE_PRODUCAO = "lote_producao"
+
+
+# Chave do advisory lock (PostgreSQL) que ordena as gravações no log de alterações
+CHAVE_BLOQUEIO_ALTERACOES = 7_311_201
+
+
+class RegistroAlteracao(models.Model):
+    """
+    Log das alterações e exclusões dos recursos sincronizados. O id é o cursor
+    da sincronização incremental (?since=): as gravações no log são
+    serializadas até o commit, então os ids ficam na ordem de commit e um
+    cliente nunca avança o cursor para além de uma alteração ainda não
+    confirmada.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    recurso = models.CharField(max_length=30, choices=RecursoSincronizadoEnum.choices)
+    objeto_id = models.IntegerField()
+    excluido = models.BooleanField(default=False)
+    registrado_em = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["recurso", "id"], name="registro_alteracao_idx"),
+        ]
+
+    @classmethod
+    def registrar(cls, recurso, ids, excluido=False):
+        """
+        Registra a alteração (ou exclusão) dos objetos do recurso. Deve ser
+        chamado na mesma transação da alteração.
+        """
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return
+        with transaction.atomic():
+            conexao = transaction.get_connection()
+            # No SQLite só há um escritor por vez; no PostgreSQL a sequência não
+            # segue a ordem de commit, então o bloqueio vai até o fim da transação
+            if conexao.vendor == "postgresql":
+                with conexao.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT pg_advisory_xact_lock(%s)", [CHAVE_BLOQUEIO_ALTERACOES]
+                    )
+            agora = timezone.now()
+            cls.objects.bulk_create(
+                [
+                    cls(recurso=recurso, objeto_id=pk, excluido=excluido, registrado_em=agora)
+                    for pk in ids
+                ],
+                batch_size=500,
+            )
+
+    @classmethod
+    def ultimo(cls):
+        """Id do último registro (cursor atual), ou 0 com o log vazio"""
+        return cls.objects.aggregate(ultimo=models.Max("id"))["ultimo"] or 0
+
+
+class ExecucaoReconciliacao(models.Model):
+    """
+    Histórico das reconciliações do estoque das matérias primas com o saldo
+    dos lotes. O último registro do log de alterações lido pela execução é o
+    ponto de partida da próxima execução incremental.
+    """
+
+    iniciada_em = models.DateTimeField(db_index=True)
+    incremental = models.BooleanField(default=False)
+    materias_verificadas = models.IntegerField(null=True, blank=True)
+    divergencias = models.IntegerField(default=0)
+    corrigidas = models.IntegerField(default=0)
+    # Id de RegistroAlteracao no início da execução
+    ultimo_registro = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Execução de Reconciliação"
+        verbose_name_plural = "Execuções de Reconciliação"
@@ -0,0 +1,187 @@
+"""
+Reconciliação do estoque das matérias primas (quantidade_disponivel) com a soma
+do saldo dos seus lotes (quant_disponivel_kg).
+
+As divergências de todas as matérias primas saem de uma única consulta agrupada.
+No modo incremental só são verificadas as matérias primas alteradas desde a
+execução anterior (a própria matéria prima ou algum lote), lidas do log de
+alterações a partir do id registrado por ela. A correção só é feita quando
+pedida (corrigir=True): ajustes legítimos na matéria prima também aparecem como
+divergência e precisam ser avaliados antes.
+Matérias primas sem nenhum lote não são reconciliadas: o estoque delas é
+controlado apenas pela quantidade informada no cadastro.
+"""
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import LessThanOrEqual
+from django.utils import timezone
+
+from .models import (
+    ExecucaoReconciliacao,
+    LoteMateriaPrima,
+    MateriaPrima,
+    MovimentacaoEstoque,
+    RecursoSincronizadoEnum,
+    RegistroAlteracao,
+    TipoMovimentacaoEnum,
+    invalidar_cache_valor_estoque,
+)
+
+# Precisão do relatório (gramas). Diferenças menores que a última casa exibida
+# são ruído de arredondamento de float e não contam como divergência
+CASAS_DECIMAIS_KG = 3
+TOLERANCIA_KG = 10**-CASAS_DECIMAIS_KG
+
+# Matérias primas corrigidas por UPDATE (limite de parâmetros do SQLite)
+BLOCO_CORRECAO = 500
+
+
+def _materias_alteradas_desde(registro_id):
+    """
+    IDs das matérias primas alteradas depois do registro do log (uma consulta).
+    Toda movimentação altera a matéria prima ou o lote, então também aparece.
+    """
+    alteracoes = RegistroAlteracao.objects.filter(id__gt=registro_id, excluido=False)
+    return set(
+        alteracoes.filter(recurso=RecursoSincronizadoEnum.MATERIA_PRIMA)
+        .values_list("objeto_id", flat=True)
+        .union(
+            LoteMateriaPrima.objects.filter(
+                pk__in=alteracoes.filter(
+                    recurso=RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA
+                ).values("objeto_id")
+            ).values_list("materia_prima_id", flat=True)
+        )
+    )
+
+
+def divergencias(materias_primas=None):
+    """
+    Matérias primas cujo estoque difere da soma dos lotes, calculadas no banco
+    em uma consulta agrupada. materias_primas restringe a verificação a esses IDs.
+    """
+    consulta = MateriaPrima.objects.all()
+    if materias_primas is not None:
+        consulta = consulta.filter(pk__in=materias_primas)
+
+    return list(
+        consulta.annotate(total_lotes=Sum("lotes__quant_disponivel_kg"))
+        .filter(total_lotes__isnull=False)
+        .annotate(diferenca_kg=F("quantidade_disponivel") - F("total_lotes"))
+        .filter(Q(diferenca_kg__gt=TOLERANCIA_KG) | Q(diferenca_kg__lt=-TOLERANCIA_KG))
+        .order_by("id")
+        .values("id", "nome", "quantidade_disponivel", "total_lotes", "diferenca_kg")
+    )
+
+
+def _corrigir(ids):
+    """
+    Iguala o estoque das matérias primas à soma dos lotes e registra o ajuste.
+    Lotes e matérias primas ficam travados (na ordem do lançamento da produção)
+    e a divergência é lida de novo, então a movimentação registra exatamente a
+    diferença aplicada. Retorna as divergências corrigidas.
+    """
+    soma_lotes = Coalesce(
+        Subquery(
+            LoteMateriaPrima.objects.filter(materia_prima=OuterRef("pk"))
+            .order_by()
+            .values("materia_prima")
+            .annotate(total=Sum("quant_disponivel_kg"))
+            .values("total")
+        ),
+        Value(0.0),
+        output_field=FloatField(),
+    )
+
+    corrigidas = []
+    with transaction.atomic():
+        for inicio in range(0, len(ids), BLOCO_CORRECAO):
+            bloco = ids[inicio : inicio + BLOCO_CORRECAO]
+            list(
+                LoteMateriaPrima.objects.select_for_update()
+                .filter(materia_prima_id__in=bloco)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            list(
+                MateriaPrima.objects.select_for_update()
+                .filter(pk__in=bloco)
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            encontradas = divergencias(bloco)
+            if not encontradas:
+                continue
+            MateriaPrima.objects.filter(pk__in=[item["id"] for item in encontradas]).update(
+                quantidade_disponivel=soma_lotes,
+                _status_interno=Case(
+                    When(LessThanOrEqual(soma_lotes, 0), then=Value("esgotado")),
+                    When(_status_interno="esgotado", then=Value("disponível")),
+                    default=F("_status_interno"),
+                ),
+                atualizado_em=timezone.now(),
+            )
+            corrigidas.extend(encontradas)
+
+        if corrigidas:
+            RegistroAlteracao.registrar(
+                RecursoSincronizadoEnum.MATERIA_PRIMA, [item["id"] for item in corrigidas]
+            )
+            invalidar_cache_valor_estoque()
+            MovimentacaoEstoque.objects.bulk_create(
+                [
+                    MovimentacaoEstoque(
+                        tipo=TipoMovimentacaoEnum.RECONCILIACAO,
+                        quantidade_kg=-item["diferenca_kg"],
+                        materia_prima_id=item["id"],
+                        observacao="Estoque igualado à soma dos lotes",
+                    )
+                    for item in corrigidas
+                ],
+                batch_size=500,
+            )
+    return corrigidas
+
+
+def reconciliar(incremental=False, corrigir=False):
+    """
+    Verifica (e, com corrigir=True, corrige) as divergências e registra a execução.
+    No modo incremental, sem execução anterior, todas as matérias primas são
+    verificadas.
+    """
+    iniciada_em = timezone.now()
+    # Lido antes das divergências: o que mudar durante a execução fica para a próxima
+    ultimo_registro = RegistroAlteracao.ultimo()
+
+    materias_primas = None
+    if incremental:
+        anterior = ExecucaoReconciliacao.objects.order_by("-iniciada_em").first()
+        if anterior is not None and anterior.ultimo_registro is not None:
+            materias_primas = _materias_alteradas_desde(anterior.ultimo_registro)
+
+    encontradas = divergencias(materias_primas) if materias_primas != set() else []
+    corrigidas = 0
+    if corrigir and encontradas:
+        encontradas = _corrigir([item["id"] for item in encontradas])
+        corrigidas = len(encontradas)
+
+    ExecucaoReconciliacao.objects.create(
+        iniciada_em=iniciada_em,
+        incremental=materias_primas is not None,
+        materias_verificadas=(
+            len(materias_primas) if materias_primas is not None else None
+        ),
+        divergencias=len(encontradas),
+        corrigidas=corrigidas,
+        ultimo_registro=ultimo_registro,
+    )
+    return {
+        "incremental": materias_primas is not None,
+        "materias_verificadas": (
+            len(materias_primas) if materias_primas is not None else None
+        ),
+        "divergencias": encontradas,
+        "corrigidas": corrigidas,
+    }
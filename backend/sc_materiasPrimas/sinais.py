@@ -0,0 +1,126 @@
+"""
+Registro das alterações dos recursos sincronizados (ver sincronizacao.py).
+
+save() e delete() são registrados pelos sinais; as gravações em massa
+(queryset.update, bulk_create, bulk_update) chamam registrar_alteracoes.
+Quando muda um campo copiado na representação de outro recurso (o nome da
+matéria prima no lote, por exemplo), os objetos dependentes também são
+registrados, para que os clientes não fiquem com o valor antigo.
+"""
+
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import RecursoSincronizadoEnum, RegistroAlteracao
+
+# Modelo de cada recurso sincronizado
+MODELOS = {
+    RecursoSincronizadoEnum.MATERIA_PRIMA: "sc_materiasPrimas.MateriaPrima",
+    RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA: "sc_materiasPrimas.LoteMateriaPrima",
+    RecursoSincronizadoEnum.PRODUTO: "sc_produtos.Produto",
+    RecursoSincronizadoEnum.LOTE_PRODUCAO: "sc_producao.LoteProducao",
+}
+
+# modelo: (campos copiados em outros recursos, [(recurso dependente, caminho
+# do modelo dependente até este)])
+DEPENDENCIAS = {
+    "sc_materiasPrimas.MateriaPrima": (
+        ("nome",),
+        [
+            (RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA, "materia_prima"),
+            (
+                RecursoSincronizadoEnum.LOTE_PRODUCAO,
+                "materias_consumidas__lote_materia_prima__materia_prima",
+            ),
+        ],
+    ),
+    "sc_materiasPrimas.LoteMateriaPrima": (
+        ("numero_lote", "materia_prima_id"),
+        [(RecursoSincronizadoEnum.LOTE_PRODUCAO, "materias_consumidas__lote_materia_prima")],
+    ),
+    "sc_fornecedores.Fornecedor": (
+        ("razao_social",),
+        [(RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA, "fornecedor")],
+    ),
+    "sc_produtos.Produto": (
+        ("nome",),
+        [(RecursoSincronizadoEnum.LOTE_PRODUCAO, "produto")],
+    ),
+    "sc_produtos.Formula": (
+        ("forma_farmaceutica", "quant_unid_padrao", "quant_kg_padrao"),
+        [(RecursoSincronizadoEnum.PRODUTO, "formula")],
+    ),
+}
+
+
+def _recurso(modelo):
+    rotulo = modelo._meta.label
+    for recurso, modelo_sincronizado in MODELOS.items():
+        if modelo_sincronizado == rotulo:
+            return recurso
+    return None
+
+
+def registrar_alteracoes(modelo, ids):
+    """Registra a alteração dos objetos gravados sem save() (gravações em massa)"""
+    recurso = _recurso(modelo)
+    if recurso is not None:
+        RegistroAlteracao.registrar(recurso, ids)
+
+
+def objeto_salvo(sender, instance, raw=False, **kwargs):
+    if not raw:
+        RegistroAlteracao.registrar(_recurso(sender), [instance.pk])
+
+
+def objeto_excluido(sender, instance, **kwargs):
+    RegistroAlteracao.registrar(_recurso(sender), [instance.pk], excluido=True)
+
+
+def verificar_dependencias(sender, instance, update_fields=None, raw=False, **kwargs):
+    """Antes de gravar, verifica se algum campo copiado em outros recursos mudou"""
+    instance._sincronizar_dependentes = False
+    campos = DEPENDENCIAS[sender._meta.label][0]
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    # update_fields traz o nome do campo (materia_prima), não a coluna (materia_prima_id)
+    nomes = {campo.removesuffix("_id") for campo in campos}
+    if update_fields is not None and not set(update_fields) & nomes:
+        return
+    anterior = sender.objects.filter(pk=instance.pk).values(*campos).first()
+    instance._sincronizar_dependentes = anterior is not None and any(
+        anterior[campo] != getattr(instance, campo) for campo in campos
+    )
+
+
+def registrar_dependentes(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, "_sincronizar_dependentes", False):
+        return
+    for recurso, caminho in DEPENDENCIAS[sender._meta.label][1]:
+        modelo = apps.get_model(MODELOS[recurso])
+        RegistroAlteracao.registrar(
+            recurso,
+            modelo.objects.filter(**{caminho: instance.pk})
+            .order_by()
+            .values_list("pk", flat=True)
+            .distinct(),
+        )
+    instance._sincronizar_dependentes = False
+
+
+def conectar():
+    """Conecta os sinais apenas aos modelos sincronizados e às dependências"""
+    for rotulo in MODELOS.values():
+        modelo = apps.get_model(rotulo)
+        post_save.connect(objeto_salvo, sender=modelo, dispatch_uid=f"sinc_{rotulo}")
+        post_delete.connect(
+            objeto_excluido, sender=modelo, dispatch_uid=f"sinc_excluido_{rotulo}"
+        )
+    for rotulo in DEPENDENCIAS:
+        modelo = apps.get_model(rotulo)
+        pre_save.connect(
+            verificar_dependencias, sender=modelo, dispatch_uid=f"sinc_dep_{rotulo}"
+        )
+        post_save.connect(
+            registrar_dependentes, sender=modelo, dispatch_uid=f"sinc_dep_salvo_{rotulo}"
+        )
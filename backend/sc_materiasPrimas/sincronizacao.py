@@ -0,0 +1,93 @@
+"""
+Sincronização incremental dos clientes (tablets do chão de fábrica).
+O cursor é o id do último registro lido do log de alterações (RegistroAlteracao).
+Os ids seguem a ordem de commit, então uma alteração confirmada depois de uma
+sincronização sempre tem id maior que o cursor devolvido a ela. Uma
+sincronização sem alterações custa uma leitura do índice (recurso, id).
+"""
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import RegistroAlteracao
+
+# Registros do log lidos por resposta; com "mais": true o cliente repete a
+# chamada com o novo cursor
+LIMITE_ALTERACOES = 2000
+
+
+def _ler_cursor(since):
+    """
+    Id do log a partir do cursor recebido. Cursores antigos (data e hora ISO
+    8601) continuam do último registro gravado até aquele instante.
+    Retorna None se o cursor for inválido.
+    """
+    if since.isdigit():
+        return int(since)
+    instante = parse_datetime(since)
+    if instante is None:
+        return None
+    if timezone.is_naive(instante):
+        instante = timezone.make_aware(instante)
+    return (
+        RegistroAlteracao.objects.filter(registrado_em__lte=instante)
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+        or 0
+    )
+
+
+def resposta_alteracoes(request, queryset, recurso, serializar):
+    """
+    Responde com os objetos do recurso criados ou alterados e os IDs excluídos
+    depois de ?since= (o "cursor" devolvido pela sincronização anterior).
+    Sem ?since= devolve todos os objetos, para a carga inicial.
+    """
+    since = request.GET.get("since")
+    if not since:
+        # O cursor é lido antes dos objetos: o que mudar no meio volta na próxima
+        cursor = RegistroAlteracao.ultimo()
+        return JsonResponse(
+            {
+                "cursor": str(cursor),
+                "alterados": [serializar(obj) for obj in queryset.order_by("pk")],
+                "excluidos": [],
+                "mais": False,
+            },
+            encoder=DjangoJSONEncoder,
+        )
+
+    cursor = _ler_cursor(since)
+    if cursor is None:
+        return JsonResponse(
+            {"error": "O parâmetro since deve ser o cursor devolvido pela sincronização"},
+            status=400,
+        )
+
+    registros = list(
+        RegistroAlteracao.objects.filter(recurso=recurso, id__gt=cursor)
+        .order_by("id")
+        .values_list("id", "objeto_id", "excluido")[:LIMITE_ALTERACOES]
+    )
+    # Vale o último registro de cada objeto
+    ultimo = {}
+    for registro_id, objeto_id, excluido in registros:
+        ultimo.pop(objeto_id, None)
+        ultimo[objeto_id] = excluido
+    if registros:
+        cursor = registros[-1][0]
+
+    objetos = queryset.in_bulk([i for i, excluido in ultimo.items() if not excluido])
+    return JsonResponse(
+        {
+            "cursor": str(cursor),
+            "alterados": [serializar(objetos[i]) for i in ultimo if i in objetos],
+            # Objetos que não existem mais, mesmo que a exclusão venha na próxima página
+            "excluidos": [i for i in ultimo if i not in objetos],
+            "mais": len(registros) == LIMITE_ALTERACOES,
+        },
+        encoder=DjangoJSONEncoder,
+    )
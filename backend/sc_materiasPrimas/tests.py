@@ -1,3 +1,506 @@
-from django.test import TestCase
+import json
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from sc_fornecedores.models import Fornecedor
+from .models import (
+    ExecucaoReconciliacao,
+    LoteMateriaPrima,
+    MateriaPrima,
+    MovimentacaoEstoque,
+    RegistroAlteracao,
+    TipoMovimentacaoEnum,
+)
+from .reconciliacao import reconciliar
+from .unidade_trabalho import UnidadeDeTrabalho
+
+
+def criar_materia_prima(fornecedor, quantidade=10.0, **campos):
+    campos.setdefault("cod_interno", MateriaPrima.objects.count() + 1)
+    return MateriaPrima.objects.create(
+        nome=campos.pop("nome", "Vitamina C"),
+        fornecedor=fornecedor,
+        data_validade=campos.pop("data_validade", date.today() + timedelta(days=365)),
+        quantidade_disponivel=quantidade,
+        **campos,
+    )
+
+
+def criar_lote(materia_prima, quantidade=10.0, **campos):
+    return LoteMateriaPrima.objects.create(
+        materia_prima=materia_prima,
+        numero_lote=campos.pop("numero_lote", f"L{LoteMateriaPrima.objects.count() + 1}"),
+        data_validade=campos.pop("data_validade", date.today() + timedelta(days=365)),
+        quant_recebida_kg=quantidade,
+        quant_disponivel_kg=quantidade,
+        **campos,
+    )
+
+
+def durante_requisicao(acao):
+    """
+    Executa a ação depois da leitura inicial da view e antes da gravação (na
+    leitura do corpo da requisição), como uma transação concorrente
+    """
+    carregar = json.loads
+
+    def carregar_depois_da_acao(*args, **kwargs):
+        acao()
+        return carregar(*args, **kwargs)
+
+    return mock.patch("sc_materiasPrimas.views.json.loads", side_effect=carregar_depois_da_acao)
+
+
+class EdicaoSemPerdaDeAtualizacaoTests(TestCase):
+    """As edições de lote e matéria prima não desfazem consumos concorrentes"""
+
+    def setUp(self):
+        self.fornecedor = Fornecedor.objects.create(
+            cnpj="00.000.000/0001-00", razao_social="Fornecedor", fantasia="F"
+        )
+        self.materia_prima = criar_materia_prima(self.fornecedor, quantidade=10.0)
+        self.lote = criar_lote(self.materia_prima, quantidade=10.0)
+
+    def _put(self, url, dados):
+        return self.client.put(url, json.dumps(dados), content_type="application/json")
+
+    def test_edicao_do_lote_mantem_consumo_concorrente(self):
+        with durante_requisicao(lambda: self.lote.consumir_quantidade(4.0)):
+            resposta = self._put(
+                f"/api/lotes/{self.lote.pk}/", {"observacoes": "Reetiquetado"}
+            )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.lote.refresh_from_db()
+        self.assertEqual(self.lote.quant_disponivel_kg, 6.0)
+        self.assertEqual(self.lote.quant_recebida_kg, 10.0)
+        self.assertEqual(self.lote.observacoes, "Reetiquetado")
+
+    def test_edicao_do_lote_nao_grava_saldos(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self._put(
+                f"/api/lotes/{self.lote.pk}/",
+                {"observacoes": "x", "quant_disponivel_kg": 99, "quant_recebida_kg": 99},
+            )
+
+        updates = [q["sql"] for q in consultas.captured_queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn("quant_disponivel_kg", updates[0])
+        self.assertNotIn("quant_recebida_kg", updates[0])
+
+    def test_edicao_da_materia_prima_sem_quantidade_mantem_consumo_concorrente(self):
+        with durante_requisicao(lambda: self.materia_prima.atualizar_quantidade(3.0)):
+            resposta = self._put(
+                f"/api/materias-primas/{self.materia_prima.pk}/", {"localizacao": "A1"}
+            )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.materia_prima.refresh_from_db()
+        self.assertEqual(self.materia_prima.quantidade_disponivel, 7.0)
+        self.assertEqual(self.materia_prima.localizacao, "A1")
+
+    def test_ajuste_de_quantidade_parte_do_saldo_atual(self):
+        with durante_requisicao(lambda: self.materia_prima.atualizar_quantidade(3.0)):
+            resposta = self._put(
+                f"/api/materias-primas/{self.materia_prima.pk}/",
+                {"quantidade_disponivel": 12.0},
+            )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()["quantidade_disponivel"], 12.0)
+        ajuste = MovimentacaoEstoque.objects.get(
+            materia_prima_id=self.materia_prima.pk, tipo="ajuste"
+        )
+        # 7kg depois do consumo concorrente, editado para 12kg
+        self.assertEqual(ajuste.quantidade_kg, 5.0)
+
+
+class SincronizacaoTests(TestCase):
+    """Protocolo de sincronização incremental pelo cursor do log de alterações"""
+
+    def setUp(self):
+        self.fornecedor = Fornecedor.objects.create(
+            cnpj="00.000.000/0001-00", razao_social="Fornecedor", fantasia="F"
+        )
+        self.materia_prima = criar_materia_prima(self.fornecedor)
+        self.lote = criar_lote(self.materia_prima)
+
+    def alteracoes(self, recurso, since=None):
+        url = f"/api/{recurso}/alteracoes/"
+        resposta = self.client.get(url, {"since": since} if since is not None else {})
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.json()
+
+    @staticmethod
+    def ids(resposta):
+        return [item["id"] for item in resposta["alterados"]]
+
+    def test_cursor_segue_o_id_do_log(self):
+        carga = self.alteracoes("materias-primas")
+        self.assertEqual(carga["cursor"], str(RegistroAlteracao.ultimo()))
+        self.assertEqual(self.ids(carga), [self.materia_prima.id])
+
+        self.assertEqual(self.ids(self.alteracoes("materias-primas", carga["cursor"])), [])
+
+        self.materia_prima.adicionar_estoque(1.0)
+        resposta = self.alteracoes("materias-primas", carga["cursor"])
+        self.assertEqual(self.ids(resposta), [self.materia_prima.id])
+        self.assertGreater(int(resposta["cursor"]), int(carga["cursor"]))
+
+        vazia = self.alteracoes("materias-primas", resposta["cursor"])
+        self.assertEqual((self.ids(vazia), vazia["cursor"]), ([], resposta["cursor"]))
+
+    def test_paginas_param_no_limite(self):
+        cursor = self.alteracoes("materias-primas")["cursor"]
+        outras = [criar_materia_prima(self.fornecedor, nome=f"M{i}") for i in range(2)]
+        self.materia_prima.adicionar_estoque(1.0)
+
+        with mock.patch("sc_materiasPrimas.sincronizacao.LIMITE_ALTERACOES", 2):
+            primeira = self.alteracoes("materias-primas", cursor)
+            segunda = self.alteracoes("materias-primas", primeira["cursor"])
+
+        self.assertEqual(self.ids(primeira), [mp.id for mp in outras])
+        self.assertTrue(primeira["mais"])
+        self.assertEqual(self.ids(segunda), [self.materia_prima.id])
+        self.assertFalse(segunda["mais"])
+
+    def test_exclusao_gera_registro_de_excluido(self):
+        cursor = self.alteracoes("lotes")["cursor"]
+
+        self.assertEqual(self.client.delete(f"/api/lotes/{self.lote.id}/").status_code, 204)
+
+        resposta = self.alteracoes("lotes", cursor)
+        self.assertEqual(resposta["alterados"], [])
+        self.assertEqual(resposta["excluidos"], [self.lote.id])
+
+    def test_exclusao_em_cascata_gera_registro_dos_lotes(self):
+        cursor = self.alteracoes("lotes")["cursor"]
+
+        self.client.delete(f"/api/materias-primas/{self.materia_prima.id}/")
+
+        self.assertEqual(self.alteracoes("lotes", cursor)["excluidos"], [self.lote.id])
+
+    def test_renomear_materia_prima_registra_os_lotes(self):
+        cursor = self.alteracoes("lotes")["cursor"]
+
+        self.materia_prima.nome = "Vitamina D"
+        self.materia_prima.save(update_fields=["nome"])
+
+        resposta = self.alteracoes("lotes", cursor)
+        self.assertEqual(self.ids(resposta), [self.lote.id])
+        self.assertEqual(resposta["alterados"][0]["materia_prima"]["nome"], "Vitamina D")
+
+    def test_renomear_fornecedor_registra_os_lotes_dele(self):
+        self.lote.fornecedor = self.fornecedor
+        self.lote.save()
+        cursor = self.alteracoes("lotes")["cursor"]
+
+        self.fornecedor.razao_social = "Novo nome"
+        self.fornecedor.save()
+
+        self.assertEqual(self.ids(self.alteracoes("lotes", cursor)), [self.lote.id])
+
+    def test_alteracao_sem_campo_copiado_nao_registra_dependentes(self):
+        cursor = self.alteracoes("lotes")["cursor"]
+
+        self.materia_prima.localizacao = "B2"
+        self.materia_prima.save(update_fields=["localizacao"])
+
+        self.assertEqual(self.ids(self.alteracoes("lotes", cursor)), [])
+
+    def test_cursor_invalido_responde_400(self):
+        resposta = self.client.get("/api/materias-primas/alteracoes/", {"since": "ontem"})
+        self.assertEqual(resposta.status_code, 400)
+
+
+class ReconciliacaoTests(TestCase):
+    """Estoque das matérias primas comparado com a soma dos lotes"""
+
+    def setUp(self):
+        fornecedor = Fornecedor.objects.create(cnpj="1", razao_social="F", fantasia="F")
+        self.materias_primas = [criar_materia_prima(fornecedor, 10.0) for _ in range(3)]
+        for materia_prima in self.materias_primas:
+            criar_lote(materia_prima, 6.0)
+            criar_lote(materia_prima, 4.0)
+
+    def desviar(self, materia_prima, quantidade):
+        """Altera o estoque sem passar pelo log de alterações"""
+        MateriaPrima.objects.filter(pk=materia_prima.pk).update(quantidade_disponivel=quantidade)
+
+    def test_apenas_relata_sem_corrigir(self):
+        self.desviar(self.materias_primas[0], 12.0)
+
+        resultado = reconciliar()
+
+        self.assertEqual(
+            [item["id"] for item in resultado["divergencias"]], [self.materias_primas[0].id]
+        )
+        self.assertAlmostEqual(resultado["divergencias"][0]["diferenca_kg"], 2.0)
+        self.assertEqual(resultado["corrigidas"], 0)
+        self.materias_primas[0].refresh_from_db()
+        self.assertEqual(self.materias_primas[0].quantidade_disponivel, 12.0)
+        self.assertFalse(MovimentacaoEstoque.objects.exists())
+
+    def test_corrige_e_registra_a_diferenca_aplicada(self):
+        self.desviar(self.materias_primas[0], 12.0)
+        self.desviar(self.materias_primas[1], 7.5)
+
+        resultado = reconciliar(corrigir=True)
+
+        self.assertEqual(resultado["corrigidas"], 2)
+        for materia_prima in self.materias_primas:
+            materia_prima.refresh_from_db()
+            self.assertAlmostEqual(materia_prima.quantidade_disponivel, 10.0)
+        movimentacoes = dict(
+            MovimentacaoEstoque.objects.filter(
+                tipo=TipoMovimentacaoEnum.RECONCILIACAO
+            ).values_list("materia_prima_id", "quantidade_kg")
+        )
+        self.assertEqual(
+            movimentacoes, {self.materias_primas[0].id: -2.0, self.materias_primas[1].id: 2.5}
+        )
+        self.assertEqual(reconciliar()["divergencias"], [])
+
+    def test_ruido_de_arredondamento_nao_e_divergencia(self):
+        # 0,1 + 0,2 em float, e meio grama: abaixo da precisão do relatório
+        self.desviar(self.materias_primas[0], 10.0 + (0.1 + 0.2 - 0.3))
+        self.desviar(self.materias_primas[1], 10.0005)
+
+        self.assertEqual(reconciliar(corrigir=True)["divergencias"], [])
+        self.assertFalse(MovimentacaoEstoque.objects.exists())
+
+    def test_incremental_verifica_so_o_alterado_depois_da_execucao_anterior(self):
+        reconciliar()
+        alterada, fora_do_log = self.materias_primas[0], self.materias_primas[1]
+        alterada.quantidade_disponivel = 11.0
+        alterada.save(update_fields=["quantidade_disponivel"])
+        self.desviar(fora_do_log, 13.0)
+
+        resultado = reconciliar(incremental=True)
+
+        self.assertTrue(resultado["incremental"])
+        self.assertEqual(resultado["materias_verificadas"], 1)
+        self.assertEqual([item["id"] for item in resultado["divergencias"]], [alterada.id])
+        self.assertEqual(ExecucaoReconciliacao.objects.count(), 2)
+        # Sem alterações desde a última execução nada é verificado
+        self.assertEqual(reconciliar(incremental=True)["materias_verificadas"], 0)
+
+    def test_comando_exibe_a_diferenca_com_a_precisao_da_tolerancia(self):
+        self.desviar(self.materias_primas[0], 10.0016)
+        saida = StringIO()
+
+        call_command("reconciliar_estoque", stdout=saida)
+
+        self.assertIn("diferença +0.002kg", saida.getvalue())
+        self.assertIn("1 divergência(s), 0 corrigida(s)", saida.getvalue())
+
+
+class UnidadeDeTrabalhoTests(TestCase):
+    """Transições gravadas só nos campos alterados e, em lote, juntas ao final"""
+
+    def setUp(self):
+        fornecedor = Fornecedor.objects.create(cnpj="1", razao_social="F", fantasia="F")
+        self.materias_primas = [criar_materia_prima(fornecedor) for _ in range(3)]
+
+    def updates(self, consultas):
+        tabela = MateriaPrima._meta.db_table
+        return [
+            consulta["sql"]
+            for consulta in consultas.captured_queries
+            if consulta["sql"].startswith(f'UPDATE "{tabela}"')
+        ]
+
+    def test_transicao_direta_grava_so_os_campos_alterados(self):
+        materia_prima = self.materias_primas[0]
+
+        with CaptureQueriesContext(connection) as consultas:
+            materia_prima.abrir_embalagem()
+
+        (sql,) = self.updates(consultas)
+        self.assertIn('"data_validade_efetiva"', sql)
+        self.assertNotIn('"quantidade_disponivel"', sql)
+        self.assertNotIn('"nome"', sql)
+
+    def test_transicoes_do_mesmo_objeto_viram_um_update(self):
+        with CaptureQueriesContext(connection) as consultas:
+            with UnidadeDeTrabalho() as unidade:
+                for materia_prima in self.materias_primas:
+                    materia_prima.abrir_embalagem(unidade=unidade)
+                    materia_prima.transferir_para_quarentena("Análise", unidade=unidade)
+
+        self.assertEqual(len(self.updates(consultas)), 1)
+        for materia_prima in self.materias_primas:
+            materia_prima.refresh_from_db()
+            self.assertTrue(materia_prima.embalagem_aberta)
+            self.assertEqual(materia_prima.status, "em quarentena")
+        self.assertEqual(
+            set(
+                RegistroAlteracao.objects.filter(recurso="materia_prima").values_list(
+                    "objeto_id", flat=True
+                )
+            ),
+            {materia_prima.id for materia_prima in self.materias_primas},
+        )
+
+    def test_um_update_por_conjunto_de_campos(self):
+        primeira, segunda, terceira = self.materias_primas
+
+        with CaptureQueriesContext(connection) as consultas:
+            with UnidadeDeTrabalho() as unidade:
+                primeira.abrir_embalagem(unidade=unidade)
+                segunda.transferir_para_quarentena(unidade=unidade)
+                terceira.transferir_para_quarentena(unidade=unidade)
+
+        self.assertEqual(len(self.updates(consultas)), 2)
+
+    def test_outra_instancia_da_mesma_linha_e_recusada(self):
+        materia_prima = self.materias_primas[0]
+        copia = MateriaPrima.objects.get(pk=materia_prima.pk)
+
+        with self.assertRaises(ValueError):
+            with UnidadeDeTrabalho() as unidade:
+                materia_prima.abrir_embalagem(unidade=unidade)
+                copia.transferir_para_quarentena(unidade=unidade)
+
+        materia_prima.refresh_from_db()
+        self.assertFalse(materia_prima.embalagem_aberta)
+
+    def test_erro_no_bloco_descarta_as_alteracoes(self):
+        with self.assertRaises(RuntimeError):
+            with UnidadeDeTrabalho() as unidade:
+                self.materias_primas[0].transferir_para_quarentena(unidade=unidade)
+                raise RuntimeError
+
+        self.materias_primas[0].refresh_from_db()
+        self.assertNotEqual(self.materias_primas[0].status, "em quarentena")
+
+    def test_endpoint_aplica_a_transicao_em_lote(self):
+        ids = [materia_prima.id for materia_prima in self.materias_primas[:2]]
+
+        with CaptureQueriesContext(connection) as consultas:
+            resposta = self.client.post(
+                "/api/materias-primas/transicoes/",
+                json.dumps({"acao": "quarentena", "ids": ids + [0], "motivo": "Análise"}),
+                content_type="application/json",
+            )
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json()["atualizadas"], 2)
+        self.assertEqual(resposta.json()["nao_encontradas"], [0])
+        self.assertEqual(len(self.updates(consultas)), 1)
+        em_quarentena = MateriaPrima.objects.filter(_status_interno="em quarentena")
+        self.assertEqual(set(em_quarentena.values_list("id", flat=True)), set(ids))
+
+    def test_endpoint_valida_acao_e_motivo(self):
+        for dados in (
+            {"acao": "excluir", "ids": [self.materias_primas[0].id]},
+            {"acao": "quarentena", "ids": [self.materias_primas[0].id]},
+            {"acao": "abrir_embalagem", "ids": []},
+        ):
+            resposta = self.client.post(
+                "/api/materias-primas/transicoes/",
+                json.dumps(dados),
+                content_type="application/json",
+            )
+            self.assertEqual(resposta.status_code, 400, dados)
+
+
+def migrar(destino=None):
+    """Migra o banco de testes (por padrão até a última migração) e devolve os modelos"""
+    executor = MigrationExecutor(connection)
+    destino = destino or executor.loader.graph.leaf_nodes()
+    executor.migrate(destino)
+    return MigrationExecutor(connection).loader.project_state(destino).apps
+
+
+class MigracaoRegistroAlteracaoTests(TransactionTestCase):
+    """A migração 0011 cria o log na ordem das alterações e exclusões antigas"""
+
+    antes = [
+        ("sc_materiasPrimas", "0010_genealogia_lotes"),
+        ("sc_producao", "0005_genealogia_lotes"),
+        ("sc_produtos", "0003_versao_formula"),
+    ]
+
+    def setUp(self):
+        apps = migrar(self.antes)
+
+        agora = timezone.now()
+        self.instantes = [agora - timedelta(hours=horas) for horas in (3, 2, 1)]
+        fornecedor = apps.get_model("sc_fornecedores", "Fornecedor").objects.create(
+            cnpj="1", razao_social="F", fantasia="F"
+        )
+        MateriaPrimaAntiga = apps.get_model("sc_materiasPrimas", "MateriaPrima")
+        self.antiga = MateriaPrimaAntiga.objects.create(
+            cod_interno=1, nome="Antiga", fornecedor=fornecedor
+        )
+        self.recente = MateriaPrimaAntiga.objects.create(
+            cod_interno=2, nome="Recente", fornecedor=fornecedor
+        )
+        MateriaPrimaAntiga.objects.filter(pk=self.antiga.pk).update(
+            atualizado_em=self.instantes[0]
+        )
+        MateriaPrimaAntiga.objects.filter(pk=self.recente.pk).update(
+            atualizado_em=self.instantes[2]
+        )
+        apps.get_model("sc_materiasPrimas", "RegistroExclusao").objects.create(
+            recurso="materia_prima", objeto_id=99, excluido_em=self.instantes[1]
+        )
+
+        migrar([("sc_materiasPrimas", "0011_registro_alteracao")])
+
+    def tearDown(self):
+        migrar()
+
+    def test_log_segue_a_ordem_das_alteracoes(self):
+        self.assertEqual(
+            list(
+                RegistroAlteracao.objects.order_by("id").values_list("objeto_id", "excluido")
+            ),
+            [(self.antiga.pk, False), (99, True), (self.recente.pk, False)],
+        )
+
+    def test_cursor_antigo_continua_do_instante(self):
+        # Cliente sincronizado entre a primeira alteração e a exclusão
+        since = (self.instantes[0] + timedelta(minutes=30)).isoformat()
+
+        resposta = self.client.get("/api/materias-primas/alteracoes/", {"since": since})
+
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.json()
+        self.assertEqual([item["id"] for item in dados["alterados"]], [self.recente.pk])
+        self.assertEqual(dados["excluidos"], [99])
+        self.assertEqual(dados["cursor"], str(RegistroAlteracao.ultimo()))
+
+
+class ReparoRegistroAlteracaoTests(TransactionTestCase):
+    """A migração 0013 registra de novo os objetos gravados pela 0011 com o recurso errado"""
+
+    def setUp(self):
+        apps = migrar([("sc_materiasPrimas", "0012_reconciliacao_ultimo_registro")])
+        fornecedor = apps.get_model("sc_fornecedores", "Fornecedor").objects.create(
+            cnpj="1", razao_social="F", fantasia="F"
+        )
+        self.materia_prima = apps.get_model("sc_materiasPrimas", "MateriaPrima").objects.create(
+            cod_interno=1, nome="M", fornecedor=fornecedor
+        )
+        apps.get_model("sc_materiasPrimas", "RegistroAlteracao").objects.create(
+            recurso="lote_producao", objeto_id=self.materia_prima.pk
+        )
+        self.cursor = RegistroAlteracao.ultimo()
+        migrar()
+
+    def test_cliente_recebe_a_materia_prima(self):
+        resposta = self.client.get("/api/materias-primas/alteracoes/", {"since": self.cursor})
+
+        self.assertEqual(
+            [item["id"] for item in resposta.json()["alterados"]], [self.materia_prima.pk]
+        )
@@ -0,0 +1,113 @@
+"""
+Gravação parcial e em lote das transições de estado dos modelos.
+
+As transições (abrir embalagem, verificar validade, quarentena...) alteram o
+objeto em memória e gravam só os campos alterados, em um único UPDATE. Dentro de
+uma UnidadeDeTrabalho as gravações são adiadas e feitas ao final do bloco com
+um bulk_update por modelo:
+
+    with UnidadeDeTrabalho() as unidade:
+        for materia_prima in materias_primas:
+            materia_prima.verificar_validade(unidade=unidade)
+"""
+
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+# Objetos por comando UPDATE no bulk_update
+BLOCO_GRAVACAO = 500
+
+
+def _possui_atualizado_em(modelo):
+    return any(f.name == "atualizado_em" for f in modelo._meta.concrete_fields)
+
+
+class GravacaoParcialMixin:
+    """Gravação dos campos alterados por uma transição, direta ou adiada"""
+
+    def gravar_campos(self, campos, unidade=None):
+        campos = list(campos)
+        if not campos:
+            return
+        if unidade is not None:
+            unidade.registrar(self, campos)
+        else:
+            # auto_now só é aplicado aos campos listados em update_fields
+            if _possui_atualizado_em(type(self)):
+                campos.append("atualizado_em")
+            self.save(update_fields=campos)
+
+
+class UnidadeDeTrabalho:
+    """
+    Acumula as alterações registradas pelas transições e grava tudo ao sair do
+    bloco, dentro de uma transação, com um bulk_update por modelo e conjunto de
+    campos alterados (cada objeto grava só os próprios campos).
+
+    O bulk_update não chama save() nem dispara sinais: as transições já deixam
+    os campos derivados (como a validade efetiva) calculados, e atualizado_em e
+    o log de alterações da sincronização são preenchidos aqui.
+    """
+
+    def __init__(self, batch_size=BLOCO_GRAVACAO):
+        self.batch_size = batch_size
+        # (modelo, pk): (objeto, campos alterados)
+        self._pendentes = {}
+        self._transacao = None
+
+    def registrar(self, obj, campos):
+        """
+        Registra os campos alterados do objeto. O mesmo objeto pode passar por
+        várias transições e é gravado uma vez só; outra instância da mesma
+        linha é recusada, pois a gravação usaria valores desatualizados de uma
+        delas.
+        """
+        chave = (type(obj), obj.pk)
+        registrado, campos_registrados = self._pendentes.get(chave, (obj, set()))
+        if registrado is not obj:
+            raise ValueError(
+                f"{type(obj).__name__} {obj.pk} já foi registrado na unidade de "
+                "trabalho por outra instância"
+            )
+        campos_registrados.update(campos)
+        self._pendentes[chave] = (obj, campos_registrados)
+
+    def gravar(self):
+        """Grava as alterações pendentes e retorna o total de objetos gravados"""
+        # Import tardio: sinais depende dos modelos, que dependem deste módulo
+        from .sinais import registrar_alteracoes
+
+        grupos = defaultdict(list)
+        for (modelo, _), (obj, campos) in self._pendentes.items():
+            grupos[(modelo, frozenset(campos))].append(obj)
+
+        agora = timezone.now()
+        total = 0
+        for (modelo, campos), objetos in grupos.items():
+            campos = set(campos)
+            if _possui_atualizado_em(modelo):
+                campos.add("atualizado_em")
+                for obj in objetos:
+                    obj.atualizado_em = agora
+            modelo.objects.bulk_update(objetos, sorted(campos), batch_size=self.batch_size)
+            registrar_alteracoes(modelo, [obj.pk for obj in objetos])
+            total += len(objetos)
+        self._pendentes.clear()
+        return total
+
+    def __enter__(self):
+        self._transacao = transaction.atomic()
+        self._transacao.__enter__()
+        return self
+
+    def __exit__(self, tipo_excecao, excecao, traceback):
+        if tipo_excecao is None:
+            try:
+                self.gravar()
+            except Exception as erro:
+                # Desfaz a transação e propaga o erro da gravação
+                self._transacao.__exit__(type(erro), erro, erro.__traceback__)
+                raise
+        return self._transacao.__exit__(tipo_excecao, excecao, traceback)
@@ -3,6 +3,21 @@ from . import views
 
 urlpatterns = [
     path("materias-primas/", views.materia_prima_list, name="materia_prima_list"),
+    path(
+        "materias-primas/alteracoes/",
+        views.materia_prima_alteracoes,
+        name="materia_prima_alteracoes",
+    ),
+    path(
+        "materias-primas/valor-estoque/",
+        views.valor_estoque,
+        name="valor_estoque",
+    ),
+    path(
+        "materias-primas/transicoes/",
+        views.materia_prima_transicoes,
+        name="materia_prima_transicoes",
+    ),
     path(
         "materias-primas/<int:pk>/",
         views.materia_prima_detail,
@@ -19,6 +34,15 @@ urlpatterns = [
         name="registrar_abertura_embalagem",
     ),
     path("lotes/", views.lote_list, name="lote_list"),
+    path("lotes/importar/", views.lote_importar, name="lote_importar"),
+    path("lotes/alteracoes/", views.lote_alteracoes, name="lote_alteracoes"),
+    path(
+        "lotes/calendario-vencimento/",
+        views.calendario_vencimento,
+        name="calendario_vencimento",
+    ),
     path("lotes/<int:pk>/", views.lote_detail, name="lote_detail"),
     path("lotes/<int:pk>/estoque/", views.lote_estoque, name="lote_estoque"),
+    path("lotes/<int:pk>/saldo/", views.lote_saldo, name="lote_saldo"),
+    path("movimentacoes/", views.movimentacao_list, name="movimentacao_list"),
 ]
@@ -1,51 +1,141 @@
+from django.db import transaction
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Greatest, TruncWeek
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from .models import MateriaPrima, LoteMateriaPrima
+from .models import (
+    MateriaPrima,
+    LoteMateriaPrima,
+    MovimentacaoEstoque,
+    RecursoSincronizadoEnum,
+    RegistroAlteracao,
+    SaldoLote,
+    TipoMovimentacaoEnum,
+    invalidar_cache_valor_estoque,
+)
 from sc_fornecedores.models import Fornecedor
+from sistema_capsulas.respostas import get_condicional, resposta_lista
+from .importacao import importar_lotes, ler_registros
+from .reconciliacao import TOLERANCIA_KG
+from .sincronizacao import resposta_alteracoes
+from .unidade_trabalho import UnidadeDeTrabalho
+import csv
 import json
+from datetime import datetime, timedelta
 from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _format_date_or_none(date_obj):
+    """Formata datas para resposta"""
+    if not date_obj:
+        return None
+    if hasattr(date_obj, "strftime"):
+        return date_obj.strftime("%Y-%m-%d")
+    return str(date_obj)
+
+
+def _serializar_materia_prima_lista(mp):
+    """Representação de uma matéria prima na listagem"""
+    return {
+        "id": mp.id,
+        "nome": mp.nome,
+        "data_validade": _format_date_or_none(mp.data_validade),
+        "data_validade_efetiva": _format_date_or_none(mp.data_validade_efetiva),
+        "embalagem_aberta": mp.embalagem_aberta,
+        "data_abertura_embalagem": _format_date_or_none(mp.data_abertura_embalagem),
+        "dias_validade_apos_aberto": mp.dias_validade_apos_aberto,
+        "status": mp.status,
+    }
+
+
+def _serializar_lote_base(lote):
+    """Campos do lote comuns à listagem e à sincronização"""
+    return {
+        "id": lote.id,
+        "materia_prima": {
+            "id": lote.materia_prima.id,
+            "nome": lote.materia_prima.nome,
+        },
+        "numero_lote": lote.numero_lote,
+        "data_fabricacao": lote.data_fabricacao,
+        "data_validade": lote.data_validade,
+        "nota_fiscal": lote.nota_fiscal,
+        "quant_recebida_kg": lote.quant_recebida_kg,
+        "quant_disponivel_kg": lote.quant_disponivel_kg,
+        "data_recebimento": lote.data_recebimento,
+        "fornecedor": (
+            {
+                "id": lote.fornecedor.id,
+                "razao_social": lote.fornecedor.razao_social,
+            }
+            if lote.fornecedor
+            else None
+        ),
+        "local_armazenamento": lote.local_armazenamento,
+        "embalagem_original_aberta": lote.embalagem_original_aberta,
+    }
+
+
+def _serializar_lote_lista(lote):
+    """Representação de um lote na listagem (espera a anotação status_atual)"""
+    return {**_serializar_lote_base(lote), "status": lote.status_atual}
+
+
+def _serializar_lote_sincronizacao(lote):
+    """
+    Lote na sincronização incremental: sem o status, que muda com a data sem
+    alterar o lote (o cliente o calcula pela validade, saldo e aprovação)
+    """
+    return {
+        **_serializar_lote_base(lote),
+        "aprovado_controle_qualidade": lote.aprovado_controle_qualidade,
+    }
+
+
 @csrf_exempt
+@get_condicional(MateriaPrima)
 def materia_prima_list(request):
     """Listar todas as matérias primas ou criar uma nova"""
     if request.method == "GET":
         materias_primas = MateriaPrima.objects.all()
-        materias_primas_data = []
-
-        # Formatar datas para resposta
-        def format_date_or_none(date_obj):
-            if not date_obj:
-                return None
-            if hasattr(date_obj, "strftime"):
-                return date_obj.strftime("%Y-%m-%d")
-            return str(date_obj)
-
-        for mp in materias_primas:
-            # Calcular data efetiva
-            data_validade_efetiva = mp.data_validade_efetiva
 
-            materias_primas_data.append(
-                {
-                    "id": mp.id,
-                    "nome": mp.nome,
-                    # Outros campos...
-                    "data_validade": format_date_or_none(mp.data_validade),
-                    "data_validade_efetiva": format_date_or_none(data_validade_efetiva),
-                    "embalagem_aberta": mp.embalagem_aberta,
-                    "data_abertura_embalagem": format_date_or_none(
-                        mp.data_abertura_embalagem
-                    ),
-                    "dias_validade_apos_aberto": mp.dias_validade_apos_aberto,
-                    "status": mp.status,
-                    # Outros campos...
-                }
+        # Filtros por vencimento resolvidos no banco (coluna indexada)
+        vence_antes = request.GET.get("vence_antes")
+        if vence_antes:
+            try:
+                vence_antes = datetime.strptime(vence_antes, "%Y-%m-%d").date()
+            except ValueError:
+                return JsonResponse(
+                    {"error": "Formato de data inválido. Use YYYY-MM-DD"}, status=400
+                )
+            materias_primas = materias_primas.filter(
+                data_validade_efetiva__lt=vence_antes
+            )
+        if request.GET.get("vencidas") == "true":
+            materias_primas = materias_primas.filter(
+                data_validade_efetiva__lt=timezone.now().date()
             )
+        if request.GET.get("status"):
+            materias_primas = materias_primas.filter(
+                _status_interno=request.GET["status"]
+            )
+        if request.GET.get("fornecedor"):
+            try:
+                materias_primas = materias_primas.filter(
+                    fornecedor_id=int(request.GET["fornecedor"])
+                )
+            except ValueError:
+                return JsonResponse(
+                    {"error": "O parâmetro fornecedor deve ser um ID numérico"},
+                    status=400,
+                )
+        if request.GET.get("ordenar") == "validade":
+            materias_primas = materias_primas.order_by("data_validade_efetiva", "id")
 
-        return JsonResponse(materias_primas_data, safe=False)
+        return resposta_lista(request, materias_primas, _serializar_materia_prima_lista)
 
     elif request.method == "POST":
         try:
@@ -109,31 +199,39 @@ def materia_prima_list(request):
                 print(f"Removendo status: {data['status']}")
                 data.pop("status")
 
-            # Criar a matéria prima
-            materia_prima = MateriaPrima.objects.create(
-                cod_interno=data.get("cod_interno"),
-                nome=data.get("nome"),
-                desc=data.get("desc") or None,
-                numero_lote=data.get("numero_lote"),
-                nota_fiscal=data.get("nota_fiscal"),
-                fornecedor=fornecedor,
-                data_fabricacao=data.get("data_fabricacao"),
-                data_validade=data.get("data_validade"),
-                dias_validade_apos_aberto=data.get("dias_validade_apos_aberto", 30),
-                embalagem_aberta=data.get("embalagem_aberta", False),
-                quantidade_disponivel=data.get("quantidade_disponivel", 0),
-                unidade_medida=data.get("unidade_medida", "kg"),
-                categoria=data.get("categoria") or None,
-                condicao_armazenamento=data.get("condicao_armazenamento") or None,
-                localizacao=data.get("localizacao") or None,
-                preco_unitario=data.get("preco_unitario", 0),
-                # Não incluir status aqui
-            )
-
-            # Se a embalagem estiver aberta, definir a data de abertura
-            if materia_prima.embalagem_aberta:
+            # Criar a matéria prima (e registrar o estoque inicial, se houver)
+            with transaction.atomic():
+                materia_prima = MateriaPrima(
+                    cod_interno=data.get("cod_interno"),
+                    nome=data.get("nome"),
+                    desc=data.get("desc") or None,
+                    numero_lote=data.get("numero_lote"),
+                    nota_fiscal=data.get("nota_fiscal"),
+                    fornecedor=fornecedor,
+                    data_fabricacao=data.get("data_fabricacao"),
+                    data_validade=data.get("data_validade"),
+                    dias_validade_apos_aberto=data.get("dias_validade_apos_aberto", 30),
+                    embalagem_aberta=data.get("embalagem_aberta", False),
+                    quantidade_disponivel=data.get("quantidade_disponivel", 0),
+                    unidade_medida=data.get("unidade_medida", "kg"),
+                    categoria=data.get("categoria") or None,
+                    condicao_armazenamento=data.get("condicao_armazenamento") or None,
+                    localizacao=data.get("localizacao") or None,
+                    preco_unitario=data.get("preco_unitario", 0),
+                    # Não incluir status aqui
+                )
+                # Embalagem já aberta: a data de abertura vai no mesmo INSERT
                 materia_prima.definir_data_abertura_embalagem()
-                materia_prima.definir_data_validade_efetiva()
+                materia_prima.save(force_insert=True)
+
+                quantidade_inicial = float(materia_prima.quantidade_disponivel or 0)
+                if quantidade_inicial:
+                    MovimentacaoEstoque.registrar(
+                        TipoMovimentacaoEnum.AJUSTE,
+                        quantidade_inicial,
+                        materia_prima.id,
+                        observacao="Estoque inicial informado no cadastro",
+                    )
 
             return JsonResponse(
                 {
@@ -167,7 +265,40 @@ def materia_prima_list(request):
             return JsonResponse({"error": str(e)}, status=400)
 
 
+def _serializar_materia_prima_detalhe(materia_prima):
+    """Matéria prima com a validade original e a efetiva"""
+    return {
+        "id": materia_prima.id,
+        "nome": materia_prima.nome,
+        "desc": materia_prima.desc,
+        "numero_lote": materia_prima.numero_lote,
+        "nota_fiscal": materia_prima.nota_fiscal,
+        "fornecedor": {
+            "id": materia_prima.fornecedor.id,
+            "razao_social": materia_prima.fornecedor.razao_social,
+        },
+        "data_fabricacao": materia_prima.data_fabricacao,
+        "data_validade": materia_prima.data_validade,
+        "dias_validade_apos_aberto": materia_prima.dias_validade_apos_aberto,
+        "data_abertura_embalagem": materia_prima.data_abertura_embalagem,
+        "data_validade_efetiva": materia_prima.data_validade_efetiva,
+        "embalagem_aberta": materia_prima.embalagem_aberta,
+        "quantidade_disponivel": materia_prima.quantidade_disponivel,
+        "unidade_medida": materia_prima.unidade_medida,
+        "categoria": materia_prima.categoria,
+        "condicao_armazenamento": materia_prima.condicao_armazenamento,
+        "localizacao": materia_prima.localizacao,
+        "status": materia_prima.status,
+        "preco_unitario": float(materia_prima.preco_unitario),
+        "data_entrada": materia_prima.data_entrada,
+    }
+
+
 @csrf_exempt
+@get_condicional(
+    lambda pk: MateriaPrima.objects.filter(pk=pk),
+    lambda pk: Fornecedor.objects.filter(materias_primas=pk),
+)
 def materia_prima_detail(request, pk):
     """Recuperar, atualizar ou excluir uma matéria prima"""
     try:
@@ -177,33 +308,7 @@ def materia_prima_detail(request, pk):
 
     if request.method == "GET":
         # Retornar tanto a validade original quanto a efetiva
-        return JsonResponse(
-            {
-                "id": materia_prima.id,
-                "nome": materia_prima.nome,
-                "desc": materia_prima.desc,
-                "numero_lote": materia_prima.numero_lote,
-                "nota_fiscal": materia_prima.nota_fiscal,
-                "fornecedor": {
-                    "id": materia_prima.fornecedor.id,
-                    "razao_social": materia_prima.fornecedor.razao_social,
-                },
-                "data_fabricacao": materia_prima.data_fabricacao,
-                "data_validade": materia_prima.data_validade,
-                "dias_validade_apos_aberto": materia_prima.dias_validade_apos_aberto,
-                "data_abertura_embalagem": materia_prima.data_abertura_embalagem,
-                "data_validade_efetiva": materia_prima.data_validade_efetiva,
-                "embalagem_aberta": materia_prima.embalagem_aberta,
-                "quantidade_disponivel": materia_prima.quantidade_disponivel,
-                "unidade_medida": materia_prima.unidade_medida,
-                "categoria": materia_prima.categoria,
-                "condicao_armazenamento": materia_prima.condicao_armazenamento,
-                "localizacao": materia_prima.localizacao,
-                "status": materia_prima.status,
-                "preco_unitario": float(materia_prima.preco_unitario),
-                "data_entrada": materia_prima.data_entrada,
-            }
-        )
+        return JsonResponse(_serializar_materia_prima_detalhe(materia_prima))
 
     elif request.method == "PUT":
         try:
@@ -234,16 +339,11 @@ def materia_prima_detail(request, pk):
                 # Não inclua "status" aqui
             ]
 
-            # Atualizar campos permitidos
-            for field in allowed_fields:
-                if field in data:
-                    setattr(materia_prima, field, data[field])
-
             # Tratar relacionamentos especiais
+            fornecedor = None
             if "fornecedor_id" in data and data["fornecedor_id"]:
                 try:
                     fornecedor = Fornecedor.objects.get(pk=data["fornecedor_id"])
-                    materia_prima.fornecedor = fornecedor
                 except Fornecedor.DoesNotExist:
                     return JsonResponse(
                         {
@@ -252,9 +352,48 @@ def materia_prima_detail(request, pk):
                         status=404,
                     )
 
-            materia_prima.save()
+            with transaction.atomic():
+                # Relida travada: a diferença de quantidade parte do saldo atual,
+                # não do lido no início da requisição
+                materia_prima = MateriaPrima.objects.select_for_update().get(
+                    pk=materia_prima.pk
+                )
+
+                # Atualizar campos permitidos (a quantidade é aplicada à parte)
+                campos = [
+                    field
+                    for field in allowed_fields
+                    if field in data and field != "quantidade_disponivel"
+                ]
+                for field in campos:
+                    setattr(materia_prima, field, data[field])
+                if fornecedor is not None:
+                    materia_prima.fornecedor = fornecedor
+                    campos.append("fornecedor")
 
-            # Resto do código...
+                # Um UPDATE só com os campos editados
+                materia_prima.gravar_campos(campos)
+
+                # Alteração direta da quantidade entra no histórico como ajuste
+                if "quantidade_disponivel" in data:
+                    delta = float(data["quantidade_disponivel"] or 0) - float(
+                        materia_prima.quantidade_disponivel or 0
+                    )
+                    if delta > 0:
+                        materia_prima.adicionar_estoque(delta)
+                    elif delta < 0:
+                        materia_prima.atualizar_quantidade(-delta)
+                    if delta:
+                        MovimentacaoEstoque.registrar(
+                            TipoMovimentacaoEnum.AJUSTE,
+                            delta,
+                            materia_prima.id,
+                            observacao="Quantidade alterada na edição da matéria prima",
+                        )
+
+            # Valores convertidos pelo banco (datas e decimais chegam como texto)
+            materia_prima.refresh_from_db()
+            return JsonResponse(_serializar_materia_prima_detalhe(materia_prima))
 
         except Exception as e:
             import traceback
@@ -264,48 +403,98 @@ def materia_prima_detail(request, pk):
             return JsonResponse({"error": str(e)}, status=400)
 
     elif request.method == "DELETE":
-        materia_prima.delete()
+        with transaction.atomic():
+            # Os lotes são excluídos em cascata junto com a matéria prima: o saldo
+            # de cada um (e o que sobrar fora de lotes) sai do histórico antes
+            materia_prima = MateriaPrima.objects.select_for_update().get(
+                pk=materia_prima.pk
+            )
+            lotes = list(
+                LoteMateriaPrima.objects.select_for_update()
+                .filter(materia_prima=materia_prima)
+                .values_list("id", "numero_lote", "quant_disponivel_kg")
+            )
+            # Lotes consumidos pela produção fazem parte da genealogia (recall)
+            # e são protegidos contra exclusão
+            if LoteMateriaPrima.objects.filter(
+                materia_prima=materia_prima, lotemateriaprimaconsumida__isnull=False
+            ).exists():
+                return JsonResponse(
+                    {
+                        "error": "Esta matéria prima não pode ser excluída, pois há "
+                        "lotes dela consumidos em lotes de produção."
+                    },
+                    status=409,
+                )
+            movimentacoes = [
+                MovimentacaoEstoque(
+                    tipo=TipoMovimentacaoEnum.EXCLUSAO_LOTE,
+                    quantidade_kg=-quant_kg,
+                    materia_prima_id=materia_prima.id,
+                    lote_id=lote_id,
+                    observacao=f"Exclusão do lote {numero_lote}"[:255],
+                )
+                for lote_id, numero_lote, quant_kg in lotes
+                if quant_kg
+            ]
+            fora_de_lotes = float(materia_prima.quantidade_disponivel or 0) - sum(
+                quant_kg for _, _, quant_kg in lotes
+            )
+            if abs(fora_de_lotes) > TOLERANCIA_KG:
+                movimentacoes.append(
+                    MovimentacaoEstoque(
+                        tipo=TipoMovimentacaoEnum.AJUSTE,
+                        quantidade_kg=-fora_de_lotes,
+                        materia_prima_id=materia_prima.id,
+                        observacao="Exclusão da matéria prima",
+                    )
+                )
+            MovimentacaoEstoque.objects.bulk_create(movimentacoes)
+
+            # A exclusão em cascata dos lotes passa pelos sinais do log de alterações
+            materia_prima.delete()
         return JsonResponse(
             {"message": "Matéria prima excluída com sucesso"}, status=204
         )
 
 
 @csrf_exempt
+@get_condicional(LoteMateriaPrima, MateriaPrima, Fornecedor)
 def lote_list(request):
     """Listar todos os lotes ou criar um novo"""
     if request.method == "GET":
-        lotes = LoteMateriaPrima.objects.all()
-        lotes_data = []
-        for lote in lotes:
-            lotes_data.append(
-                {
-                    "id": lote.id,
-                    "materia_prima": {
-                        "id": lote.materia_prima.id,
-                        "nome": lote.materia_prima.nome,
-                    },
-                    "numero_lote": lote.numero_lote,
-                    "data_fabricacao": lote.data_fabricacao,
-                    "data_validade": lote.data_validade,
-                    "nota_fiscal": lote.nota_fiscal,
-                    "quant_recebida_kg": lote.quant_recebida_kg,
-                    "quant_disponivel_kg": lote.quant_disponivel_kg,
-                    "status": lote.status,
-                    "data_recebimento": lote.data_recebimento,
-                    "fornecedor": (
-                        {
-                            "id": lote.fornecedor.id,
-                            "razao_social": lote.fornecedor.razao_social,
-                        }
-                        if lote.fornecedor
-                        else None
-                    ),
-                    "local_armazenamento": lote.local_armazenamento,
-                    "embalagem_original_aberta": lote.embalagem_original_aberta,
-                }
-            )
+        # Status calculado no banco para permitir filtrar sem carregar os lotes
+        lotes = LoteMateriaPrima.objects.select_related(
+            "materia_prima", "fornecedor"
+        ).annotate(
+            status_atual=LoteMateriaPrima.expressao_status(timezone.now().date())
+        )
 
-        return JsonResponse(lotes_data, safe=False)
+        status = request.GET.get("status")
+        if status:
+            lotes = lotes.filter(status_atual=status)
+
+        materia_prima_id = request.GET.get("materia_prima")
+        if materia_prima_id:
+            try:
+                lotes = lotes.filter(materia_prima_id=int(materia_prima_id))
+            except ValueError:
+                return JsonResponse(
+                    {"error": "O parâmetro materia_prima deve ser um ID numérico"},
+                    status=400,
+                )
+
+        vence_antes = request.GET.get("vence_antes")
+        if vence_antes:
+            try:
+                vence_antes = datetime.strptime(vence_antes, "%Y-%m-%d").date()
+            except ValueError:
+                return JsonResponse(
+                    {"error": "Formato de data inválido. Use YYYY-MM-DD"}, status=400
+                )
+            lotes = lotes.filter(data_validade__lt=vence_antes)
+
+        return resposta_lista(request, lotes, _serializar_lote_lista)
 
     elif request.method == "POST":
         data = json.loads(request.body)
@@ -352,28 +541,38 @@ def lote_list(request):
                         status=404,
                     )
 
-            # Criar o lote
-            lote = LoteMateriaPrima.objects.create(
-                materia_prima=materia_prima,
-                numero_lote=data["numero_lote"],
-                data_fabricacao=data["data_fabricacao"],
-                data_validade=data["data_validade"],
-                nota_fiscal=data.get("nota_fiscal", ""),
-                quant_recebida_kg=data["quant_recebida_kg"],
-                quant_disponivel_kg=data[
-                    "quant_recebida_kg"
-                ],  # Inicialmente igual à quantidade recebida
-                fornecedor=fornecedor,
-                local_armazenamento=data.get("local_armazenamento", ""),
-                condicoes_armazenamento=data.get("condicoes_armazenamento", ""),
-                observacoes=data.get("observacoes", ""),
-                aprovado_controle_qualidade=data.get(
-                    "aprovado_controle_qualidade", False
-                ),
-            )
+            # Criar o lote e somar a quantidade recebida ao estoque da matéria prima
+            with transaction.atomic():
+                lote = LoteMateriaPrima.objects.create(
+                    materia_prima=materia_prima,
+                    numero_lote=data["numero_lote"],
+                    data_fabricacao=data["data_fabricacao"],
+                    data_validade=data["data_validade"],
+                    nota_fiscal=data.get("nota_fiscal", ""),
+                    quant_recebida_kg=data["quant_recebida_kg"],
+                    quant_disponivel_kg=data[
+                        "quant_recebida_kg"
+                    ],  # Inicialmente igual à quantidade recebida
+                    fornecedor=fornecedor,
+                    local_armazenamento=data.get("local_armazenamento", ""),
+                    condicoes_armazenamento=data.get("condicoes_armazenamento", ""),
+                    observacoes=data.get("observacoes", ""),
+                    aprovado_controle_qualidade=data.get(
+                        "aprovado_controle_qualidade", False
+                    ),
+                )
+
+                materia_prima.adicionar_estoque(float(data["quant_recebida_kg"]))
+                MovimentacaoEstoque.registrar(
+                    TipoMovimentacaoEnum.RECEBIMENTO,
+                    float(data["quant_recebida_kg"]),
+                    materia_prima.id,
+                    lote.id,
+                    observacao=f"NF {lote.nota_fiscal}" if lote.nota_fiscal else "",
+                )
 
-            # Atualizar matéria prima com quantidade recebida
-            materia_prima.adicionar_estoque(float(data["quant_recebida_kg"]))
+            # As datas chegam como texto no JSON; recarregar para calcular o status
+            lote.refresh_from_db(fields=["data_fabricacao", "data_validade"])
 
             return JsonResponse(
                 {
@@ -400,6 +599,11 @@ def lote_list(request):
 
 
 @csrf_exempt
+@get_condicional(
+    lambda pk: LoteMateriaPrima.objects.filter(pk=pk),
+    lambda pk: MateriaPrima.objects.filter(lotes=pk),
+    lambda pk: Fornecedor.objects.filter(lotes_fornecidos=pk),
+)
 def lote_detail(request, pk):
     """Recuperar, atualizar ou excluir um lote"""
     try:
@@ -448,7 +652,8 @@ def lote_detail(request, pk):
     elif request.method == "PUT":
         data = json.loads(request.body)
 
-        # Atualizar campos simples
+        # Atualizar campos simples (os saldos nunca são gravados por aqui: só
+        # mudam pelas movimentações de estoque)
         simple_fields = [
             "numero_lote",
             "data_fabricacao",
@@ -461,28 +666,30 @@ def lote_detail(request, pk):
             "responsavel_aprovacao",
         ]
 
-        for field in simple_fields:
-            if field in data:
+        with transaction.atomic():
+            # Relido travado: os campos editados partem do estado atual do lote
+            lote = LoteMateriaPrima.objects.select_for_update().get(pk=lote.pk)
+            campos = [field for field in simple_fields if field in data]
+            for field in campos:
                 setattr(lote, field, data[field])
 
-        # Campos especiais
-        if "aprovado_controle_qualidade" in data:
-            was_not_approved = not lote.aprovado_controle_qualidade
-            lote.aprovado_controle_qualidade = data["aprovado_controle_qualidade"]
+            # Campos especiais
+            if "aprovado_controle_qualidade" in data:
+                was_not_approved = not lote.aprovado_controle_qualidade
+                lote.aprovado_controle_qualidade = data["aprovado_controle_qualidade"]
+                campos.append("aprovado_controle_qualidade")
 
-            # Se acabou de ser aprovado, registrar a data de aprovação
-            if was_not_approved and lote.aprovado_controle_qualidade:
-                lote.data_aprovacao = timezone.now().date()
+                # Se acabou de ser aprovado, registrar a data de aprovação
+                if was_not_approved and lote.aprovado_controle_qualidade:
+                    lote.data_aprovacao = timezone.now().date()
+                    campos.append("data_aprovacao")
 
-        # Tratar abertura de embalagem
-        if (
-            "embalagem_original_aberta" in data
-            and data["embalagem_original_aberta"]
-            and not lote.embalagem_original_aberta
-        ):
-            lote.abrir_embalagem()
+            # Tratar abertura de embalagem
+            if "embalagem_original_aberta" in data and data["embalagem_original_aberta"]:
+                campos.extend(lote.marcar_embalagem_aberta())
 
-        lote.save()
+            # Um UPDATE só com os campos editados
+            lote.gravar_campos(campos)
 
         return JsonResponse(
             {
@@ -499,21 +706,48 @@ def lote_detail(request, pk):
         )
 
     elif request.method == "DELETE":
-        materia_prima = lote.materia_prima
-        quantidade_a_remover = lote.quant_disponivel_kg
-
-        # Remover quantidade do estoque da matéria prima antes de deletar o lote
-        if quantidade_a_remover > 0:
-            try:
-                materia_prima.atualizar_quantidade(quantidade_a_remover)
-            except ValueError:
-                # Se não houver quantidade suficiente, apenas ajustar para zero
-                materia_prima.quantidade_disponivel = max(
-                    0, materia_prima.quantidade_disponivel - quantidade_a_remover
+        with transaction.atomic():
+            # Travar o lote para que nenhum consumo concorrente altere o saldo
+            lote = LoteMateriaPrima.objects.select_for_update().get(pk=lote.pk)
+            if lote.lotemateriaprimaconsumida_set.exists():
+                return JsonResponse(
+                    {
+                        "error": "Este lote não pode ser excluído, pois foi consumido "
+                        "em lotes de produção."
+                    },
+                    status=409,
+                )
+            quantidade_a_remover = lote.quant_disponivel_kg
+
+            # Remover quantidade do estoque da matéria prima antes de deletar o lote
+            # (se não houver quantidade suficiente, apenas ajustar para zero)
+            if quantidade_a_remover > 0:
+                MateriaPrima.objects.filter(pk=lote.materia_prima_id).update(
+                    quantidade_disponivel=Greatest(
+                        F("quantidade_disponivel") - quantidade_a_remover, Value(0.0)
+                    ),
+                    _status_interno=Case(
+                        When(
+                            quantidade_disponivel__lte=quantidade_a_remover,
+                            then=Value("esgotado"),
+                        ),
+                        default=F("_status_interno"),
+                    ),
+                    atualizado_em=timezone.now(),
+                )
+                RegistroAlteracao.registrar(
+                    RecursoSincronizadoEnum.MATERIA_PRIMA, [lote.materia_prima_id]
+                )
+                invalidar_cache_valor_estoque()
+                MovimentacaoEstoque.registrar(
+                    TipoMovimentacaoEnum.EXCLUSAO_LOTE,
+                    -quantidade_a_remover,
+                    lote.materia_prima_id,
+                    lote.id,
+                    observacao=f"Exclusão do lote {lote.numero_lote}",
                 )
-                materia_prima.save()
 
-        lote.delete()
+            lote.delete()
         return JsonResponse({"message": "Lote excluído com sucesso"}, status=204)
 
 
@@ -532,18 +766,27 @@ def atualizar_estoque(request, pk):
             quantidade = float(data.get("quantidade", 0))
             operacao = data.get("operacao", "")
 
-            if operacao == "adicionar":
-                materia_prima.adicionar_estoque(quantidade)
-                mensagem = f"Adicionado {quantidade} {materia_prima.unidade_medida}(s) ao estoque"
-            elif operacao == "subtrair":
-                materia_prima.atualizar_quantidade(quantidade)
-                mensagem = f"Removido {quantidade} {materia_prima.unidade_medida}(s) do estoque"
-            else:
+            if operacao not in ("adicionar", "subtrair"):
                 return JsonResponse(
                     {"error": "Operação inválida. Use 'adicionar' ou 'subtrair'"},
                     status=400,
                 )
 
+            with transaction.atomic():
+                if operacao == "adicionar":
+                    materia_prima.adicionar_estoque(quantidade)
+                    mensagem = f"Adicionado {quantidade} {materia_prima.unidade_medida}(s) ao estoque"
+                else:
+                    materia_prima.atualizar_quantidade(quantidade)
+                    mensagem = f"Removido {quantidade} {materia_prima.unidade_medida}(s) do estoque"
+
+                MovimentacaoEstoque.registrar(
+                    TipoMovimentacaoEnum.AJUSTE,
+                    quantidade if operacao == "adicionar" else -quantidade,
+                    materia_prima.id,
+                    observacao=mensagem,
+                )
+
             return JsonResponse(
                 {
                     "id": materia_prima.id,
@@ -593,7 +836,14 @@ def registrar_abertura_embalagem(request, pk):
         # Recalcular o status (opcional)
         materia_prima.calcular_status()
 
-        materia_prima.save()
+        # Um único UPDATE (o save inclui a validade efetiva recalculada)
+        materia_prima.save(
+            update_fields=[
+                "embalagem_aberta",
+                "data_abertura_embalagem",
+                "_status_interno",
+            ]
+        )
 
         # Calcular nova data de validade
         nova_validade = materia_prima.data_validade_efetiva
@@ -623,6 +873,64 @@ def registrar_abertura_embalagem(request, pk):
     return JsonResponse({"error": "Método não permitido"}, status=405)
 
 
+# Transições aplicáveis em lote: ação -> (transição, exige motivo)
+TRANSICOES_EM_LOTE = {
+    "abrir_embalagem": (lambda mp, unidade, motivo: mp.abrir_embalagem(unidade), False),
+    "quarentena": (
+        lambda mp, unidade, motivo: mp.transferir_para_quarentena(motivo, unidade),
+        True,
+    ),
+}
+
+
+@csrf_exempt
+def materia_prima_transicoes(request):
+    """
+    Aplica uma transição (abertura de embalagem ou quarentena) a várias
+    matérias primas. Corpo: {"acao": ..., "ids": [...], "motivo": ...}.
+    As matérias primas são lidas em uma consulta e gravadas juntas pela
+    unidade de trabalho, em vez de um UPDATE por objeto.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Dados inválidos: não é um JSON válido"}, status=400)
+
+    acao = data.get("acao")
+    if acao not in TRANSICOES_EM_LOTE:
+        return JsonResponse(
+            {"error": f"Ação inválida. Use: {', '.join(TRANSICOES_EM_LOTE)}"}, status=400
+        )
+    transicao, exige_motivo = TRANSICOES_EM_LOTE[acao]
+    motivo = data.get("motivo") or ""
+    if exige_motivo and not motivo:
+        return JsonResponse({"error": "Informe o motivo"}, status=400)
+    try:
+        ids = list(dict.fromkeys(int(i) for i in data.get("ids") or []))
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "ids deve ser uma lista de números"}, status=400)
+    if not ids:
+        return JsonResponse({"error": "Informe os ids das matérias primas"}, status=400)
+
+    with UnidadeDeTrabalho() as unidade:
+        # Travadas até a gravação, para não sobrescrever alterações concorrentes
+        materias_primas = MateriaPrima.objects.select_for_update().in_bulk(ids)
+        for materia_prima in materias_primas.values():
+            transicao(materia_prima, unidade, motivo)
+        atualizadas = unidade.gravar()
+
+    return JsonResponse(
+        {
+            "acao": acao,
+            "atualizadas": atualizadas,
+            "nao_encontradas": [i for i in ids if i not in materias_primas],
+        }
+    )
+
+
 @csrf_exempt
 def lote_estoque(request, pk):
     """Endpoint para gerenciar o estoque de um lote específico"""
@@ -640,20 +948,29 @@ def lote_estoque(request, pk):
 
             materia_prima = lote.materia_prima
 
-            if operacao == "adicionar":
-                lote.adicionar_quantidade(quantidade)
-                materia_prima.adicionar_estoque(quantidade)
-                mensagem = f"Adicionado {quantidade}kg ao lote"
-            elif operacao == "consumir":
-                lote.consumir_quantidade(quantidade)
-                materia_prima.atualizar_quantidade(quantidade)
-                mensagem = f"Consumido {quantidade}kg do lote"
-            else:
+            if operacao not in ("adicionar", "consumir"):
                 return JsonResponse(
                     {"error": "Operação inválida. Use 'adicionar' ou 'consumir'"},
                     status=400,
                 )
 
+            # Lote e matéria prima mudam juntos ou não mudam
+            with transaction.atomic():
+                if operacao == "adicionar":
+                    lote.adicionar_quantidade(quantidade)
+                    materia_prima.adicionar_estoque(quantidade)
+                    mensagem = f"Adicionado {quantidade}kg ao lote"
+                    tipo, delta = TipoMovimentacaoEnum.RECEBIMENTO, quantidade
+                else:
+                    lote.consumir_quantidade(quantidade)
+                    materia_prima.atualizar_quantidade(quantidade)
+                    mensagem = f"Consumido {quantidade}kg do lote"
+                    tipo, delta = TipoMovimentacaoEnum.CONSUMO, -quantidade
+
+                MovimentacaoEstoque.registrar(
+                    tipo, delta, materia_prima.id, lote.id, observacao=mensagem
+                )
+
             return JsonResponse(
                 {
                     "id": lote.id,
@@ -676,36 +993,221 @@ def lote_estoque(request, pk):
                 {"error": f"Erro ao atualizar estoque: {str(e)}"}, status=500
             )
 
-    # Substitua qualquer consulta que use data_validade_efetiva
-    # POR EXEMPLO, se você tem algo como:
-    # materias_vencidas = MateriaPrima.objects.filter(data_validade_efetiva__lt=hoje)
+    materia_prima = lote.materia_prima
+
+    return JsonResponse(
+        {
+            "id": materia_prima.id,
+            "data_validade": materia_prima.data_validade,
+            "data_validade_efetiva": materia_prima.data_validade_efetiva,
+        }
+    )
+
+
+def _serializar_movimentacao(movimentacao):
+    """Representação de uma movimentação de estoque"""
+    return {
+        "id": movimentacao.id,
+        "tipo": movimentacao.tipo,
+        "quantidade_kg": movimentacao.quantidade_kg,
+        "materia_prima_id": movimentacao.materia_prima_id,
+        "lote_id": movimentacao.lote_id,
+        "data_hora": movimentacao.data_hora,
+        "observacao": movimentacao.observacao,
+    }
+
+
+@csrf_exempt
+def movimentacao_list(request):
+    """Listar o histórico de movimentações de estoque (somente leitura)"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    movimentacoes = MovimentacaoEstoque.objects.order_by("data_hora", "id")
+
+    try:
+        if request.GET.get("materia_prima"):
+            movimentacoes = movimentacoes.filter(
+                materia_prima_id=int(request.GET["materia_prima"])
+            )
+        if request.GET.get("lote"):
+            movimentacoes = movimentacoes.filter(lote_id=int(request.GET["lote"]))
+        if request.GET.get("desde"):
+            desde = datetime.strptime(request.GET["desde"], "%Y-%m-%d").date()
+            movimentacoes = movimentacoes.filter(data_hora__date__gte=desde)
+        if request.GET.get("ate"):
+            ate = datetime.strptime(request.GET["ate"], "%Y-%m-%d").date()
+            movimentacoes = movimentacoes.filter(data_hora__date__lte=ate)
+    except ValueError:
+        return JsonResponse(
+            {"error": "Parâmetros inválidos. Use IDs numéricos e datas YYYY-MM-DD"},
+            status=400,
+        )
+    if request.GET.get("tipo"):
+        movimentacoes = movimentacoes.filter(tipo=request.GET["tipo"])
+
+    return resposta_lista(request, movimentacoes, _serializar_movimentacao)
+
+
+@csrf_exempt
+def lote_saldo(request, pk):
+    """Saldo de um lote ao final de uma data (?data=YYYY-MM-DD, padrão hoje)"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    data_param = request.GET.get("data")
+    try:
+        data = (
+            datetime.strptime(data_param, "%Y-%m-%d").date()
+            if data_param
+            else timezone.localdate()
+        )
+    except ValueError:
+        return JsonResponse(
+            {"error": "Formato de data inválido. Use YYYY-MM-DD"}, status=400
+        )
+
+    return JsonResponse(
+        {"lote_id": pk, "data": data, "saldo_kg": SaldoLote.saldo_em(pk, data)}
+    )
+
+
+@csrf_exempt
+def lote_importar(request):
+    """
+    Receber vários lotes de uma vez a partir de um arquivo CSV ou NDJSON.
+    O formato vem de ?formato= ou do Content-Type. Linhas inválidas são
+    reportadas sem impedir a gravação das válidas.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    formato = request.GET.get("formato")
+    if not formato:
+        formato = "csv" if "csv" in request.content_type else "ndjson"
+
+    try:
+        registros = ler_registros(request.body.decode("utf-8-sig"), formato)
+    except (ValueError, csv.Error) as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    resultado = importar_lotes(registros)
+    return JsonResponse(
+        {
+            "total_criados": len(resultado["criados"]),
+            "total_erros": len(resultado["erros"]),
+            **resultado,
+        },
+        status=201 if resultado["criados"] else 400,
+    )
+
+
+@csrf_exempt
+@get_condicional(MateriaPrima, Fornecedor)
+def valor_estoque(request):
+    """Valor do estoque de matérias primas agrupado por categoria, fornecedor e localização"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+    return JsonResponse(MateriaPrima.valor_estoque_agrupado())
+
 
-    # Substitua por:
-    from django.utils import timezone
+@csrf_exempt
+@get_condicional(LoteMateriaPrima, MateriaPrima)
+def calendario_vencimento(request):
+    """
+    Quantos kg vencem em cada semana, por matéria prima e local de armazenamento.
+    Retorna uma matriz compacta: a lista de semanas (segunda-feira de cada uma)
+    e, para cada par matéria prima/local, os kg que vencem em cada semana.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
 
-    hoje = timezone.now().date()
-    todas_materias = MateriaPrima.objects.all()
-    materias_vencidas = []
+    try:
+        total_semanas = int(request.GET.get("semanas", 26))
+        if not 1 <= total_semanas <= 104:
+            raise ValueError
+    except ValueError:
+        return JsonResponse(
+            {"error": "O parâmetro semanas deve estar entre 1 e 104"}, status=400
+        )
 
-    for mp in todas_materias:
+    hoje = timezone.localdate()
+    inicio = hoje - timedelta(days=hoje.weekday())
+    semanas = [inicio + timedelta(weeks=i) for i in range(total_semanas)]
+    fim = inicio + timedelta(weeks=total_semanas)
+
+    lotes = LoteMateriaPrima.objects.filter(
+        data_validade__gte=inicio, data_validade__lt=fim, quant_disponivel_kg__gt=0
+    )
+    if request.GET.get("materia_prima"):
         try:
-            if hasattr(mp, "data_validade_efetiva") and mp.data_validade_efetiva < hoje:
-                materias_vencidas.append(mp)
-        except Exception as e:
-            print(f"Erro ao verificar data_validade_efetiva para MP {mp.id}: {e}")
+            lotes = lotes.filter(materia_prima_id=int(request.GET["materia_prima"]))
+        except ValueError:
+            return JsonResponse(
+                {"error": "O parâmetro materia_prima deve ser um ID numérico"},
+                status=400,
+            )
+
+    grupos = (
+        lotes.annotate(semana=TruncWeek("data_validade"))
+        .values("materia_prima_id", "materia_prima__nome", "local_armazenamento", "semana")
+        .annotate(kg=Sum("quant_disponivel_kg"))
+        .order_by("materia_prima__nome", "local_armazenamento", "semana")
+    )
+
+    indice_semana = {semana: i for i, semana in enumerate(semanas)}
+    linhas = {}
+    for grupo in grupos:
+        chave = (grupo["materia_prima_id"], grupo["local_armazenamento"])
+        linha = linhas.setdefault(
+            chave,
+            {
+                "materia_prima_id": grupo["materia_prima_id"],
+                "nome": grupo["materia_prima__nome"],
+                "local_armazenamento": grupo["local_armazenamento"],
+                "kg": [0.0] * total_semanas,
+            },
+        )
+        semana = grupo["semana"]
+        if hasattr(semana, "date"):
+            semana = semana.date()
+        linha["kg"][indice_semana[semana]] += grupo["kg"]
 
-    # Se estiver usando em um JSON, certifique-se de usar getattr com valor padrão:
     return JsonResponse(
         {
-            "id": materia_prima.id,
-            # Outros campos...
-            "data_validade": materia_prima.data_validade,
-            # Use getattr para propriedades que podem não existir
-            "data_validade_efetiva": (
-                materia_prima.data_validade.isoformat()
-                if materia_prima.data_validade
-                else None
-            ),
-            # Outros campos...
+            "semanas": [semana.isoformat() for semana in semanas],
+            "linhas": list(linhas.values()),
+            "total_por_semana": [
+                sum(linha["kg"][i] for linha in linhas.values())
+                for i in range(total_semanas)
+            ],
         }
     )
+
+
+@csrf_exempt
+def materia_prima_alteracoes(request):
+    """Matérias primas criadas, alteradas ou excluídas desde o cursor ?since="""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    return resposta_alteracoes(
+        request,
+        MateriaPrima.objects.all(),
+        RecursoSincronizadoEnum.MATERIA_PRIMA,
+        _serializar_materia_prima_lista,
+    )
+
+
+@csrf_exempt
+def lote_alteracoes(request):
+    """Lotes criados, alterados ou excluídos desde o cursor ?since="""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    return resposta_alteracoes(
+        request,
+        LoteMateriaPrima.objects.select_related("materia_prima", "fornecedor"),
+        RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA,
+        _serializar_lote_sincronizacao,
+    )
@@ -0,0 +1,157 @@
+"""
+Alocação FEFO (first-expired, first-out) de lotes de matéria prima para a produção.
+"""
+
+from collections import OrderedDict
+
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When, Window
+from django.utils import timezone
+
+from sc_materiasPrimas.models import LoteMateriaPrima
+from sc_produtos.models import Ingrediente
+
+MG_POR_KG = 1_000_000
+
+# Tolerância para comparar quantidades em kg (float)
+EPSILON_KG = 1e-9
+
+# Tentativas de realocação quando outro processo consome um lote escolhido
+TENTATIVAS_ALOCACAO = 3
+
+
+def necessidades_por_materia_prima(formula, lote_tamanho):
+    """Quantidade necessária (kg) de cada matéria prima para um lote de lote_tamanho kg"""
+    fator = formula.fator_escala(lote_tamanho)
+    necessidades = OrderedDict()
+    ingredientes = (
+        Ingrediente.objects.filter(formula=formula)
+        .select_related("lote_materia_prima__materia_prima")
+        .order_by("id")
+    )
+    for ingrediente in ingredientes:
+        materia_prima = ingrediente.lote_materia_prima.materia_prima
+        item = necessidades.setdefault(
+            materia_prima.id, {"nome": materia_prima.nome, "necessario_kg": 0.0}
+        )
+        item["necessario_kg"] += ingrediente.quant_mg * fator / MG_POR_KG
+    return necessidades
+
+
+def _lotes_elegiveis(hoje):
+    """Lotes aprovados, com saldo e dentro da validade"""
+    return LoteMateriaPrima.objects.filter(
+        Q(data_validade__gte=hoje) | Q(data_validade__isnull=True),
+        aprovado_controle_qualidade=True,
+        quant_disponivel_kg__gt=0,
+    )
+
+
+def _candidatos_fefo(necessidades, hoje):
+    """
+    Lotes candidatos em ordem FEFO, já limitados no banco aos necessários:
+    um lote entra enquanto o saldo acumulado antes dele não cobrir a necessidade.
+    """
+    ordem_fefo = [F("data_validade").asc(nulls_last=True), F("id").asc()]
+    necessidade = Case(
+        *[
+            When(materia_prima_id=materia_prima_id, then=Value(item["necessario_kg"]))
+            for materia_prima_id, item in necessidades.items()
+        ],
+        output_field=FloatField(),
+    )
+    return (
+        _lotes_elegiveis(hoje)
+        .filter(materia_prima_id__in=necessidades)
+        .annotate(
+            acumulado_kg=Window(
+                Sum("quant_disponivel_kg"),
+                partition_by=[F("materia_prima_id")],
+                order_by=ordem_fefo,
+            )
+        )
+        .filter(acumulado_kg__lt=necessidade + F("quant_disponivel_kg") - EPSILON_KG)
+        .order_by("materia_prima_id", *ordem_fefo)
+        .values("id", "quant_disponivel_kg")
+    )
+
+
+def _distribuir(necessidades, lotes):
+    """Distribui a necessidade de cada matéria prima pelos lotes, na ordem recebida"""
+    resultado = OrderedDict(
+        (
+            materia_prima_id,
+            {
+                "materia_prima_id": materia_prima_id,
+                "nome": item["nome"],
+                "necessario_kg": item["necessario_kg"],
+                "alocado_kg": 0.0,
+                "lotes": [],
+            },
+        )
+        for materia_prima_id, item in necessidades.items()
+    )
+    for lote in lotes:
+        item = resultado[lote.materia_prima_id]
+        restante = item["necessario_kg"] - item["alocado_kg"]
+        if restante <= EPSILON_KG:
+            continue
+        quantidade = min(restante, lote.quant_disponivel_kg)
+        item["alocado_kg"] += quantidade
+        item["lotes"].append(
+            {
+                "lote_materia_prima_id": lote.id,
+                "numero_lote": lote.numero_lote,
+                "data_validade": lote.data_validade,
+                "quantidade_kg": quantidade,
+                "quant_consumida_mg": quantidade * MG_POR_KG,
+            }
+        )
+
+    for item in resultado.values():
+        item["faltante_kg"] = max(0.0, item["necessario_kg"] - item["alocado_kg"])
+    return list(resultado.values())
+
+
+def alocar_lotes_fefo(produto, lote_tamanho, hoje=None, travar=False):
+    """
+    Escolhe os lotes a consumir para produzir lote_tamanho kg do produto,
+    do vencimento mais próximo para o mais distante, dividindo entre lotes
+    quando necessário.
+
+    Com travar=True (deve ser chamado dentro de transaction.atomic) os lotes
+    escolhidos ficam bloqueados com SELECT ... FOR UPDATE até o fim da transação,
+    e a escolha é refeita se outro processo tiver consumido algum deles.
+    """
+    if hoje is None:
+        hoje = timezone.localdate()
+
+    necessidades = necessidades_por_materia_prima(produto.formula, lote_tamanho)
+    if not necessidades:
+        return {"completo": True, "materias_primas": []}
+
+    for _ in range(TENTATIVAS_ALOCACAO):
+        escolhidos = {
+            lote["id"]: lote["quant_disponivel_kg"]
+            for lote in _candidatos_fefo(necessidades, hoje)
+        }
+
+        # Uma consulta para carregar (e, se pedido, bloquear) apenas os lotes escolhidos
+        lotes = _lotes_elegiveis(hoje).filter(pk__in=escolhidos)
+        if travar:
+            # Mesma ordem de bloqueio do lançamento (por pk), evitando deadlock
+            lotes = lotes.select_for_update().order_by("pk")
+        lotes = {lote.id: lote for lote in lotes}
+
+        # Manter a ordem FEFO da consulta de candidatos
+        ordenados = [lotes[i] for i in escolhidos if i in lotes]
+        materias_primas = _distribuir(necessidades, ordenados)
+        completo = all(item["faltante_kg"] <= EPSILON_KG for item in materias_primas)
+
+        # Escolher de novo só se algum lote mudou entre a escolha e o bloqueio
+        inalterados = len(ordenados) == len(escolhidos) and all(
+            lote.quant_disponivel_kg == escolhidos[lote.id] for lote in ordenados
+        )
+        if completo or not travar or inalterados:
+            break
+
+    return {"completo": completo, "materias_primas": materias_primas}
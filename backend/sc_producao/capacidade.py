@@ -0,0 +1,134 @@
+"""
+Capacidade de produção: quantos lotes padrão de cada produto podem ser feitos
+com o estoque atual, e qual matéria prima limita cada um.
+"""
+
+import numpy as np
+from django.db.models import Sum
+from django.utils import timezone
+
+from sc_materiasPrimas.models import MateriaPrima
+from sc_produtos.models import Ingrediente, Produto
+from .alocacao import MG_POR_KG, _lotes_elegiveis
+
+# Evita perder um lote inteiro por erro de arredondamento (ex.: 2.9999999)
+TOLERANCIA_LOTES = 1e-9
+
+
+def _estoque_por_materia_prima(hoje):
+    """kg disponível em lotes utilizáveis (mesmo critério da alocação FEFO)"""
+    return dict(
+        _lotes_elegiveis(hoje)
+        .order_by()
+        .values("materia_prima_id")
+        .annotate(total=Sum("quant_disponivel_kg"))
+        .values_list("materia_prima_id", "total")
+    )
+
+
+def _limitantes(linhas, estoque):
+    """
+    Para cada fórmula, a matéria prima com a menor razão estoque / necessidade.
+    linhas é a matriz (formula_id, materia_prima_id, quant_mg) dos ingredientes.
+    """
+    if not len(linhas):
+        return {}
+
+    formulas, formula_idx = np.unique(linhas[:, 0].astype(np.int64), return_inverse=True)
+    materias, materia_idx = np.unique(linhas[:, 1].astype(np.int64), return_inverse=True)
+
+    # Soma os ingredientes da mesma matéria prima na fórmula (necessidade por lote)
+    pares, par_idx = np.unique(
+        formula_idx * len(materias) + materia_idx, return_inverse=True
+    )
+    necessario_kg = np.bincount(par_idx, weights=linhas[:, 2]) / MG_POR_KG
+    par_formula, par_materia = np.divmod(pares, len(materias))
+
+    disponivel_kg = np.array([estoque.get(int(m), 0.0) for m in materias], dtype=float)
+    razao = disponivel_kg[par_materia] / necessario_kg
+
+    # Os pares já estão ordenados por fórmula; ordenando também pela razão,
+    # o primeiro de cada grupo é a limitante
+    inicios = np.flatnonzero(np.r_[True, par_formula[1:] != par_formula[:-1]])
+    limitante = np.lexsort((razao, par_formula))[inicios]
+    return {
+        int(formulas[par_formula[par]]): {
+            "lotes": float(razao[par]),
+            "materia_prima_id": int(materias[par_materia[par]]),
+            "disponivel_kg": float(disponivel_kg[par_materia[par]]),
+            "necessario_kg_por_lote": float(necessario_kg[par]),
+        }
+        for par in limitante
+    }
+
+
+def capacidade_producao(produto_ids=None, hoje=None):
+    """
+    Lotes padrão (quant_kg_padrao) possíveis de cada produto.
+
+    A matriz fórmula x matéria prima é carregada uma vez e o cálculo é feito
+    para todas as fórmulas juntas: a razão estoque / necessidade de cada par
+    e o mínimo por fórmula, que dá a quantidade de lotes e a limitante.
+    """
+    if hoje is None:
+        hoje = timezone.localdate()
+
+    produtos = Produto.objects.order_by("id")
+    if produto_ids is not None:
+        produtos = produtos.filter(pk__in=produto_ids)
+    produtos = list(
+        produtos.values_list("id", "nome", "formula_id", "formula__quant_kg_padrao")
+    )
+
+    ingredientes = Ingrediente.objects.filter(quant_mg__gt=0)
+    if produto_ids is not None:
+        ingredientes = ingredientes.filter(
+            formula_id__in={formula_id for _, _, formula_id, _ in produtos}
+        )
+    linhas = np.array(
+        ingredientes.values_list(
+            "formula_id", "lote_materia_prima__materia_prima_id", "quant_mg"
+        ),
+        dtype=float,
+    ).reshape(-1, 3)
+
+    por_formula = _limitantes(linhas, _estoque_por_materia_prima(hoje))
+
+    nomes = dict(
+        MateriaPrima.objects.filter(
+            pk__in={item["materia_prima_id"] for item in por_formula.values()}
+        ).values_list("id", "nome")
+    )
+
+    resultado = []
+    for produto_id, nome, formula_id, quant_kg_padrao in produtos:
+        item = por_formula.get(formula_id)
+        if item is None:
+            # Fórmula sem ingredientes: não há o que limitar
+            resultado.append(
+                {
+                    "produto_id": produto_id,
+                    "nome": nome,
+                    "formula_id": formula_id,
+                    "lotes_possiveis": None,
+                    "kg_possiveis": None,
+                    "limitante": None,
+                }
+            )
+            continue
+        resultado.append(
+            {
+                "produto_id": produto_id,
+                "nome": nome,
+                "formula_id": formula_id,
+                "lotes_possiveis": int(np.floor(item["lotes"] + TOLERANCIA_LOTES)),
+                "kg_possiveis": round(item["lotes"] * quant_kg_padrao, 3),
+                "limitante": {
+                    "materia_prima_id": item["materia_prima_id"],
+                    "nome": nomes.get(item["materia_prima_id"]),
+                    "disponivel_kg": round(item["disponivel_kg"], 6),
+                    "necessario_kg_por_lote": round(item["necessario_kg_por_lote"], 6),
+                },
+            }
+        )
+    return resultado
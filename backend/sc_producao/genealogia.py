@@ -0,0 +1,166 @@
+"""
+Genealogia dos lotes: quais lotes de produção consumiram um lote de matéria
+prima (para frente, usado em recall) e quais lotes de matéria prima entraram em
+um lote de produção (para trás). Cada sentido é respondido em uma consulta,
+apoiada nos índices de LoteMateriaPrimaConsumida e LoteMateriaPrima.
+"""
+
+from django.db.models import Q
+from django.db.models.functions import Coalesce
+
+from sc_materiasPrimas.models import LoteMateriaPrima, MateriaPrima
+from .models import LoteMateriaPrimaConsumida
+
+# Campos do lote de matéria prima devolvidos nos dois sentidos
+CAMPOS_LOTE_MATERIA_PRIMA = (
+    "id",
+    "numero_lote",
+    "nota_fiscal",
+    "data_validade",
+    "materia_prima_id",
+    "materia_prima__nome",
+)
+
+
+def _fornecedor_efetivo(prefixo=""):
+    """O fornecedor do lote, quando informado; senão o da matéria prima"""
+    return Coalesce(f"{prefixo}fornecedor_id", f"{prefixo}materia_prima__fornecedor_id")
+
+
+def criterios_recall(fornecedor_id=None, numero_lote=None, nota_fiscal=None, lote_ids=None):
+    """
+    Filtro dos lotes de matéria prima atingidos por um recall. Os critérios
+    informados são combinados (E). O fornecedor vale para os lotes dele e para
+    os lotes sem fornecedor de matérias primas dele.
+    """
+    filtro = Q()
+    if fornecedor_id is not None:
+        # UNION de duas consultas indexadas: um OR através do JOIN com a matéria
+        # prima não usaria nenhum dos índices de fornecedor
+        do_fornecedor = LoteMateriaPrima.objects.filter(fornecedor_id=fornecedor_id)
+        sem_fornecedor = LoteMateriaPrima.objects.filter(
+            fornecedor__isnull=True,
+            materia_prima__in=MateriaPrima.objects.filter(
+                fornecedor_id=fornecedor_id
+            ).values("pk"),
+        )
+        filtro &= Q(pk__in=do_fornecedor.values("pk").union(sem_fornecedor.values("pk")))
+    if numero_lote:
+        filtro &= Q(numero_lote=numero_lote)
+    if nota_fiscal:
+        filtro &= Q(nota_fiscal=nota_fiscal)
+    if lote_ids:
+        filtro &= Q(pk__in=lote_ids)
+    return filtro
+
+
+def _serializar_lote_materia_prima(linha, prefixo=""):
+    """Lote de matéria prima a partir de uma linha de values()"""
+    validade = linha[f"{prefixo}data_validade"]
+    return {
+        "id": linha[f"{prefixo}id"],
+        "numero_lote": linha[f"{prefixo}numero_lote"],
+        "nota_fiscal": linha[f"{prefixo}nota_fiscal"],
+        "data_validade": validade.isoformat() if validade else None,
+        "materia_prima": {
+            "id": linha[f"{prefixo}materia_prima_id"],
+            "nome": linha[f"{prefixo}materia_prima__nome"],
+        },
+        "fornecedor_id": linha["fornecedor_efetivo"],
+    }
+
+
+def impacto_recall(filtro):
+    """
+    Lotes de matéria prima que atendem ao filtro e todos os lotes de produção
+    que consumiram algum deles, em uma consulta (LEFT JOIN dos lotes com os
+    consumos). Lotes nunca consumidos também aparecem, para bloqueio do estoque.
+    """
+    consumo = "lotemateriaprimaconsumida"
+    producao = f"{consumo}__lote_producao"
+    linhas = (
+        LoteMateriaPrima.objects.filter(filtro)
+        .annotate(fornecedor_efetivo=_fornecedor_efetivo())
+        .order_by("id", f"{producao}__data_producao", f"{producao}__id")
+        .values(
+            *CAMPOS_LOTE_MATERIA_PRIMA,
+            "fornecedor_efetivo",
+            "quant_disponivel_kg",
+            f"{consumo}__quant_consumida_mg",
+            f"{producao}__id",
+            f"{producao}__lote",
+            f"{producao}__data_producao",
+            f"{producao}__produto_id",
+            f"{producao}__produto__nome",
+        )
+    )
+
+    lotes_materia_prima, lotes_producao = {}, {}
+    for linha in linhas:
+        lote_mp = lotes_materia_prima.get(linha["id"])
+        if lote_mp is None:
+            lote_mp = _serializar_lote_materia_prima(linha)
+            lote_mp["quant_disponivel_kg"] = linha["quant_disponivel_kg"]
+            lote_mp["lotes_producao"] = []
+            lotes_materia_prima[linha["id"]] = lote_mp
+
+        producao_id = linha[f"{producao}__id"]
+        if producao_id is None:
+            continue
+        lote_mp["lotes_producao"].append(producao_id)
+
+        lote_producao = lotes_producao.get(producao_id)
+        if lote_producao is None:
+            lote_producao = lotes_producao[producao_id] = {
+                "id": producao_id,
+                "lote": linha[f"{producao}__lote"],
+                "data_producao": linha[f"{producao}__data_producao"].isoformat(),
+                "produto": {
+                    "id": linha[f"{producao}__produto_id"],
+                    "nome": linha[f"{producao}__produto__nome"],
+                },
+                "lotes_materia_prima": [],
+            }
+        lote_producao["lotes_materia_prima"].append(
+            {
+                "id": linha["id"],
+                "quant_consumida_mg": linha[f"{consumo}__quant_consumida_mg"],
+            }
+        )
+
+    return {
+        "lotes_materia_prima": list(lotes_materia_prima.values()),
+        "lotes_producao": sorted(
+            lotes_producao.values(), key=lambda item: (item["data_producao"], item["id"])
+        ),
+        "totais": {
+            "lotes_materia_prima": len(lotes_materia_prima),
+            "lotes_producao": len(lotes_producao),
+            "produtos": len({item["produto"]["id"] for item in lotes_producao.values()}),
+        },
+    }
+
+
+def origem_lote_producao(lote_producao_id):
+    """
+    Lotes de matéria prima consumidos por um lote de produção, com nota fiscal,
+    validade e fornecedor, em uma consulta
+    """
+    prefixo = "lote_materia_prima__"
+    linhas = (
+        LoteMateriaPrimaConsumida.objects.filter(lote_producao_id=lote_producao_id)
+        .annotate(fornecedor_efetivo=_fornecedor_efetivo(prefixo))
+        .order_by("id")
+        .values(
+            "quant_consumida_mg",
+            "fornecedor_efetivo",
+            *(f"{prefixo}{campo}" for campo in CAMPOS_LOTE_MATERIA_PRIMA),
+        )
+    )
+    return [
+        {
+            **_serializar_lote_materia_prima(linha, prefixo),
+            "quant_consumida_mg": linha["quant_consumida_mg"],
+        }
+        for linha in linhas
+    ]
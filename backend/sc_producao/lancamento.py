@@ -0,0 +1,262 @@
+"""
+Lançamento (e estorno) de lotes de produção: a baixa dos lotes de matéria
+prima consumidos é feita em uma única transação, com número fixo de consultas.
+"""
+
+from collections import OrderedDict
+
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.lookups import LessThanOrEqual
+from django.utils import timezone
+
+from sc_materiasPrimas.models import (
+    LoteMateriaPrima,
+    MateriaPrima,
+    MovimentacaoEstoque,
+    RecursoSincronizadoEnum,
+    RegistroAlteracao,
+    TipoMovimentacaoEnum,
+    invalidar_cache_valor_estoque,
+)
+from sc_produtos.models import VersaoFormula
+from .alocacao import EPSILON_KG, MG_POR_KG, alocar_lotes_fefo
+from .models import LoteMateriaPrimaConsumida, LoteProducao
+
+
+class ErroLancamento(ValueError):
+    """Erro de validação do lançamento; status é o código HTTP sugerido"""
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def _ler_consumos(materiais):
+    """
+    Converte os materiais recebidos em {lote_materia_prima_id: mg}, somando
+    lotes repetidos
+    """
+    consumos = OrderedDict()
+    for material in materiais:
+        try:
+            lote_id = int(material.get("lote_materia_prima_id"))
+        except (AttributeError, TypeError, ValueError):
+            raise ErroLancamento("O campo lote_materia_prima_id deve ser um ID numérico")
+        try:
+            quant_mg = float(material.get("quant_consumida_mg"))
+        except (TypeError, ValueError):
+            raise ErroLancamento("O campo quant_consumida_mg deve ser numérico")
+        if quant_mg <= 0:
+            raise ErroLancamento("O campo quant_consumida_mg deve ser maior que zero")
+        consumos[lote_id] = consumos.get(lote_id, 0.0) + quant_mg
+    return consumos
+
+
+def _alocar_consumos(produto, lote_tamanho, data_producao):
+    """
+    Consumos ({lote_materia_prima_id: mg}) escolhidos pela alocação FEFO, com os
+    lotes bloqueados até o fim da transação. Falta de estoque impede o lançamento.
+    Um lançamento retroativo não consome lotes que já venceram hoje.
+    """
+    hoje = max(data_producao, timezone.localdate())
+    alocacao = alocar_lotes_fefo(produto, lote_tamanho, hoje=hoje, travar=True)
+    if not alocacao["completo"]:
+        faltas = ", ".join(
+            f"{item['nome']} ({item['faltante_kg']:.3f}kg)"
+            for item in alocacao["materias_primas"]
+            if item["faltante_kg"] > EPSILON_KG
+        )
+        raise ErroLancamento(f"Estoque insuficiente para o lote: faltam {faltas}", status=409)
+
+    consumos = OrderedDict()
+    for item in alocacao["materias_primas"]:
+        for lote in item["lotes"]:
+            lote_id = lote["lote_materia_prima_id"]
+            consumos[lote_id] = consumos.get(lote_id, 0.0) + lote["quant_consumida_mg"]
+    return consumos
+
+
+def _por_chave(valores):
+    """Case com o valor de cada pk, para atualizar várias linhas em um UPDATE"""
+    return Case(
+        *[When(pk=chave, then=Value(valor)) for chave, valor in valores.items()],
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def _somar_por_materia_prima(kg_por_lote, materia_prima_por_lote):
+    kg_por_materia_prima = {}
+    for lote_id, quant_kg in kg_por_lote.items():
+        materia_prima_id = materia_prima_por_lote[lote_id]
+        kg_por_materia_prima[materia_prima_id] = (
+            kg_por_materia_prima.get(materia_prima_id, 0.0) + quant_kg
+        )
+    return kg_por_materia_prima
+
+
+def _ajustar_materias_primas(variacao_kg):
+    """
+    Soma a variação (negativa na baixa) ao estoque de cada matéria prima em um
+    UPDATE, mantendo o estoque igual à soma dos lotes (ver reconciliacao.py)
+    """
+    novo = F("quantidade_disponivel") + _por_chave(variacao_kg)
+    MateriaPrima.objects.filter(pk__in=variacao_kg).update(
+        quantidade_disponivel=Greatest(novo, Value(0.0)),
+        _status_interno=Case(
+            When(LessThanOrEqual(novo, EPSILON_KG), then=Value("esgotado")),
+            When(_status_interno="esgotado", then=Value("disponível")),
+            default=F("_status_interno"),
+        ),
+        atualizado_em=timezone.now(),
+    )
+    RegistroAlteracao.registrar(RecursoSincronizadoEnum.MATERIA_PRIMA, variacao_kg)
+    invalidar_cache_valor_estoque()
+
+
+def lancar_producao(produto, lote, lote_tamanho, data_producao, materiais):
+    """
+    Cria o lote de produção e dá baixa nos lotes de matéria prima consumidos.
+    Sem materiais informados, os lotes são escolhidos pela alocação FEFO na
+    data de produção (ou hoje, se for retroativa), dentro da mesma transação.
+
+    Tudo acontece em uma transação: os lotes envolvidos são bloqueados em uma
+    consulta, as quantidades (mg) são convertidas para kg e validadas, e só
+    então são gravados os consumos (bulk_create), as baixas (UPDATE condicional
+    com F()) e as movimentações. Qualquer erro desfaz o lançamento inteiro.
+
+    Retorna (lote_producao, consumos) com os lotes de matéria prima já carregados.
+    """
+    consumos_mg = _ler_consumos(materiais)
+
+    with transaction.atomic():
+        if not consumos_mg:
+            consumos_mg = _alocar_consumos(produto, lote_tamanho, data_producao)
+        consumos_kg = {lote_id: mg / MG_POR_KG for lote_id, mg in consumos_mg.items()}
+
+        # Ordem fixa de bloqueio evita deadlock entre lançamentos concorrentes
+        lotes = {
+            lote_mp.id: lote_mp
+            for lote_mp in LoteMateriaPrima.objects.select_for_update(of=("self",))
+            .select_related("materia_prima")
+            .filter(pk__in=consumos_kg)
+            .order_by("pk")
+        }
+
+        for lote_id, quant_kg in consumos_kg.items():
+            lote_mp = lotes.get(lote_id)
+            if lote_mp is None:
+                raise ErroLancamento(
+                    f"Lote de matéria-prima com ID {lote_id} não encontrado", status=404
+                )
+            if lote_mp.quant_disponivel_kg < quant_kg - EPSILON_KG:
+                raise ErroLancamento(
+                    f"Quantidade insuficiente para o lote de matéria-prima "
+                    f"{lote_mp.numero_lote}. Disponível: {lote_mp.quant_disponivel_kg}kg"
+                )
+
+        lote_producao = LoteProducao.objects.create(
+            produto=produto,
+            lote=lote,
+            lote_tamanho=lote_tamanho,
+            data_producao=data_producao,
+            versao_formula=VersaoFormula.registrar(produto.formula),
+        )
+        consumos = LoteMateriaPrimaConsumida.objects.bulk_create(
+            [
+                LoteMateriaPrimaConsumida(
+                    lote_producao=lote_producao,
+                    lote_materia_prima=lotes[lote_id],
+                    quant_consumida_mg=quant_mg,
+                )
+                for lote_id, quant_mg in consumos_mg.items()
+            ]
+        )
+
+        if consumos_kg:
+            # Baixa condicional: cada lote só é atualizado se ainda tiver saldo
+            saldo_suficiente = Q()
+            for lote_id, quant_kg in consumos_kg.items():
+                saldo_suficiente |= Q(
+                    pk=lote_id, quant_disponivel_kg__gte=quant_kg - EPSILON_KG
+                )
+            atualizados = LoteMateriaPrima.objects.filter(saldo_suficiente).update(
+                quant_disponivel_kg=Greatest(
+                    F("quant_disponivel_kg") - _por_chave(consumos_kg), Value(0.0)
+                ),
+                atualizado_em=timezone.now(),
+            )
+            if atualizados != len(consumos_kg):
+                raise ErroLancamento(
+                    "O saldo de um dos lotes mudou durante o lançamento. Tente novamente"
+                )
+            RegistroAlteracao.registrar(
+                RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA, consumos_kg
+            )
+
+            kg_por_materia_prima = _somar_por_materia_prima(
+                consumos_kg, {i: lote_mp.materia_prima_id for i, lote_mp in lotes.items()}
+            )
+            _ajustar_materias_primas({i: -kg for i, kg in kg_por_materia_prima.items()})
+
+            MovimentacaoEstoque.objects.bulk_create(
+                [
+                    MovimentacaoEstoque(
+                        tipo=TipoMovimentacaoEnum.CONSUMO,
+                        quantidade_kg=-quant_kg,
+                        materia_prima_id=lotes[lote_id].materia_prima_id,
+                        lote_id=lote_id,
+                        observacao=f"Lote de produção {lote}"[:255],
+                    )
+                    for lote_id, quant_kg in consumos_kg.items()
+                ]
+            )
+
+    return lote_producao, consumos
+
+
+def estornar_producao(lote_producao):
+    """
+    Exclui o lote de produção devolvendo aos lotes de matéria prima (e às
+    matérias primas) as quantidades consumidas, em uma transação.
+    """
+    consumos = lote_producao.materias_consumidas.values_list(
+        "lote_materia_prima_id",
+        "lote_materia_prima__materia_prima_id",
+        "quant_consumida_mg",
+    )
+    with transaction.atomic():
+        devolucoes_kg, materias_primas = {}, {}
+        for lote_id, materia_prima_id, quant_mg in consumos:
+            devolucoes_kg[lote_id] = devolucoes_kg.get(lote_id, 0.0) + quant_mg / MG_POR_KG
+            materias_primas[lote_id] = materia_prima_id
+
+        if devolucoes_kg:
+            LoteMateriaPrima.objects.filter(pk__in=devolucoes_kg).update(
+                quant_disponivel_kg=F("quant_disponivel_kg") + _por_chave(devolucoes_kg),
+                atualizado_em=timezone.now(),
+            )
+            RegistroAlteracao.registrar(
+                RecursoSincronizadoEnum.LOTE_MATERIA_PRIMA, devolucoes_kg
+            )
+            _ajustar_materias_primas(
+                _somar_por_materia_prima(devolucoes_kg, materias_primas)
+            )
+
+            observacao = f"Estorno do lote de produção {lote_producao.lote}"[:255]
+            MovimentacaoEstoque.objects.bulk_create(
+                [
+                    MovimentacaoEstoque(
+                        tipo=TipoMovimentacaoEnum.AJUSTE,
+                        quantidade_kg=quant_kg,
+                        materia_prima_id=materias_primas[lote_id],
+                        lote_id=lote_id,
+                        observacao=observacao,
+                    )
+                    for lote_id, quant_kg in devolucoes_kg.items()
+                ]
+            )
+
+        lote_producao.delete()
@@ -0,0 +1,256 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from sc_fornecedores.models import Fornecedor
+from sc_materiasPrimas.models import LoteMateriaPrima, MateriaPrima
+from sc_producao.alocacao import _lotes_elegiveis
+from sc_producao.models import LoteProducao
+from sc_produtos.models import Formula, Produto
+
+STATUS_MATERIA_PRIMA = ["disponível", "próximo ao vencimento", "vencido", "esgotado"]
+LOCAIS = ["A1", "A2", "B1", "B2", "Câmara fria"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mostra o plano de execução (EXPLAIN) e o tempo das consultas mais "
+        "frequentes, opcionalmente sobre uma massa de dados fictícia"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--lotes",
+            type=int,
+            default=0,
+            help=(
+                "Cria essa quantidade de lotes fictícios (e matérias primas, produtos "
+                "e lotes de produção proporcionais) antes de medir. Tudo é desfeito "
+                "ao final. Com 0 (padrão) usa os dados existentes."
+            ),
+        )
+        parser.add_argument(
+            "--repeticoes", type=int, default=5, help="Execuções de cada consulta"
+        )
+        parser.add_argument(
+            "--falhar-com-varredura",
+            action="store_true",
+            help="Termina com erro se alguma consulta fizer varredura completa",
+        )
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            if kwargs["lotes"]:
+                inicio = time.perf_counter()
+                self._popular(kwargs["lotes"])
+                self.stdout.write(
+                    f"Massa de dados criada em {time.perf_counter() - inicio:.1f}s"
+                )
+
+            varreduras = []
+            for nome, consulta in self._consultas():
+                plano = consulta.explain()
+                tempos = []
+                for _ in range(kwargs["repeticoes"]):
+                    inicio = time.perf_counter()
+                    linhas = len(list(consulta.all()))
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+
+                varredura = self._varredura_completa(plano)
+                if varredura:
+                    varreduras.append(nome)
+                estilo = self.style.WARNING if varredura else self.style.SUCCESS
+                self.stdout.write(
+                    estilo(
+                        f"{nome}: {statistics.median(tempos):.2f} ms "
+                        f"({linhas} linha(s))"
+                    )
+                )
+                for linha_plano in plano.splitlines():
+                    self.stdout.write(f"    {linha_plano}")
+
+            # A massa de dados fictícia nunca é gravada
+            transaction.set_rollback(True)
+
+        if varreduras:
+            mensagem = f"Consultas com varredura completa: {', '.join(varreduras)}"
+            if kwargs["falhar_com_varredura"]:
+                raise CommandError(mensagem)
+            self.stdout.write(self.style.WARNING(mensagem))
+        else:
+            self.stdout.write(self.style.SUCCESS("Nenhuma varredura completa"))
+
+    @staticmethod
+    def _varredura_completa(plano):
+        if connection.vendor == "postgresql":
+            return "Seq Scan" in plano
+        # SQLite: "SCAN tabela" sem índice percorre a tabela inteira
+        return any(
+            linha.strip().startswith("SCAN") and "USING" not in linha
+            for linha in plano.splitlines()
+        )
+
+    def _consultas(self):
+        hoje = timezone.localdate()
+        materia_prima_id = (
+            LoteMateriaPrima.objects.aggregate(id=Max("materia_prima_id"))["id"] or 0
+        )
+        fornecedor_id = MateriaPrima.objects.aggregate(id=Max("fornecedor_id"))["id"]
+        produto_id = LoteProducao.objects.aggregate(id=Max("produto_id"))["id"] or 0
+        codigo = (
+            LoteMateriaPrima.objects.exclude(codigo_rastreabilidade="")
+            .values_list("codigo_rastreabilidade", flat=True)
+            .last()
+        )
+
+        return [
+            (
+                "Lotes FEFO de uma matéria prima",
+                _lotes_elegiveis(hoje)
+                .filter(materia_prima_id=materia_prima_id)
+                .order_by("data_validade", "id"),
+            ),
+            (
+                "Lotes de uma matéria prima vencendo em 30 dias",
+                LoteMateriaPrima.objects.filter(
+                    materia_prima_id=materia_prima_id,
+                    data_validade__lt=hoje + timedelta(days=30),
+                ),
+            ),
+            (
+                "Lotes vencendo em 7 dias (vence_antes)",
+                LoteMateriaPrima.objects.filter(
+                    data_validade__gte=hoje,
+                    data_validade__lt=hoje + timedelta(days=7),
+                ),
+            ),
+            (
+                "Calendário de vencimento (4 semanas)",
+                LoteMateriaPrima.objects.filter(
+                    data_validade__gte=hoje,
+                    data_validade__lt=hoje + timedelta(weeks=4),
+                    quant_disponivel_kg__gt=0,
+                )
+                .annotate(semana=TruncWeek("data_validade"))
+                .values("materia_prima_id", "local_armazenamento", "semana")
+                .annotate(kg=Sum("quant_disponivel_kg"))
+                .order_by(),
+            ),
+            (
+                "Lote pelo código de rastreabilidade",
+                LoteMateriaPrima.objects.filter(codigo_rastreabilidade=codigo),
+            ),
+            (
+                "Matérias primas próximas ao vencimento",
+                MateriaPrima.objects.filter(
+                    _status_interno="próximo ao vencimento"
+                ).order_by("data_validade_efetiva"),
+            ),
+            (
+                "Matérias primas de um fornecedor",
+                MateriaPrima.objects.filter(fornecedor_id=fornecedor_id).order_by(
+                    "data_validade_efetiva"
+                ),
+            ),
+            (
+                "Produção de um produto nos últimos 90 dias",
+                LoteProducao.objects.filter(
+                    produto_id=produto_id,
+                    data_producao__gte=hoje - timedelta(days=90),
+                ).order_by("data_producao"),
+            ),
+            (
+                "Sincronização de matérias primas sem alterações",
+                MateriaPrima.objects.filter(atualizado_em__gt=timezone.now()),
+            ),
+        ]
+
+    def _popular(self, total_lotes):
+        aleatorio = random.Random(42)
+        hoje = timezone.localdate()
+        total_materias = max(total_lotes // 20, 1)
+        total_produtos = max(total_lotes // 500, 1)
+
+        fornecedores = Fornecedor.objects.bulk_create(
+            [
+                Fornecedor(
+                    cnpj=f"bench-{i}", razao_social=f"Fornecedor {i}", fantasia=f"F{i}"
+                )
+                for i in range(50)
+            ]
+        )
+        primeiro_codigo = (
+            MateriaPrima.objects.aggregate(codigo=Max("cod_interno"))["codigo"] or 0
+        ) + 1
+        materias = MateriaPrima.objects.bulk_create(
+            [
+                MateriaPrima(
+                    cod_interno=primeiro_codigo + i,
+                    nome=f"Matéria prima {i}",
+                    fornecedor=aleatorio.choice(fornecedores),
+                    data_validade=hoje + timedelta(days=aleatorio.randint(-60, 720)),
+                    data_validade_efetiva=hoje
+                    + timedelta(days=aleatorio.randint(-60, 720)),
+                    quantidade_disponivel=aleatorio.uniform(0, 500),
+                    _status_interno=aleatorio.choice(STATUS_MATERIA_PRIMA),
+                )
+                for i in range(total_materias)
+            ],
+            batch_size=1000,
+        )
+        LoteMateriaPrima.objects.bulk_create(
+            (
+                LoteMateriaPrima(
+                    materia_prima=aleatorio.choice(materias),
+                    numero_lote=f"BENCH-{i}",
+                    data_fabricacao=hoje - timedelta(days=aleatorio.randint(0, 365)),
+                    data_validade=hoje + timedelta(days=aleatorio.randint(-60, 720)),
+                    nota_fiscal=str(i),
+                    quant_recebida_kg=100,
+                    quant_disponivel_kg=aleatorio.choice([0, aleatorio.uniform(0, 100)]),
+                    aprovado_controle_qualidade=aleatorio.random() < 0.9,
+                    local_armazenamento=aleatorio.choice(LOCAIS),
+                    codigo_rastreabilidade=f"RAST-{i}",
+                )
+                for i in range(total_lotes)
+            ),
+            batch_size=1000,
+        )
+
+        formula = Formula.objects.create(
+            forma_farmaceutica="comprimido", quant_unid_padrao=1000, quant_kg_padrao=1
+        )
+        produtos = Produto.objects.bulk_create(
+            [
+                Produto(
+                    nome=f"Produto {i}",
+                    descricao="",
+                    apresentacao="Embalagem com 30 unidades",
+                    formula=formula,
+                )
+                for i in range(total_produtos)
+            ]
+        )
+        LoteProducao.objects.bulk_create(
+            (
+                LoteProducao(
+                    produto=aleatorio.choice(produtos),
+                    lote=f"BENCH-{i}",
+                    lote_tamanho=aleatorio.uniform(1, 50),
+                    data_producao=hoje - timedelta(days=aleatorio.randint(0, 730)),
+                )
+                for i in range(total_lotes // 5)
+            ),
+            batch_size=1000,
+        )
+
+        # Estatísticas atualizadas para o otimizador escolher os índices
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
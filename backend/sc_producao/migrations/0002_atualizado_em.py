@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_producao', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loteproducao',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
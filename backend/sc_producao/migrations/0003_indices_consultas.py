@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_producao', '0002_atualizado_em'),
+        ('sc_produtos', '0002_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loteproducao',
+            index=models.Index(fields=['produto', 'data_producao'], name='lote_producao_produto_data_idx'),
+        ),
+    ]
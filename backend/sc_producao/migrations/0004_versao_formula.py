@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 13:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_producao', '0003_indices_consultas'),
+        ('sc_produtos', '0003_versao_formula'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loteproducao',
+            name='versao_formula',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='lotes_producao', to='sc_produtos.versaoformula'),
+        ),
+    ]
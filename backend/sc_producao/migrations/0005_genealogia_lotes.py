@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0010_genealogia_lotes'),
+        ('sc_producao', '0004_versao_formula'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lotemateriaprimaconsumida',
+            index=models.Index(fields=['lote_materia_prima', 'lote_producao'], name='consumo_lote_mp_producao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lotemateriaprimaconsumida',
+            index=models.Index(fields=['lote_producao', 'lote_materia_prima'], name='consumo_producao_lote_mp_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-18 14:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_materiasPrimas', '0013_reparar_registro_alteracao'),
+        ('sc_producao', '0005_genealogia_lotes'),
+        ('sc_produtos', '0003_versao_formula'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lotemateriaprimaconsumida',
+            name='lote_materia_prima',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, to='sc_materiasPrimas.lotemateriaprima'),
+        ),
+        migrations.AlterField(
+            model_name='lotemateriaprimaconsumida',
+            name='lote_producao',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='materias_consumidas', to='sc_producao.loteproducao'),
+        ),
+        migrations.AlterField(
+            model_name='loteproducao',
+            name='produto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='sc_produtos.produto'),
+        ),
+    ]
@@ -2,20 +2,62 @@ from django.db import models
 
 # Create your models here.
 from django.db import models
-from sc_produtos.models import Produto
+from sc_produtos.models import Produto, VersaoFormula
 from sc_materiasPrimas.models import LoteMateriaPrima
 
 
 class LoteProducao(models.Model):
-    produto = models.ForeignKey(Produto, on_delete=models.CASCADE)
+    # Produto com lotes produzidos não pode ser excluído (genealogia para recall)
+    produto = models.ForeignKey(Produto, on_delete=models.PROTECT)
     lote = models.CharField(max_length=50)
     lote_tamanho = models.FloatField()
     data_producao = models.DateField()
+    # Receita usada na produção (nula nos lotes anteriores ao versionamento)
+    versao_formula = models.ForeignKey(
+        VersaoFormula,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name="lotes_producao",
+    )
+    atualizado_em = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Histórico de produção de um produto por data
+            models.Index(
+                fields=["produto", "data_producao"],
+                name="lote_producao_produto_data_idx",
+            ),
+        ]
 
 
 class LoteMateriaPrimaConsumida(models.Model):
+    # Sem índice próprio nas chaves: os índices compostos abaixo começam por elas
     lote_producao = models.ForeignKey(
-        LoteProducao, on_delete=models.CASCADE, related_name="materias_consumidas"
+        LoteProducao,
+        on_delete=models.CASCADE,
+        related_name="materias_consumidas",
+        db_index=False,
+    )
+    # Um lote de matéria prima consumido não pode ser excluído: a genealogia
+    # (recall) dos lotes de produção depende dele
+    lote_materia_prima = models.ForeignKey(
+        LoteMateriaPrima, on_delete=models.PROTECT, db_index=False
     )
-    lote_materia_prima = models.ForeignKey(LoteMateriaPrima, on_delete=models.CASCADE)
     quant_consumida_mg = models.FloatField()
+
+    class Meta:
+        indexes = [
+            # Genealogia para frente (recall): lotes de produção de um lote de
+            # matéria prima, sem ler a tabela
+            models.Index(
+                fields=["lote_materia_prima", "lote_producao"],
+                name="consumo_lote_mp_producao_idx",
+            ),
+            # Genealogia para trás: lotes de matéria prima de um lote de produção
+            models.Index(
+                fields=["lote_producao", "lote_materia_prima"],
+                name="consumo_producao_lote_mp_idx",
+            ),
+        ]
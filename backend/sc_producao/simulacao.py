@@ -0,0 +1,191 @@
+"""
+Simulação de um plano de produção contra o estoque atual, sem gravar nada.
+Estoque e fórmulas são carregados uma vez em arrays e o plano é repetido em
+memória, em ordem de data, consumindo os lotes em ordem FEFO.
+"""
+
+from datetime import date
+
+import numpy as np
+from django.db.models import F
+from django.utils import timezone
+
+from sc_materiasPrimas.models import MateriaPrima
+from sc_produtos.models import Ingrediente, Produto
+from .alocacao import EPSILON_KG, MG_POR_KG, _lotes_elegiveis
+
+# Lotes sem validade ficam por último na ordem FEFO
+SEM_VALIDADE = date.max.toordinal()
+
+
+def ler_plano(itens):
+    """
+    Valida o plano recebido ([{produto_id, lote_tamanho, data_producao}]).
+    Retorna (plano, erros), com as datas já convertidas.
+    """
+    plano, erros = [], []
+    for indice, item in enumerate(itens):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Item do plano deve ser um objeto")
+            try:
+                produto_id = int(item.get("produto_id"))
+            except (TypeError, ValueError):
+                raise ValueError("O campo produto_id deve ser um ID numérico")
+            try:
+                lote_tamanho = float(item.get("lote_tamanho"))
+            except (TypeError, ValueError):
+                lote_tamanho = 0
+            if lote_tamanho <= 0:
+                raise ValueError("O campo lote_tamanho deve ser um número maior que zero")
+            try:
+                data_producao = date.fromisoformat(str(item.get("data_producao")))
+            except ValueError:
+                raise ValueError("O campo data_producao deve estar no formato YYYY-MM-DD")
+            plano.append((indice, produto_id, lote_tamanho, data_producao))
+        except ValueError as e:
+            erros.append({"indice": indice, "erro": str(e)})
+    return plano, erros
+
+
+def _carregar_estoque(materia_prima_ids, hoje):
+    """
+    Lotes utilizáveis das matérias primas em arrays ordenados por matéria prima
+    e, dentro dela, em ordem FEFO. Retorna os arrays e o intervalo de cada
+    matéria prima ({id: (inicio, fim)}).
+    """
+    lotes = list(
+        _lotes_elegiveis(hoje)
+        .filter(materia_prima_id__in=materia_prima_ids)
+        .order_by(
+            "materia_prima_id", F("data_validade").asc(nulls_last=True), "id"
+        )
+        .values_list(
+            "id", "numero_lote", "materia_prima_id", "data_validade", "quant_disponivel_kg"
+        )
+    )
+    estoque = {
+        "id": np.array([lote[0] for lote in lotes], dtype=np.int64),
+        "numero_lote": [lote[1] for lote in lotes],
+        "validade": np.array(
+            [lote[3].toordinal() if lote[3] else SEM_VALIDADE for lote in lotes],
+            dtype=np.int64,
+        ),
+        "saldo": np.array([lote[4] for lote in lotes], dtype=float),
+    }
+    materias = np.array([lote[2] for lote in lotes], dtype=np.int64)
+    ids, inicios = np.unique(materias, return_index=True)
+    fins = np.r_[inicios[1:], len(materias)]
+    intervalos = {int(m): (int(i), int(f)) for m, i, f in zip(ids, inicios, fins)}
+    return estoque, intervalos
+
+
+def simular_plano(plano, hoje=None):
+    """
+    Executa o plano (lista de (indice, produto_id, lote_tamanho, data_producao))
+    contra o estoque atual. Cada lote planejado consome, em ordem de data, os
+    lotes de matéria prima ainda válidos na data de produção.
+
+    Retorna os lotes planejados com as faltas de cada um e os conflitos de
+    validade: lotes com saldo que vencem antes de serem usados.
+    """
+    if hoje is None:
+        hoje = timezone.localdate()
+
+    produtos = {
+        produto_id: (nome, formula_id, quant_kg_padrao)
+        for produto_id, nome, formula_id, quant_kg_padrao in Produto.objects.filter(
+            pk__in={item[1] for item in plano}
+        ).values_list("id", "nome", "formula_id", "formula__quant_kg_padrao")
+    }
+
+    # kg de cada matéria prima por lote padrão de cada fórmula
+    necessidades = {}
+    for formula_id, materia_prima_id, quant_mg in Ingrediente.objects.filter(
+        formula_id__in={formula_id for _, formula_id, _ in produtos.values()}
+    ).values_list("formula_id", "lote_materia_prima__materia_prima_id", "quant_mg"):
+        por_materia = necessidades.setdefault(formula_id, {})
+        por_materia[materia_prima_id] = (
+            por_materia.get(materia_prima_id, 0.0) + quant_mg / MG_POR_KG
+        )
+
+    materia_prima_ids = {m for item in necessidades.values() for m in item}
+    nomes = dict(
+        MateriaPrima.objects.filter(pk__in=materia_prima_ids).values_list("id", "nome")
+    )
+    estoque, intervalos = _carregar_estoque(materia_prima_ids, hoje)
+    saldo, validade = estoque["saldo"], estoque["validade"]
+
+    resultado, conflitos, vencidos = [], [], set()
+    for indice, produto_id, lote_tamanho, data_producao in sorted(
+        plano, key=lambda item: (item[3], item[0])
+    ):
+        item = {
+            "indice": indice,
+            "produto_id": produto_id,
+            "lote_tamanho": lote_tamanho,
+            "data_producao": data_producao.isoformat(),
+            "completo": False,
+            "faltas": [],
+        }
+        resultado.append(item)
+        if produto_id not in produtos:
+            item["erro"] = f"Produto com ID {produto_id} não encontrado"
+            continue
+        nome, formula_id, quant_kg_padrao = produtos[produto_id]
+        item["nome"] = nome
+        if not quant_kg_padrao:
+            item["erro"] = "A fórmula não possui quantidade padrão em kg"
+            continue
+
+        fator = lote_tamanho / quant_kg_padrao
+        dia = data_producao.toordinal()
+        for materia_prima_id, kg_por_lote in necessidades.get(formula_id, {}).items():
+            necessario = kg_por_lote * fator
+            inicio, fim = intervalos.get(materia_prima_id, (0, 0))
+
+            # Na ordem FEFO os lotes vencidos na data ficam no começo do intervalo
+            primeiro_valido = inicio + int(
+                np.searchsorted(validade[inicio:fim], dia, side="left")
+            )
+            for posicao in np.flatnonzero(saldo[inicio:primeiro_valido] > EPSILON_KG):
+                posicao += inicio
+                if posicao not in vencidos:
+                    vencidos.add(posicao)
+                    conflitos.append(
+                        {
+                            "lote_materia_prima_id": int(estoque["id"][posicao]),
+                            "numero_lote": estoque["numero_lote"][posicao],
+                            "materia_prima_id": materia_prima_id,
+                            "nome": nomes.get(materia_prima_id),
+                            "data_validade": date.fromordinal(
+                                int(validade[posicao])
+                            ).isoformat(),
+                            "saldo_kg": round(float(saldo[posicao]), 6),
+                            "necessario_em": data_producao.isoformat(),
+                            "indice_plano": indice,
+                        }
+                    )
+
+            # Consumo FEFO vetorizado nos lotes válidos
+            disponivel = saldo[primeiro_valido:fim]
+            acumulado = np.cumsum(disponivel)
+            consumo = np.clip(necessario - (acumulado - disponivel), 0.0, disponivel)
+            saldo[primeiro_valido:fim] -= consumo
+
+            faltante = necessario - float(consumo.sum())
+            if faltante > EPSILON_KG:
+                item["faltas"].append(
+                    {
+                        "materia_prima_id": materia_prima_id,
+                        "nome": nomes.get(materia_prima_id),
+                        "necessario_kg": round(necessario, 6),
+                        "faltante_kg": round(faltante, 6),
+                    }
+                )
+        item["completo"] = not item["faltas"]
+
+    return {
+        "lotes_planejados": sorted(resultado, key=lambda item: item["indice"]),
+        "conflitos_validade": conflitos,
+    }
@@ -1,3 +1,253 @@
+import json
+from datetime import date, timedelta
+from unittest import mock
+
+from django.db import connection
+from django.db.models import ProtectedError, Sum
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from sc_fornecedores.models import Fornecedor
+from sc_materiasPrimas.models import LoteMateriaPrima, MateriaPrima, MovimentacaoEstoque
+from sc_produtos.models import (
+    ApresentacaoEnum,
+    FormaFarmaceuticaEnum,
+    Formula,
+    Ingrediente,
+    Produto,
+    VersaoFormula,
+)
+from .lancamento import ErroLancamento, estornar_producao, lancar_producao
+from .models import LoteMateriaPrimaConsumida, LoteProducao
+
+
+class ProducaoTestCase(TestCase):
+    """
+    Duas matérias primas com 10kg cada: A em dois lotes (A1 vence antes de A2)
+    e B em um. A fórmula usa 2kg de A e 1kg de B por kg de produto.
+    """
+
+    def setUp(self):
+        self.hoje = date.today()
+        fornecedor = Fornecedor.objects.create(
+            cnpj="00.000.000/0001-00", razao_social="Fornecedor", fantasia="F"
+        )
+        self.materia_a = MateriaPrima.objects.create(
+            cod_interno=1, nome="A", fornecedor=fornecedor, quantidade_disponivel=10.0
+        )
+        self.materia_b = MateriaPrima.objects.create(
+            cod_interno=2, nome="B", fornecedor=fornecedor, quantidade_disponivel=10.0
+        )
+        self.lote_a1 = self.criar_lote(self.materia_a, "A1", 6.0, dias_validade=30)
+        self.lote_a2 = self.criar_lote(self.materia_a, "A2", 4.0, dias_validade=60)
+        self.lote_b1 = self.criar_lote(self.materia_b, "B1", 10.0, dias_validade=90)
+
+        formula = Formula.objects.create(
+            forma_farmaceutica=FormaFarmaceuticaEnum.COMPRIMIDO,
+            quant_unid_padrao=1000,
+            quant_kg_padrao=1.0,
+        )
+        Ingrediente.objects.create(
+            formula=formula, lote_materia_prima=self.lote_a1, quant_mg=2_000_000
+        )
+        Ingrediente.objects.create(
+            formula=formula, lote_materia_prima=self.lote_b1, quant_mg=1_000_000
+        )
+        self.produto = Produto.objects.create(
+            nome="Produto",
+            descricao="",
+            apresentacao=ApresentacaoEnum.EMBALAGEM_30,
+            formula=formula,
+        )
+
+    def criar_lote(self, materia_prima, numero_lote, quantidade, dias_validade, **campos):
+        campos.setdefault("aprovado_controle_qualidade", True)
+        return LoteMateriaPrima.objects.create(
+            materia_prima=materia_prima,
+            numero_lote=numero_lote,
+            data_validade=self.hoje + timedelta(days=dias_validade),
+            quant_recebida_kg=quantidade,
+            quant_disponivel_kg=quantidade,
+            **campos,
+        )
+
+    def lancar(self, materiais, lote="P1", lote_tamanho=1.0, data_producao=None):
+        return lancar_producao(
+            self.produto, lote, lote_tamanho, data_producao or self.hoje, materiais
+        )
+
+    def post_producao(self, **dados):
+        dados = {
+            "produto_id": self.produto.id,
+            "lote": "P1",
+            "lote_tamanho": 1.0,
+            "data_producao": self.hoje.isoformat(),
+            **dados,
+        }
+        return self.client.post(
+            "/api/producao/", json.dumps(dados), content_type="application/json"
+        )
+
+    def saldo(self, objeto):
+        objeto.refresh_from_db()
+        if isinstance(objeto, MateriaPrima):
+            return objeto.quantidade_disponivel
+        return objeto.quant_disponivel_kg
+
+    def total_movimentado(self, materia_prima):
+        return MovimentacaoEstoque.objects.filter(materia_prima_id=materia_prima.id).aggregate(
+            total=Sum("quantidade_kg")
+        )["total"] or 0.0
+
+
+class LancamentoProducaoTests(ProducaoTestCase):
+    def test_converte_consumo_de_mg_para_kg(self):
+        _, consumos = self.lancar(
+            [{"lote_materia_prima_id": self.lote_a1.id, "quant_consumida_mg": 2_500_000}]
+        )
+
+        self.assertEqual(consumos[0].quant_consumida_mg, 2_500_000)
+        self.assertAlmostEqual(self.saldo(self.lote_a1), 3.5)
+        self.assertAlmostEqual(self.saldo(self.materia_a), 7.5)
+        self.assertAlmostEqual(self.total_movimentado(self.materia_a), -2.5)
+
+    def test_saldo_alterado_entre_bloqueio_e_baixa_desfaz_o_lancamento(self):
+        registrar = VersaoFormula.registrar
+
+        def consumir_e_registrar(formula):
+            # Outro consumo do lote entre a validação e a baixa condicional
+            LoteMateriaPrima.objects.filter(pk=self.lote_a1.pk).update(quant_disponivel_kg=1.0)
+            return registrar(formula)
+
+        with mock.patch.object(VersaoFormula, "registrar", side_effect=consumir_e_registrar):
+            with self.assertRaisesMessage(ErroLancamento, "O saldo de um dos lotes mudou"):
+                self.lancar(
+                    [
+                        {"lote_materia_prima_id": self.lote_a1.id, "quant_consumida_mg": 2_000_000},
+                        {"lote_materia_prima_id": self.lote_b1.id, "quant_consumida_mg": 1_000_000},
+                    ]
+                )
+
+        self.assertFalse(LoteProducao.objects.exists())
+        self.assertFalse(LoteMateriaPrimaConsumida.objects.exists())
+        self.assertFalse(MovimentacaoEstoque.objects.exists())
+        self.assertEqual(self.saldo(self.lote_a1), 6.0)
+        self.assertEqual(self.saldo(self.lote_b1), 10.0)
+        self.assertEqual(self.saldo(self.materia_a), 10.0)
+        self.assertEqual(self.saldo(self.materia_b), 10.0)
+
+    def test_falta_de_estoque_na_alocacao_fefo_responde_409(self):
+        # 6kg de produto precisam de 12kg de A, que só tem 10kg
+        resposta = self.post_producao(lote_tamanho=6.0)
+
+        self.assertEqual(resposta.status_code, 409)
+        self.assertIn("A (2.000kg)", resposta.json()["error"])
+        self.assertFalse(LoteProducao.objects.exists())
+        self.assertEqual(self.saldo(self.lote_a1), 6.0)
+
+    def test_estorno_devolve_lotes_e_materias_primas(self):
+        resposta = self.post_producao(lote_tamanho=4.0)
+        self.assertEqual(resposta.status_code, 201)
+        self.assertAlmostEqual(self.saldo(self.materia_a), 2.0)
+
+        resposta = self.client.delete(f"/api/producao/{resposta.json()['id']}/")
+
+        self.assertEqual(resposta.status_code, 204)
+        self.assertFalse(LoteProducao.objects.exists())
+        for lote, quantidade in ((self.lote_a1, 6.0), (self.lote_a2, 4.0), (self.lote_b1, 10.0)):
+            self.assertAlmostEqual(self.saldo(lote), quantidade)
+        for materia_prima in (self.materia_a, self.materia_b):
+            self.assertAlmostEqual(self.saldo(materia_prima), 10.0)
+            self.assertAlmostEqual(self.total_movimentado(materia_prima), 0.0)
+
+    def test_numero_de_consultas_nao_depende_dos_lotes_consumidos(self):
+        # A versão da fórmula é criada no primeiro lançamento
+        self.lancar([{"lote_materia_prima_id": self.lote_b1.id, "quant_consumida_mg": 1}])
+
+        with CaptureQueriesContext(connection) as consultas:
+            self.lancar(
+                [{"lote_materia_prima_id": self.lote_a1.id, "quant_consumida_mg": 1_000}],
+                lote="P2",
+            )
+        with self.assertNumQueries(len(consultas.captured_queries)):
+            self.lancar(
+                [
+                    {"lote_materia_prima_id": lote.id, "quant_consumida_mg": 1_000}
+                    for lote in (self.lote_a1, self.lote_a2, self.lote_b1)
+                ],
+                lote="P3",
+            )
+
+
+class AlocacaoFefoTests(ProducaoTestCase):
+    """Lançamento sem materiais informados: lotes escolhidos pela validade"""
+
+    def consumos_kg(self, **kwargs):
+        _, consumos = self.lancar([], **kwargs)
+        return {
+            consumo.lote_materia_prima.numero_lote: consumo.quant_consumida_mg / 1_000_000
+            for consumo in consumos
+        }
+
+    def test_consome_primeiro_o_lote_que_vence_antes(self):
+        # 4kg de produto: 8kg de A (6kg de A1 e 2kg de A2) e 4kg de B
+        self.assertEqual(self.consumos_kg(lote_tamanho=4.0), {"A1": 6.0, "A2": 2.0, "B1": 4.0})
+        self.assertAlmostEqual(self.saldo(self.lote_a2), 2.0)
+
+    def test_ignora_lotes_vencidos_e_nao_aprovados(self):
+        vencido = self.criar_lote(self.materia_a, "A0", 5.0, dias_validade=-1)
+        nao_aprovado = self.criar_lote(
+            self.materia_a, "A00", 5.0, dias_validade=1, aprovado_controle_qualidade=False
+        )
+
+        self.assertEqual(self.consumos_kg(), {"A1": 2.0, "B1": 1.0})
+        self.assertEqual(self.saldo(vencido), 5.0)
+        self.assertEqual(self.saldo(nao_aprovado), 5.0)
+
+    def test_lancamento_retroativo_nao_consome_lote_ja_vencido(self):
+        # A0 estava na validade na data de produção, mas venceu ontem
+        vencido = self.criar_lote(self.materia_a, "A0", 5.0, dias_validade=-1)
+
+        consumos = self.consumos_kg(data_producao=self.hoje - timedelta(days=10))
+
+        self.assertEqual(consumos, {"A1": 2.0, "B1": 1.0})
+        self.assertEqual(self.saldo(vencido), 5.0)
+
+
+class GenealogiaProtegidaTests(ProducaoTestCase):
+    """Lotes consumidos e produtos com lotes produzidos não podem ser excluídos"""
+
+    def setUp(self):
+        super().setUp()
+        self.lote_producao, _ = self.lancar(
+            [{"lote_materia_prima_id": self.lote_a1.id, "quant_consumida_mg": 1_000_000}]
+        )
+
+    def test_excluir_produto_com_lotes_responde_409(self):
+        resposta = self.client.delete(f"/api/produtos/{self.produto.id}/")
+
+        self.assertEqual(resposta.status_code, 409)
+        self.assertTrue(Produto.objects.filter(pk=self.produto.pk).exists())
+        self.assertEqual(LoteMateriaPrimaConsumida.objects.count(), 1)
+
+    def test_excluir_lote_consumido_responde_409(self):
+        resposta = self.client.delete(f"/api/lotes/{self.lote_a1.id}/")
+
+        self.assertEqual(resposta.status_code, 409)
+        self.assertAlmostEqual(self.saldo(self.lote_a1), 5.0)
+
+    def test_excluir_materia_prima_com_lote_consumido_responde_409(self):
+        resposta = self.client.delete(f"/api/materias-primas/{self.materia_a.id}/")
+
+        self.assertEqual(resposta.status_code, 409)
+        self.assertFalse(MovimentacaoEstoque.objects.filter(tipo="exclusão de lote").exists())
+
+    def test_banco_protege_a_genealogia(self):
+        for objeto in (self.lote_a1, self.produto):
+            with self.assertRaises(ProtectedError):
+                objeto.delete()
+
+    def test_estorno_libera_a_exclusao(self):
+        estornar_producao(self.lote_producao)
 
-# Create your tests here.
+        self.assertEqual(self.client.delete(f"/api/produtos/{self.produto.id}/").status_code, 204)
@@ -3,5 +3,19 @@ from . import views
 
 urlpatterns = [
     path("producao/", views.lote_producao_list, name="lote-producao-list"),
+    path("producao/alocar/", views.alocar_lotes, name="lote-producao-alocar"),
+    path("producao/capacidade/", views.capacidade, name="lote-producao-capacidade"),
+    path("producao/simular/", views.simular, name="lote-producao-simular"),
+    path("producao/recall/", views.recall, name="lote-producao-recall"),
+    path(
+        "producao/alteracoes/",
+        views.lote_producao_alteracoes,
+        name="lote-producao-alteracoes",
+    ),
     path("producao/<int:pk>/", views.lote_producao_detail, name="lote-producao-detail"),
+    path(
+        "producao/<int:pk>/genealogia/",
+        views.lote_producao_genealogia,
+        name="lote-producao-genealogia",
+    ),
 ]
@@ -1,50 +1,72 @@
-
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from .models import LoteProducao, LoteMateriaPrimaConsumida
-from sc_produtos.models import Produto
-from sc_materiasPrimas.models import LoteMateriaPrima
+from .models import LoteProducao
+from sc_produtos.models import Formula, Ingrediente, Produto
+from sc_materiasPrimas.models import (
+    LoteMateriaPrima,
+    MateriaPrima,
+    RecursoSincronizadoEnum,
+)
+from sc_fornecedores.models import Fornecedor
+from sc_materiasPrimas.sincronizacao import resposta_alteracoes
+from sistema_capsulas.respostas import get_condicional, resposta_lista
+from .alocacao import alocar_lotes_fefo
+from .capacidade import capacidade_producao
+from .genealogia import criterios_recall, impacto_recall, origem_lote_producao
+from .lancamento import ErroLancamento, estornar_producao, lancar_producao
+from .simulacao import ler_plano, simular_plano
 import json
 from datetime import datetime
 
 
+def _serializar_material_consumido(material):
+    """Representação de uma matéria-prima consumida por um lote de produção"""
+    return {
+        "id": material.id,
+        "lote_materia_prima": {
+            "id": material.lote_materia_prima.id,
+            "lote": material.lote_materia_prima.numero_lote,
+            "materia_prima": {
+                "id": material.lote_materia_prima.materia_prima.id,
+                "nome": material.lote_materia_prima.materia_prima.nome,
+            },
+        },
+        "quant_consumida_mg": material.quant_consumida_mg,
+    }
+
+
+def _serializar_versao(versao):
+    """Referência à versão da fórmula usada (None nos lotes antigos)"""
+    if versao is None:
+        return None
+    return {"id": versao.id, "hash": versao.hash}
+
+
+def _serializar_lote_producao(lote):
+    """Representação de um lote de produção com as matérias-primas consumidas"""
+    return {
+        "id": lote.id,
+        "produto": {"id": lote.produto.id, "nome": lote.produto.nome},
+        "lote": lote.lote,
+        "lote_tamanho": lote.lote_tamanho,
+        "data_producao": lote.data_producao.strftime("%Y-%m-%d"),
+        "versao_formula": _serializar_versao(lote.versao_formula),
+        "materiais_consumidos": [
+            _serializar_material_consumido(material)
+            for material in lote.materias_consumidas.all()
+        ],
+    }
+
+
 @csrf_exempt
+@get_condicional(LoteProducao, Produto, LoteMateriaPrima, MateriaPrima)
 def lote_producao_list(request):
     """Listar todos os lotes de produção ou criar um novo"""
     if request.method == "GET":
-        lotes = LoteProducao.objects.all()
-        lotes_data = []
-        for lote in lotes:
-            # Obter materiais consumidos para este lote
-            materiais_consumidos = []
-            for material in lote.materias_consumidas.all():
-                materiais_consumidos.append(
-                    {
-                        "id": material.id,
-                        "lote_materia_prima": {
-                            "id": material.lote_materia_prima.id,
-                            "lote": material.lote_materia_prima.numero_lote,
-                            "materia_prima": {
-                                "id": material.lote_materia_prima.materia_prima.id,
-                                "nome": material.lote_materia_prima.materia_prima.nome,
-                            },
-                        },
-                        "quant_consumida_mg": material.quant_consumida_mg,
-                    }
-                )
-
-            lotes_data.append(
-                {
-                    "id": lote.id,
-                    "produto": {"id": lote.produto.id, "nome": lote.produto.nome},
-                    "lote": lote.lote,
-                    "lote_tamanho": lote.lote_tamanho,
-                    "data_producao": lote.data_producao.strftime("%Y-%m-%d"),
-                    "materiais_consumidos": materiais_consumidos,
-                }
-            )
-
-        return JsonResponse(lotes_data, safe=False)
+        lotes = LoteProducao.objects.select_related(
+            "produto", "versao_formula"
+        ).prefetch_related("materias_consumidas__lote_materia_prima__materia_prima")
+        return resposta_lista(request, lotes, _serializar_lote_producao)
 
     elif request.method == "POST":
         data = json.loads(request.body)
@@ -52,7 +74,7 @@ def lote_producao_list(request):
             # Obter o produto
             produto_id = int(data.get("produto_id"))
             try:
-                produto = Produto.objects.get(pk=produto_id)
+                produto = Produto.objects.select_related("formula").get(pk=produto_id)
             except Produto.DoesNotExist:
                 return JsonResponse(
                     {"error": f"Produto com ID {produto_id} não encontrado"}, status=404
@@ -68,78 +90,39 @@ def lote_producao_list(request):
                     {"error": "Formato de data inválido. Use YYYY-MM-DD"}, status=400
                 )
 
-            # Criar o lote de produção
-            lote = LoteProducao.objects.create(
-                produto=produto,
-                lote=data.get("lote"),
-                lote_tamanho=float(data.get("lote_tamanho")),
-                data_producao=data_producao,
-            )
+            try:
+                lote_tamanho = float(data.get("lote_tamanho"))
+            except (TypeError, ValueError):
+                return JsonResponse(
+                    {"error": "O campo lote_tamanho deve ser numérico"}, status=400
+                )
 
-            # Processar as matérias-primas consumidas
-            materiais_consumidos = []
-            if "materiais_consumidos" in data:
-                for material_data in data["materiais_consumidos"]:
-                    lote_materia_prima_id = int(
-                        material_data.get("lote_materia_prima_id")
-                    )
-                    quant_consumida_mg = float(material_data.get("quant_consumida_mg"))
-
-                    try:
-                        lote_materia_prima = LoteMateriaPrima.objects.get(
-                            pk=lote_materia_prima_id
-                        )
-                    except LoteMateriaPrima.DoesNotExist:
-                        return JsonResponse(
-                            {
-                                "error": f"Lote de matéria-prima com ID {lote_materia_prima_id} não encontrado"
-                            },
-                            status=404,
-                        )
-
-                    # Verificar se há quantidade suficiente
-                    if lote_materia_prima.quant_disponivel_mg < quant_consumida_mg:
-                        return JsonResponse(
-                            {
-                                "error": f"Quantidade insuficiente para o lote de matéria-prima {lote_materia_prima.numero_lote}. Disponível: {lote_materia_prima.quant_disponivel_mg}mg"
-                            },
-                            status=400,
-                        )
-
-                    # Criar o consumo
-                    material_consumido = LoteMateriaPrimaConsumida.objects.create(
-                        lote_producao=lote,
-                        lote_materia_prima=lote_materia_prima,
-                        quant_consumida_mg=quant_consumida_mg,
-                    )
+            materiais = data.get("materiais_consumidos") or []
+            if not isinstance(materiais, list):
+                return JsonResponse(
+                    {"error": "O campo materiais_consumidos deve ser uma lista"},
+                    status=400,
+                )
 
-                    # Atualizar a quantidade disponível
-                    lote_materia_prima.quant_disponivel_mg -= quant_consumida_mg
-                    lote_materia_prima.save()
-
-                    materiais_consumidos.append(
-                        {
-                            "id": material_consumido.id,
-                            "lote_materia_prima": {
-                                "id": lote_materia_prima.id,
-                                "lote": lote_materia_prima.numero_lote,
-                                "materia_prima": {
-                                    "id": lote_materia_prima.materia_prima.id,
-                                    "nome": lote_materia_prima.materia_prima.nome,
-                                },
-                            },
-                            "quant_consumida_mg": material_consumido.quant_consumida_mg,
-                        }
-                    )
+            # Lote, consumos, baixas e movimentações em uma única transação
+            try:
+                lote, consumos = lancar_producao(
+                    produto, data.get("lote"), lote_tamanho, data_producao, materiais
+                )
+            except ErroLancamento as e:
+                return JsonResponse({"error": str(e)}, status=e.status)
 
             return JsonResponse(
                 {
                     "id": lote.id,
-                    "produto": {"id": lote.produto.id, "nome": lote.produto.nome},
+                    "produto": {"id": produto.id, "nome": produto.nome},
                     "lote": lote.lote,
                     "lote_tamanho": lote.lote_tamanho,
                     "data_producao": lote.data_producao.strftime("%Y-%m-%d"),
-                    "materiais_consumidos": materiais_consumidos,
+                    "versao_formula": _serializar_versao(lote.versao_formula),
+                    "materiais_consumidos": [
+                        _serializar_material_consumido(material) for material in consumos
+                    ],
                 },
                 status=201,
             )
@@ -155,51 +138,31 @@ def lote_producao_list(request):
 
 
 @csrf_exempt
+@get_condicional(
+    lambda pk: LoteProducao.objects.filter(pk=pk),
+    lambda pk: Produto.objects.filter(loteproducao=pk),
+    lambda pk: LoteMateriaPrima.objects.filter(
+        lotemateriaprimaconsumida__lote_producao=pk
+    ),
+    lambda pk: MateriaPrima.objects.filter(
+        lotes__lotemateriaprimaconsumida__lote_producao=pk
+    ),
+)
 def lote_producao_detail(request, pk):
     """Recuperar, atualizar ou excluir um lote de produção"""
     try:
-        lote = LoteProducao.objects.get(pk=pk)
+        lote = LoteProducao.objects.select_related("produto", "versao_formula").get(
+            pk=pk
+        )
     except LoteProducao.DoesNotExist:
         return JsonResponse({"error": "Lote de produção não encontrado"}, status=404)
 
     if request.method == "GET":
-        # Obter materiais consumidos para este lote
-        materiais_consumidos = []
-        for material in lote.materias_consumidas.all():
-            materiais_consumidos.append(
-                {
-                    "id": material.id,
-                    "lote_materia_prima": {
-                        "id": material.lote_materia_prima.id,
-                        "lote": material.lote_materia_prima.numero_lote,
-                        "materia_prima": {
-                            "id": material.lote_materia_prima.materia_prima.id,
-                            "nome": material.lote_materia_prima.materia_prima.nome,
-                        },
-                    },
-                    "quant_consumida_mg": material.quant_consumida_mg,
-                }
-            )
-
-        return JsonResponse(
-            {
-                "id": lote.id,
-                "produto": {"id": lote.produto.id, "nome": lote.produto.nome},
-                "lote": lote.lote,
-                "lote_tamanho": lote.lote_tamanho,
-                "data_producao": lote.data_producao.strftime("%Y-%m-%d"),
-                "materiais_consumidos": materiais_consumidos,
-            }
-        )
+        return JsonResponse(_serializar_lote_producao(lote))
 
     elif request.method == "DELETE":
-        # Antes de excluir, reverter as quantidades consumidas de matérias-primas
-        for material in lote.materias_consumidas.all():
-            lote_materia_prima = material.lote_materia_prima
-            lote_materia_prima.quant_disponivel_mg += material.quant_consumida_mg
-            lote_materia_prima.save()
-
-        lote.delete()
+        # Devolve as quantidades consumidas e exclui o lote em uma transação
+        estornar_producao(lote)
         return JsonResponse(
             {"message": "Lote de produção excluído com sucesso"}, status=204
         )
@@ -228,36 +191,184 @@ def lote_producao_detail(request, pk):
 
             lote.save()
 
-            # Obter materiais consumidos para este lote
-            materiais_consumidos = []
-            for material in lote.materias_consumidas.all():
-                materiais_consumidos.append(
-                    {
-                        "id": material.id,
-                        "lote_materia_prima": {
-                            "id": material.lote_materia_prima.id,
-                            "lote": material.lote_materia_prima.numero_lote,
-                            "materia_prima": {
-                                "id": material.lote_materia_prima.materia_prima.id,
-                                "nome": material.lote_materia_prima.materia_prima.nome,
-                            },
-                        },
-                        "quant_consumida_mg": material.quant_consumida_mg,
-                    }
-                )
+            return JsonResponse(_serializar_lote_producao(lote))
 
+        except Exception as e:
             return JsonResponse(
-                {
-                    "id": lote.id,
-                    "produto": {"id": lote.produto.id, "nome": lote.produto.nome},
-                    "lote": lote.lote,
-                    "lote_tamanho": lote.lote_tamanho,
-                    "data_producao": lote.data_producao.strftime("%Y-%m-%d"),
-                    "materiais_consumidos": materiais_consumidos,
-                }
+                {"error": f"Erro ao atualizar lote de produção: {str(e)}"}, status=400
             )
 
-        except Exception as e:
+
+@csrf_exempt
+def alocar_lotes(request):
+    """
+    Sugerir, em ordem FEFO, os lotes de matéria prima a consumir para produzir
+    lote_tamanho kg de um produto (não grava nada)
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    data = json.loads(request.body)
+    try:
+        produto = Produto.objects.select_related("formula").get(
+            pk=int(data.get("produto_id"))
+        )
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "O campo produto_id é obrigatório"}, status=400)
+    except Produto.DoesNotExist:
+        return JsonResponse(
+            {"error": f"Produto com ID {data.get('produto_id')} não encontrado"},
+            status=404,
+        )
+
+    try:
+        lote_tamanho = float(data.get("lote_tamanho"))
+        if lote_tamanho <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse(
+            {"error": "O campo lote_tamanho deve ser um número maior que zero"},
+            status=400,
+        )
+
+    try:
+        alocacao = alocar_lotes_fefo(produto, lote_tamanho)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return JsonResponse(
+        {
+            "produto": {"id": produto.id, "nome": produto.nome},
+            "lote_tamanho": lote_tamanho,
+            **alocacao,
+        }
+    )
+
+
+@csrf_exempt
+@get_condicional(Produto, Formula, Ingrediente, LoteMateriaPrima)
+def capacidade(request):
+    """
+    Quantos lotes padrão de cada produto podem ser produzidos com o estoque
+    atual e qual matéria prima limita cada um (?produto=<id> para filtrar)
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    produto_ids = None
+    if request.GET.get("produto"):
+        try:
+            produto_ids = [int(i) for i in request.GET["produto"].split(",")]
+        except ValueError:
             return JsonResponse(
-                {"error": f"Erro ao atualizar lote de produção: {str(e)}"}, status=400
+                {"error": "O parâmetro produto deve conter IDs numéricos"}, status=400
             )
+
+    return JsonResponse(capacidade_producao(produto_ids), safe=False)
+
+
+@csrf_exempt
+@get_condicional(LoteProducao, LoteMateriaPrima, MateriaPrima, Produto, Fornecedor)
+def recall(request):
+    """
+    Impacto de um recall: lotes de matéria prima que atendem aos critérios
+    (?fornecedor=, ?numero_lote=, ?nota_fiscal=, ?lote_materia_prima=<ids>,
+    combinados) e os lotes de produção que consumiram algum deles
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    try:
+        fornecedor_id = (
+            int(request.GET["fornecedor"]) if request.GET.get("fornecedor") else None
+        )
+        lote_ids = (
+            [int(i) for i in request.GET["lote_materia_prima"].split(",")]
+            if request.GET.get("lote_materia_prima")
+            else None
+        )
+    except ValueError:
+        return JsonResponse(
+            {"error": "Os parâmetros fornecedor e lote_materia_prima devem ser IDs numéricos"},
+            status=400,
+        )
+    numero_lote = request.GET.get("numero_lote", "").strip()
+    nota_fiscal = request.GET.get("nota_fiscal", "").strip()
+
+    if fornecedor_id is None and not (numero_lote or nota_fiscal or lote_ids):
+        return JsonResponse(
+            {
+                "error": "Informe ao menos um critério: fornecedor, numero_lote, "
+                "nota_fiscal ou lote_materia_prima"
+            },
+            status=400,
+        )
+
+    filtro = criterios_recall(fornecedor_id, numero_lote, nota_fiscal, lote_ids)
+    return JsonResponse(impacto_recall(filtro))
+
+
+@csrf_exempt
+@get_condicional(
+    lambda pk: LoteProducao.objects.filter(pk=pk),
+    lambda pk: LoteMateriaPrima.objects.filter(
+        lotemateriaprimaconsumida__lote_producao=pk
+    ),
+    lambda pk: MateriaPrima.objects.filter(
+        lotes__lotemateriaprimaconsumida__lote_producao=pk
+    ),
+)
+def lote_producao_genealogia(request, pk):
+    """Lotes de matéria prima (com nota fiscal e fornecedor) de um lote de produção"""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    lote = LoteProducao.objects.filter(pk=pk).values("id", "lote").first()
+    if lote is None:
+        return JsonResponse({"error": "Lote de produção não encontrado"}, status=404)
+
+    lote["lotes_materia_prima"] = origem_lote_producao(pk)
+    return JsonResponse(lote)
+
+
+@csrf_exempt
+def simular(request):
+    """
+    Simular um plano de produção ({"plano": [{produto_id, lote_tamanho,
+    data_producao}]}) contra o estoque atual, sem gravar nada: faltas de
+    matéria prima por lote planejado e lotes que vencem antes de serem usados
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse(
+            {"error": "Dados inválidos: não é um JSON válido"}, status=400
+        )
+    itens = data.get("plano") if isinstance(data, dict) else data
+    if not isinstance(itens, list):
+        return JsonResponse(
+            {"error": "Envie a lista de lotes planejados no campo plano"}, status=400
+        )
+
+    plano, erros = ler_plano(itens)
+    if erros:
+        return JsonResponse({"erros": erros}, status=400)
+
+    return JsonResponse(simular_plano(plano))
+
+
+@csrf_exempt
+def lote_producao_alteracoes(request):
+    """Lotes de produção criados, alterados ou excluídos desde o cursor ?since="""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    lotes = LoteProducao.objects.select_related(
+        "produto", "versao_formula"
+    ).prefetch_related("materias_consumidas__lote_materia_prima__materia_prima")
+    return resposta_alteracoes(
+        request, lotes, RecursoSincronizadoEnum.LOTE_PRODUCAO, _serializar_lote_producao
+    )
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ScProdutosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sc_produtos'
+
+    def ready(self):
+        # Mantém o custo das fórmulas em cache coerente com preços e ingredientes
+        from . import sinais
+
+        sinais.conectar()
@@ -0,0 +1,134 @@
+"""
+Custo padrão das fórmulas: soma de quant_mg x preço da matéria prima de cada
+ingrediente, convertido pela unidade de medida em que o preço é informado.
+Os custos ficam em cache, agrupados em um número fixo de chaves (blocos por
+id da fórmula), até uma alteração que afete alguma fórmula do bloco.
+"""
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Lower, Mod
+from django.db.models.lookups import Exact, In
+from django.utils import timezone
+
+from .models import Formula, Ingrediente
+
+PREFIXO_CACHE_CUSTO = "produtos:custo_formula"
+
+# Chaves de cache dos custos. O FileBasedCache grava um arquivo por chave e
+# descarta entradas ao passar de MAX_ENTRIES, então o total de chaves não pode
+# crescer com o número de fórmulas
+BLOCOS_CACHE_CUSTO = 16
+
+# Quantos mg há em uma unidade de medida do preço. Unidades de volume ou
+# "unidade" não convertem de massa e ficam fora da soma (ver sem_conversao)
+MG_POR_UNIDADE_MEDIDA = {
+    "kg": 1_000_000,
+    "g": 1_000,
+    "mg": 1,
+}
+
+# Campos da matéria prima que mudam o custo das fórmulas
+CAMPOS_CUSTO_MATERIA_PRIMA = ("preco_unitario", "unidade_medida")
+
+# Campos da fórmula usados no custo por kg e por unidade
+CAMPOS_CUSTO_FORMULA = ("quant_kg_padrao", "quant_unid_padrao")
+
+
+def _bloco(formula_id):
+    return formula_id % BLOCOS_CACHE_CUSTO
+
+
+def _chave(bloco):
+    return f"{PREFIXO_CACHE_CUSTO}:{bloco}"
+
+
+def _calcular(formulas):
+    """Custo das fórmulas do queryset em uma única consulta agrupada"""
+    materia_prima = "ingredientes__lote_materia_prima__materia_prima"
+    unidade = Lower(f"{materia_prima}__unidade_medida")
+    preco = Cast(f"{materia_prima}__preco_unitario", FloatField())
+    preco_por_mg = Case(
+        *[
+            When(Exact(unidade, nome), then=preco / Value(float(mg)))
+            for nome, mg in MG_POR_UNIDADE_MEDIDA.items()
+        ],
+        output_field=FloatField(),
+    )
+    sem_conversao = Case(
+        When(In(unidade, list(MG_POR_UNIDADE_MEDIDA)), then=Value(0)),
+        default=Value(1),
+    )
+    formulas = (
+        formulas.annotate(
+            custo_lote=Sum(F("ingredientes__quant_mg") * preco_por_mg),
+            sem_conversao=Sum(sem_conversao, filter=Q(ingredientes__isnull=False)),
+        )
+        .values("id", "quant_kg_padrao", "quant_unid_padrao", "custo_lote", "sem_conversao")
+    )
+
+    calculado_em = timezone.now().isoformat()
+    custos = {}
+    for formula in formulas:
+        custo_lote = formula["custo_lote"] or 0.0
+        kg, unidades = formula["quant_kg_padrao"], formula["quant_unid_padrao"]
+        custos[formula["id"]] = {
+            "custo_lote_padrao": round(custo_lote, 2),
+            "custo_por_kg": round(custo_lote / kg, 4) if kg else None,
+            "custo_por_unidade": round(custo_lote / unidades, 4) if unidades else None,
+            "ingredientes_sem_conversao": formula["sem_conversao"] or 0,
+            "calculado_em": calculado_em,
+        }
+    return custos
+
+
+def custos_formulas(formula_ids=None):
+    """
+    Custo padrão de cada fórmula ({id: custo}). Os blocos em cache são lidos de
+    uma vez; os blocos ausentes (ou sem alguma das fórmulas) são calculados
+    inteiros, em uma consulta, e gravados no cache.
+    Sem formula_ids, considera todas as fórmulas.
+    """
+    if formula_ids is None:
+        formula_ids = Formula.objects.values_list("id", flat=True)
+    formula_ids = set(formula_ids)
+
+    em_cache = cache.get_many([_chave(b) for b in {_bloco(i) for i in formula_ids}])
+    custos, faltando = {}, set()
+    for formula_id in formula_ids:
+        bloco = em_cache.get(_chave(_bloco(formula_id)), {})
+        if formula_id in bloco:
+            custos[formula_id] = bloco[formula_id]
+        else:
+            faltando.add(formula_id)
+
+    if faltando:
+        blocos = {_bloco(i) for i in faltando}
+        calculados = _calcular(
+            Formula.objects.annotate(bloco_cache=Mod("id", Value(BLOCOS_CACHE_CUSTO))).filter(
+                bloco_cache__in=blocos
+            )
+        )
+        por_bloco = {bloco: {} for bloco in blocos}
+        for formula_id, custo in calculados.items():
+            por_bloco[_bloco(formula_id)][formula_id] = custo
+        cache.set_many({_chave(b): custos_bloco for b, custos_bloco in por_bloco.items()}, None)
+        custos.update({i: calculados[i] for i in faltando if i in calculados})
+    return custos
+
+
+def invalidar_custos(formula_ids):
+    """Descarta os blocos em cache das fórmulas quando a transação atual confirmar"""
+    chaves = [_chave(b) for b in {_bloco(i) for i in formula_ids}]
+    if chaves:
+        transaction.on_commit(lambda: cache.delete_many(chaves))
+
+
+def invalidar_custos_materia_prima(materia_prima_id):
+    """Descarta o custo das fórmulas que usam lotes da matéria prima"""
+    invalidar_custos(
+        Ingrediente.objects.filter(lote_materia_prima__materia_prima=materia_prima_id)
+        .values_list("formula_id", flat=True)
+        .distinct()
+    )
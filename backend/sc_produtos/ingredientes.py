@@ -0,0 +1,135 @@
+"""
+Substituição em massa dos ingredientes de uma fórmula: recebe a lista completa
+desejada, compara com a atual e grava só as diferenças.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from sc_materiasPrimas.models import LoteMateriaPrima
+from .custos import invalidar_custos
+from .models import Ingrediente
+
+
+def _validar(itens, atuais):
+    """
+    Converte a lista recebida em [(id ou None, lote_materia_prima_id, quant_mg)],
+    com os erros de cada posição. Os lotes são conferidos depois, de uma vez.
+    """
+    validos, erros = [], []
+    ids_vistos = set()
+    for indice, item in enumerate(itens):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("Ingrediente deve ser um objeto")
+
+            ingrediente_id = item.get("id")
+            if ingrediente_id is not None:
+                if ingrediente_id not in atuais:
+                    raise ValueError(
+                        f"Ingrediente com ID {ingrediente_id} não pertence à fórmula"
+                    )
+                if ingrediente_id in ids_vistos:
+                    raise ValueError(f"Ingrediente com ID {ingrediente_id} repetido")
+                ids_vistos.add(ingrediente_id)
+
+            try:
+                lote_id = int(item.get("lote_materia_prima_id"))
+            except (TypeError, ValueError):
+                raise ValueError("O campo lote_materia_prima_id deve ser um ID numérico")
+
+            try:
+                quant_mg = float(item.get("quant_mg"))
+            except (TypeError, ValueError):
+                raise ValueError("O campo quant_mg deve ser numérico")
+            if quant_mg <= 0:
+                raise ValueError("O campo quant_mg deve ser maior que zero")
+
+            validos.append((indice, ingrediente_id, lote_id, quant_mg))
+        except ValueError as e:
+            erros.append({"indice": indice, "erro": str(e)})
+    return validos, erros
+
+
+def substituir_ingredientes(formula, itens):
+    """
+    Deixa a fórmula exatamente com os ingredientes de itens
+    ([{"id"?, "lote_materia_prima_id", "quant_mg"}]).
+
+    Itens com id atualizam o ingrediente correspondente; sem id, reaproveitam
+    um ingrediente atual do mesmo lote ou são criados. Os que sobrarem são
+    excluídos. Tudo em uma transação, com bulk_create/bulk_update, e nada é
+    gravado se algum item for inválido.
+
+    Retorna {"ingredientes": [...], "criados", "atualizados", "excluidos", "erros"}.
+    """
+    # Usa os ingredientes já carregados (prefetch) quando houver
+    atuais = {ingrediente.id: ingrediente for ingrediente in formula.ingredientes.all()}
+
+    validos, erros = _validar(itens, atuais)
+    lotes = LoteMateriaPrima.objects.select_related("materia_prima").in_bulk(
+        {lote_id for _, _, lote_id, _ in validos}
+    )
+    for indice, _, lote_id, _ in validos:
+        if lote_id not in lotes:
+            erros.append(
+                {
+                    "indice": indice,
+                    "erro": f"Lote de matéria-prima com ID {lote_id} não encontrado",
+                }
+            )
+    if erros:
+        return {"erros": sorted(erros, key=lambda e: e["indice"])}
+
+    # Ingredientes atuais ainda não reivindicados por um id explícito, por lote
+    explicitos = {ingrediente_id for _, ingrediente_id, _, _ in validos}
+    livres = {}
+    for ingrediente in atuais.values():
+        if ingrediente.id not in explicitos:
+            livres.setdefault(ingrediente.lote_materia_prima_id, []).append(ingrediente)
+
+    resultado, criar, atualizar = [], [], []
+    for _, ingrediente_id, lote_id, quant_mg in validos:
+        if ingrediente_id is not None:
+            ingrediente = atuais[ingrediente_id]
+        elif livres.get(lote_id):
+            ingrediente = livres[lote_id].pop(0)
+        else:
+            ingrediente = Ingrediente(formula=formula, quant_mg=quant_mg)
+            ingrediente.lote_materia_prima = lotes[lote_id]
+            criar.append(ingrediente)
+            resultado.append(ingrediente)
+            continue
+
+        if ingrediente.lote_materia_prima_id != lote_id or ingrediente.quant_mg != quant_mg:
+            ingrediente.quant_mg = quant_mg
+            atualizar.append(ingrediente)
+        ingrediente.lote_materia_prima = lotes[lote_id]
+        resultado.append(ingrediente)
+
+    excluir = [i.id for restantes in livres.values() for i in restantes]
+
+    with transaction.atomic():
+        Ingrediente.objects.bulk_create(criar, batch_size=500)
+        if atualizar:
+            agora = timezone.now()
+            for ingrediente in atualizar:
+                ingrediente.atualizado_em = agora
+            Ingrediente.objects.bulk_update(
+                atualizar,
+                ["lote_materia_prima", "quant_mg", "atualizado_em"],
+                batch_size=500,
+            )
+        if excluir:
+            Ingrediente.objects.filter(pk__in=excluir).delete()
+        # bulk_create/bulk_update não disparam os sinais que invalidam o custo
+        if criar or atualizar or excluir:
+            invalidar_custos([formula.id])
+
+    return {
+        "ingredientes": resultado,
+        "criados": len(criar),
+        "atualizados": len(atualizar),
+        "excluidos": len(excluir),
+        "erros": [],
+    }
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_produtos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formula',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='ingrediente',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
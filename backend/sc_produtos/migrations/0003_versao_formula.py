@@ -0,0 +1,22 @@
+# Generated by Django 5.2 on 2026-10-18 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sc_produtos', '0002_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersaoFormula',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('conteudo', models.JSONField()),
+                ('criada_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,4 +1,7 @@
-from django.db import models
+import hashlib
+import json
+
+from django.db import IntegrityError, models, transaction
 from sc_materiasPrimas.models import LoteMateriaPrima
 
 
@@ -22,6 +25,16 @@ class Formula(models.Model):
     )
     quant_unid_padrao = models.IntegerField()
     quant_kg_padrao = models.FloatField()
+    atualizado_em = models.DateTimeField(auto_now=True, db_index=True)
+
+    def fator_escala(self, lote_tamanho):
+        """
+        Fator que converte as quantidades da fórmula (definidas para o lote
+        padrão de quant_kg_padrao kg) para um lote de lote_tamanho kg
+        """
+        if not self.quant_kg_padrao:
+            raise ValueError("A fórmula não possui quantidade padrão em kg")
+        return float(lote_tamanho) / self.quant_kg_padrao
 
 
 class Produto(models.Model):
@@ -31,6 +44,7 @@ class Produto(models.Model):
     formula = models.ForeignKey(
         Formula, on_delete=models.CASCADE, related_name="produtos"
     )
+    atualizado_em = models.DateTimeField(auto_now=True, db_index=True)
 
 
 class Ingrediente(models.Model):
@@ -39,3 +53,62 @@ class Ingrediente(models.Model):
     )
     lote_materia_prima = models.ForeignKey(LoteMateriaPrima, on_delete=models.CASCADE)
     quant_mg = models.FloatField()
+    atualizado_em = models.DateTimeField(auto_now=True, db_index=True)
+
+
+class VersaoFormula(models.Model):
+    """
+    Fotografia imutável de uma fórmula (campos e ingredientes) no momento em
+    que foi usada, identificada pelo hash do conteúdo. Receitas idênticas
+    compartilham a mesma versão.
+    """
+
+    hash = models.CharField(max_length=64, unique=True)
+    conteudo = models.JSONField()
+    criada_em = models.DateTimeField(auto_now_add=True)
+
+    @staticmethod
+    def conteudo_da_formula(formula):
+        """Conteúdo canônico da fórmula (ingredientes em ordem estável)"""
+        ingredientes = sorted(
+            Ingrediente.objects.filter(formula=formula).values_list(
+                "lote_materia_prima_id",
+                "lote_materia_prima__numero_lote",
+                "lote_materia_prima__materia_prima_id",
+                "quant_mg",
+            )
+        )
+        return {
+            "forma_farmaceutica": formula.forma_farmaceutica,
+            "quant_unid_padrao": formula.quant_unid_padrao,
+            "quant_kg_padrao": formula.quant_kg_padrao,
+            "ingredientes": [
+                {
+                    "lote_materia_prima_id": lote_id,
+                    "numero_lote": numero_lote,
+                    "materia_prima_id": materia_prima_id,
+                    "quant_mg": quant_mg,
+                }
+                for lote_id, numero_lote, materia_prima_id, quant_mg in ingredientes
+            ],
+        }
+
+    @classmethod
+    def registrar(cls, formula):
+        """Versão correspondente ao estado atual da fórmula (criada se ainda não existir)"""
+        conteudo = cls.conteudo_da_formula(formula)
+        serializado = json.dumps(conteudo, sort_keys=True, separators=(",", ":"))
+        chave = hashlib.sha256(serializado.encode()).hexdigest()
+        try:
+            # Savepoint: outro processo pode criar a mesma versão ao mesmo tempo
+            with transaction.atomic():
+                return cls.objects.get_or_create(
+                    hash=chave, defaults={"conteudo": conteudo}
+                )[0]
+        except IntegrityError:
+            return cls.objects.get(hash=chave)
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Versões de fórmula são imutáveis")
+        super().save(*args, **kwargs)
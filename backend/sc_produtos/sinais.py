@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_save
+
+from sc_materiasPrimas.models import MateriaPrima
+from . import custos
+from .models import Formula, Ingrediente
+
+
+def _altera(update_fields, campos):
+    return update_fields is None or bool(set(update_fields) & set(campos))
+
+
+def materia_prima_salva(sender, instance, update_fields=None, raw=False, **kwargs):
+    if not raw and _altera(update_fields, custos.CAMPOS_CUSTO_MATERIA_PRIMA):
+        custos.invalidar_custos_materia_prima(instance.pk)
+
+
+def formula_alterada(sender, instance, update_fields=None, raw=False, **kwargs):
+    if not raw and _altera(update_fields, custos.CAMPOS_CUSTO_FORMULA):
+        custos.invalidar_custos([instance.pk])
+
+
+def ingrediente_alterado(sender, instance, raw=False, **kwargs):
+    if not raw:
+        custos.invalidar_custos([instance.formula_id])
+
+
+def conectar():
+    """Invalida o custo em cache só das fórmulas afetadas por cada alteração"""
+    post_save.connect(
+        materia_prima_salva, sender=MateriaPrima, dispatch_uid="custo_materia_prima"
+    )
+    post_save.connect(formula_alterada, sender=Formula, dispatch_uid="custo_formula")
+    post_delete.connect(
+        formula_alterada, sender=Formula, dispatch_uid="custo_formula_excluida"
+    )
+    post_save.connect(
+        ingrediente_alterado, sender=Ingrediente, dispatch_uid="custo_ingrediente"
+    )
+    post_delete.connect(
+        ingrediente_alterado,
+        sender=Ingrediente,
+        dispatch_uid="custo_ingrediente_excluido",
+    )
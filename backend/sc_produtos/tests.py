@@ -1,3 +1,95 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from sc_fornecedores.models import Fornecedor
+from sc_materiasPrimas.models import LoteMateriaPrima, MateriaPrima
+from .custos import BLOCOS_CACHE_CUSTO, custos_formulas
+from .models import FormaFarmaceuticaEnum, Formula, Ingrediente
+
+DIRETORIO_CACHE = tempfile.mkdtemp(prefix="testes_custos_")
+
+
+def tearDownModule():
+    shutil.rmtree(DIRETORIO_CACHE, ignore_errors=True)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": DIRETORIO_CACHE,
+        }
+    }
+)
+class CustoFormulasTests(TestCase):
+    """Custo padrão em cache com número fixo de chaves"""
+
+    def setUp(self):
+        cache.clear()
+        fornecedor = Fornecedor.objects.create(cnpj="1", razao_social="F", fantasia="F")
+        # R$ 100/kg: 1kg (1.000.000 mg) por lote padrão custa R$ 100
+        self.materia_prima = MateriaPrima.objects.create(
+            cod_interno=1, nome="A", fornecedor=fornecedor, preco_unitario=100
+        )
+        lote = LoteMateriaPrima.objects.create(materia_prima=self.materia_prima, numero_lote="L1")
+        self.formulas = [
+            Formula.objects.create(
+                forma_farmaceutica=FormaFarmaceuticaEnum.COMPRIMIDO,
+                quant_unid_padrao=100,
+                quant_kg_padrao=2.0,
+            )
+            for _ in range(BLOCOS_CACHE_CUSTO * 3)
+        ]
+        Ingrediente.objects.bulk_create(
+            [
+                Ingrediente(formula=formula, lote_materia_prima=lote, quant_mg=1_000_000)
+                for formula in self.formulas
+            ]
+        )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_numero_de_chaves_nao_cresce_com_as_formulas(self):
+        custos = custos_formulas()
+
+        self.assertEqual(len(custos), len(self.formulas))
+        self.assertEqual(custos[self.formulas[0].id]["custo_lote_padrao"], 100.0)
+        self.assertEqual(custos[self.formulas[0].id]["custo_por_kg"], 50.0)
+        self.assertLessEqual(len(os.listdir(DIRETORIO_CACHE)), BLOCOS_CACHE_CUSTO)
+
+    def test_custos_em_cache_nao_consultam_o_banco(self):
+        ids = [formula.id for formula in self.formulas]
+        custos_formulas(ids)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(len(custos_formulas(ids)), len(ids))
+
+    def test_alteracao_de_preco_recalcula_as_formulas_afetadas(self):
+        custos_formulas()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.materia_prima.preco_unitario = 200
+            self.materia_prima.save(update_fields=["preco_unitario"])
+
+        with self.assertNumQueries(2):
+            custos = custos_formulas()
+        self.assertEqual(
+            {custo["custo_lote_padrao"] for custo in custos.values()}, {200.0}
+        )
+
+    def test_formula_nova_entra_no_bloco(self):
+        custos_formulas()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            nova = Formula.objects.create(
+                forma_farmaceutica=FormaFarmaceuticaEnum.COMPRIMIDO,
+                quant_unid_padrao=1,
+                quant_kg_padrao=1.0,
+            )
+
+        self.assertEqual(custos_formulas([nova.id])[nova.id]["custo_lote_padrao"], 0.0)
@@ -3,8 +3,14 @@ from . import views
 
 urlpatterns = [
     path("produtos/", views.produto_list, name="produto-list"),
+    path("produtos/alteracoes/", views.produto_alteracoes, name="produto-alteracoes"),
     path("produtos/<int:pk>/", views.produto_detail, name="produto-detail"),
     path("formulas/", views.formula_list, name="formula-list"),
+    path(
+        "formulas/versoes/<str:hash>/",
+        views.versao_formula_detail,
+        name="versao-formula-detail",
+    ),
     path(
         "formulas/<int:formula_id>/ingredientes/",
         views.ingrediente_list,
@@ -9,11 +9,121 @@ from .models import (
     Ingrediente,
     FormaFarmaceuticaEnum,
     ApresentacaoEnum,
+    VersaoFormula,
 )
-from sc_materiasPrimas.models import MateriaPrima, LoteMateriaPrima
+from sc_materiasPrimas.models import (
+    MateriaPrima,
+    LoteMateriaPrima,
+    RecursoSincronizadoEnum,
+)
+from sc_materiasPrimas.sincronizacao import resposta_alteracoes
+from sistema_capsulas.respostas import (
+    MAX_AGE_IMUTAVEL,
+    get_condicional,
+    resposta_lista,
+)
+from .custos import custos_formulas
+from .ingredientes import substituir_ingredientes
+from django.db.models import Prefetch
+from django.utils.cache import patch_cache_control
 import json
 
 
+def _prefetch_ingredientes(caminho="ingredientes"):
+    """
+    Prefetch dos ingredientes já com o lote e a matéria prima (select_related),
+    para serializar qualquer quantidade de fórmulas em duas consultas.
+    """
+    return Prefetch(
+        caminho,
+        queryset=Ingrediente.objects.select_related(
+            "lote_materia_prima__materia_prima"
+        ).order_by("id"),
+    )
+
+
+def _serializar_lote_materia_prima(lote):
+    """Resumo do lote de matéria prima usado em um ingrediente"""
+    return {
+        "id": lote.id,
+        "lote": lote.numero_lote,
+        "materia_prima": {
+            "id": lote.materia_prima.id,
+            "nome": lote.materia_prima.nome,
+        },
+    }
+
+
+def _serializar_ingrediente(ingrediente):
+    """Representação de um ingrediente (lote e matéria prima já carregados)"""
+    return {
+        "id": ingrediente.id,
+        "lote_materia_prima": _serializar_lote_materia_prima(
+            ingrediente.lote_materia_prima
+        ),
+        "quant_mg": ingrediente.quant_mg,
+    }
+
+
+def _serializar_ingrediente_detalhe(ingrediente):
+    """Ingrediente com a fórmula a que pertence"""
+    return {
+        "id": ingrediente.id,
+        "formula_id": ingrediente.formula_id,
+        "lote_materia_prima": _serializar_lote_materia_prima(
+            ingrediente.lote_materia_prima
+        ),
+        "quant_mg": ingrediente.quant_mg,
+    }
+
+
+def _serializar_formula(formula):
+    """Representação de uma fórmula com seus ingredientes"""
+    return {
+        "id": formula.id,
+        "forma_farmaceutica": formula.forma_farmaceutica,
+        "quant_unid_padrao": formula.quant_unid_padrao,
+        "quant_kg_padrao": formula.quant_kg_padrao,
+        "ingredientes": [
+            _serializar_ingrediente(ingrediente)
+            for ingrediente in formula.ingredientes.all()
+        ],
+    }
+
+
+def _serializar_produto(produto, custo=None):
+    """
+    Representação de um produto na listagem (com os dados básicos da fórmula
+    e, se informado, o custo padrão calculado por custos.custos_formulas)
+    """
+    dados = {
+        "id": produto.id,
+        "nome": produto.nome,
+        "descricao": produto.descricao,
+        "apresentacao": produto.apresentacao,
+        "formula": {
+            "id": produto.formula.id,
+            "forma_farmaceutica": produto.formula.forma_farmaceutica,
+            "quant_unid_padrao": produto.formula.quant_unid_padrao,
+            "quant_kg_padrao": produto.formula.quant_kg_padrao,
+        },
+    }
+    if custo is not None:
+        dados["formula"]["custo"] = custo
+    return dados
+
+
+def _serializar_produto_detalhe(produto):
+    """Representação de um produto com a fórmula e seus ingredientes"""
+    return {
+        "id": produto.id,
+        "nome": produto.nome,
+        "descricao": produto.descricao,
+        "apresentacao": produto.apresentacao,
+        "formula": _serializar_formula(produto.formula),
+    }
+
+
 # Json na sexta-feira vai testar isso
 class ProdutoViewSet(viewsets.ModelViewSet):
     queryset = Produto.objects.all()
@@ -31,27 +141,20 @@ class IngredienteViewSet(viewsets.ModelViewSet):
 
 
 @csrf_exempt
+@get_condicional(Produto, Formula, Ingrediente, MateriaPrima)
 def produto_list(request):
     """Listar todos os produtos ou criar um novo"""
     if request.method == "GET":
-        produtos = Produto.objects.all()
-        produtos_data = []
-        for produto in produtos:
-            produtos_data.append(
-                {
-                    "id": produto.id,
-                    "nome": produto.nome,
-                    "descricao": produto.descricao,
-                    "apresentacao": produto.apresentacao,
-                    "formula": {
-                        "id": produto.formula.id,
-                        "forma_farmaceutica": produto.formula.forma_farmaceutica,
-                        "quant_unid_padrao": produto.formula.quant_unid_padrao,
-                        "quant_kg_padrao": produto.formula.quant_kg_padrao,
-                    },
-                }
-            )
-        return JsonResponse(produtos_data, safe=False)
+        produtos = list(Produto.objects.select_related("formula"))
+        # Custos lidos do cache; só os invalidados são recalculados
+        custos = custos_formulas({produto.formula_id for produto in produtos})
+        return JsonResponse(
+            [
+                _serializar_produto(produto, custos.get(produto.formula_id))
+                for produto in produtos
+            ],
+            safe=False,
+        )
 
     elif request.method == "POST":
         data = json.loads(request.body)
@@ -93,9 +196,9 @@ def produto_list(request):
                         "lote_materia_prima_id"
                     )
                     try:
-                        lote_materia_prima = LoteMateriaPrima.objects.get(
-                            pk=lote_materia_prima_id
-                        )
+                        lote_materia_prima = LoteMateriaPrima.objects.select_related(
+                            "materia_prima"
+                        ).get(pk=lote_materia_prima_id)
                     except LoteMateriaPrima.DoesNotExist:
                         return JsonResponse(
                             {
@@ -110,20 +213,7 @@ def produto_list(request):
                         quant_mg=float(ingrediente_data.get("quant_mg", 0)),
                     )
 
-                    ingredientes_data.append(
-                        {
-                            "id": ingrediente.id,
-                            "lote_materia_prima": {
-                                "id": ingrediente.lote_materia_prima.id,
-                                "lote": ingrediente.lote_materia_prima.numero_lote,
-                                "materia_prima": {
-                                    "id": ingrediente.lote_materia_prima.materia_prima.id,
-                                    "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                                },
-                            },
-                            "quant_mg": ingrediente.quant_mg,
-                        }
-                    )
+                    ingredientes_data.append(_serializar_ingrediente(ingrediente))
 
             return JsonResponse(
                 {
@@ -153,47 +243,26 @@ def produto_list(request):
 
 
 @csrf_exempt
+@get_condicional(
+    lambda pk: Produto.objects.filter(pk=pk),
+    lambda pk: Formula.objects.filter(produtos=pk),
+    lambda pk: Ingrediente.objects.filter(formula__produtos=pk),
+    lambda pk: LoteMateriaPrima.objects.filter(ingrediente__formula__produtos=pk),
+    lambda pk: MateriaPrima.objects.filter(lotes__ingrediente__formula__produtos=pk),
+)
 def produto_detail(request, pk):
     """Recuperar, atualizar ou excluir um produto"""
     try:
-        produto = Produto.objects.get(pk=pk)
+        produto = (
+            Produto.objects.select_related("formula")
+            .prefetch_related(_prefetch_ingredientes("formula__ingredientes"))
+            .get(pk=pk)
+        )
     except Produto.DoesNotExist:
         return JsonResponse({"error": "Produto não encontrado"}, status=404)
 
     if request.method == "GET":
-        # Obter ingredientes da fórmula
-        ingredientes = []
-        for ingrediente in produto.formula.ingredientes.all():
-            ingredientes.append(
-                {
-                    "id": ingrediente.id,
-                    "lote_materia_prima": {
-                        "id": ingrediente.lote_materia_prima.id,
-                        "lote": ingrediente.lote_materia_prima.numero_lote,
-                        "materia_prima": {
-                            "id": ingrediente.lote_materia_prima.materia_prima.id,
-                            "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                        },
-                    },
-                    "quant_mg": ingrediente.quant_mg,
-                }
-            )
-
-        return JsonResponse(
-            {
-                "id": produto.id,
-                "nome": produto.nome,
-                "descricao": produto.descricao,
-                "apresentacao": produto.apresentacao,
-                "formula": {
-                    "id": produto.formula.id,
-                    "forma_farmaceutica": produto.formula.forma_farmaceutica,
-                    "quant_unid_padrao": produto.formula.quant_unid_padrao,
-                    "quant_kg_padrao": produto.formula.quant_kg_padrao,
-                    "ingredientes": ingredientes,
-                },
-            }
-        )
+        return JsonResponse(_serializar_produto_detalhe(produto))
 
     elif request.method == "PUT":
         data = json.loads(request.body)
@@ -220,39 +289,8 @@ def produto_detail(request, pk):
 
             produto.save()
 
-            # Obter ingredientes atualizados
-            ingredientes = []
-            for ingrediente in produto.formula.ingredientes.all():
-                ingredientes.append(
-                    {
-                        "id": ingrediente.id,
-                        "lote_materia_prima": {
-                            "id": ingrediente.lote_materia_prima.id,
-                            "lote": ingrediente.lote_materia_prima.numero_lote,
-                            "materia_prima": {
-                                "id": ingrediente.lote_materia_prima.materia_prima.id,
-                                "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                            },
-                        },
-                        "quant_mg": ingrediente.quant_mg,
-                    }
-                )
-
-            return JsonResponse(
-                {
-                    "id": produto.id,
-                    "nome": produto.nome,
-                    "descricao": produto.descricao,
-                    "apresentacao": produto.apresentacao,
-                    "formula": {
-                        "id": produto.formula.id,
-                        "forma_farmaceutica": produto.formula.forma_farmaceutica,
-                        "quant_unid_padrao": produto.formula.quant_unid_padrao,
-                        "quant_kg_padrao": produto.formula.quant_kg_padrao,
-                        "ingredientes": ingredientes,
-                    },
-                }
-            )
+            # O PUT não altera ingredientes; os já carregados continuam válidos
+            return JsonResponse(_serializar_produto_detalhe(produto))
 
         except Exception as e:
             return JsonResponse(
@@ -262,6 +300,15 @@ def produto_detail(request, pk):
     elif request.method == "DELETE":
         try:
             # Deletar o produto (a fórmula é mantida, pois pode ser usada por outros produtos)
+            # Os lotes de produção guardam a genealogia usada nos recalls
+            if produto.loteproducao_set.exists():
+                return JsonResponse(
+                    {
+                        "error": "Este produto não pode ser excluído, pois possui "
+                        "lotes de produção."
+                    },
+                    status=409,
+                )
             produto.delete()
             return JsonResponse({"message": "Produto excluído com sucesso"}, status=204)
         except Exception as e:
@@ -271,79 +318,62 @@ def produto_detail(request, pk):
 
 
 @csrf_exempt
+def produto_alteracoes(request):
+    """Produtos criados, alterados ou excluídos desde o cursor ?since="""
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    return resposta_alteracoes(
+        request,
+        Produto.objects.select_related("formula"),
+        RecursoSincronizadoEnum.PRODUTO,
+        _serializar_produto,
+    )
+
+
+@csrf_exempt
+@get_condicional(Formula, Ingrediente, LoteMateriaPrima, MateriaPrima)
 def formula_list(request):
     """Listar todas as fórmulas ou criar uma nova"""
     if request.method == "GET":
-        formulas = Formula.objects.all()
-        formulas_data = []
-        for formula in formulas:
-            # Obter ingredientes da fórmula
-            ingredientes = []
-            for ingrediente in formula.ingredientes.all():
-                ingredientes.append(
-                    {
-                        "id": ingrediente.id,
-                        "lote_materia_prima": {
-                            "id": ingrediente.lote_materia_prima.id,
-                            "lote": ingrediente.lote_materia_prima.numero_lote,
-                            "materia_prima": {
-                                "id": ingrediente.lote_materia_prima.materia_prima.id,
-                                "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                            },
-                        },
-                        "quant_mg": ingrediente.quant_mg,
-                    }
-                )
-
-            formulas_data.append(
-                {
-                    "id": formula.id,
-                    "forma_farmaceutica": formula.forma_farmaceutica,
-                    "quant_unid_padrao": formula.quant_unid_padrao,
-                    "quant_kg_padrao": formula.quant_kg_padrao,
-                    "ingredientes": ingredientes,
-                }
-            )
-
-        return JsonResponse(formulas_data, safe=False)
+        formulas = Formula.objects.prefetch_related(_prefetch_ingredientes())
+        return resposta_lista(request, formulas, _serializar_formula)
 
 
 @csrf_exempt
+@get_condicional(
+    lambda formula_id: Formula.objects.filter(pk=formula_id),
+    lambda formula_id: Ingrediente.objects.filter(formula=formula_id),
+    lambda formula_id: LoteMateriaPrima.objects.filter(ingrediente__formula=formula_id),
+    lambda formula_id: MateriaPrima.objects.filter(
+        lotes__ingrediente__formula=formula_id
+    ),
+)
 def ingrediente_list(request, formula_id):
-    """Listar ou adicionar ingredientes a uma fórmula"""
+    """
+    Listar ou adicionar ingredientes a uma fórmula. O PUT substitui a lista
+    inteira de uma vez (ver ingredientes.substituir_ingredientes)
+    """
     try:
-        formula = Formula.objects.get(pk=formula_id)
+        formula = Formula.objects.prefetch_related(_prefetch_ingredientes()).get(
+            pk=formula_id
+        )
     except Formula.DoesNotExist:
         return JsonResponse({"error": "Fórmula não encontrada"}, status=404)
 
     if request.method == "GET":
-        ingredientes = []
-        for ingrediente in formula.ingredientes.all():
-            ingredientes.append(
-                {
-                    "id": ingrediente.id,
-                    "lote_materia_prima": {
-                        "id": ingrediente.lote_materia_prima.id,
-                        "lote": ingrediente.lote_materia_prima.numero_lote,
-                        "materia_prima": {
-                            "id": ingrediente.lote_materia_prima.materia_prima.id,
-                            "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                        },
-                    },
-                    "quant_mg": ingrediente.quant_mg,
-                }
-            )
-
-        return JsonResponse(ingredientes, safe=False)
+        return JsonResponse(
+            [_serializar_ingrediente(i) for i in formula.ingredientes.all()], safe=False
+        )
 
     elif request.method == "POST":
         data = json.loads(request.body)
         try:
             lote_materia_prima_id = data.get("lote_materia_prima_id")
             try:
-                lote_materia_prima = LoteMateriaPrima.objects.get(
-                    pk=lote_materia_prima_id
-                )
+                lote_materia_prima = LoteMateriaPrima.objects.select_related(
+                    "materia_prima"
+                ).get(pk=lote_materia_prima_id)
             except LoteMateriaPrima.DoesNotExist:
                 return JsonResponse(
                     {
@@ -358,52 +388,60 @@ def ingrediente_list(request, formula_id):
                 quant_mg=float(data.get("quant_mg", 0)),
             )
 
-            return JsonResponse(
-                {
-                    "id": ingrediente.id,
-                    "lote_materia_prima": {
-                        "id": ingrediente.lote_materia_prima.id,
-                        "lote": ingrediente.lote_materia_prima.numero_lote,
-                        "materia_prima": {
-                            "id": ingrediente.lote_materia_prima.materia_prima.id,
-                            "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                        },
-                    },
-                    "quant_mg": ingrediente.quant_mg,
-                },
-                status=201,
-            )
+            return JsonResponse(_serializar_ingrediente(ingrediente), status=201)
 
         except Exception as e:
             return JsonResponse(
                 {"error": f"Erro ao adicionar ingrediente: {str(e)}"}, status=400
             )
 
+    elif request.method == "PUT":
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse(
+                {"error": "Dados inválidos: não é um JSON válido"}, status=400
+            )
+        itens = data.get("ingredientes") if isinstance(data, dict) else data
+        if not isinstance(itens, list):
+            return JsonResponse(
+                {"error": "Envie a lista de ingredientes no campo ingredientes"},
+                status=400,
+            )
+
+        resultado = substituir_ingredientes(formula, itens)
+        if resultado["erros"]:
+            return JsonResponse({"erros": resultado["erros"]}, status=400)
+
+        return JsonResponse(
+            {
+                "criados": resultado["criados"],
+                "atualizados": resultado["atualizados"],
+                "excluidos": resultado["excluidos"],
+                "ingredientes": [
+                    _serializar_ingrediente(i) for i in resultado["ingredientes"]
+                ],
+            }
+        )
+
 
 @csrf_exempt
+@get_condicional(
+    lambda pk: Ingrediente.objects.filter(pk=pk),
+    lambda pk: LoteMateriaPrima.objects.filter(ingrediente=pk),
+    lambda pk: MateriaPrima.objects.filter(lotes__ingrediente=pk),
+)
 def ingrediente_detail(request, pk):
     """Recuperar, atualizar ou excluir um ingrediente"""
     try:
-        ingrediente = Ingrediente.objects.get(pk=pk)
+        ingrediente = Ingrediente.objects.select_related(
+            "lote_materia_prima__materia_prima"
+        ).get(pk=pk)
     except Ingrediente.DoesNotExist:
         return JsonResponse({"error": "Ingrediente não encontrado"}, status=404)
 
     if request.method == "GET":
-        return JsonResponse(
-            {
-                "id": ingrediente.id,
-                "formula_id": ingrediente.formula.id,
-                "lote_materia_prima": {
-                    "id": ingrediente.lote_materia_prima.id,
-                    "lote": ingrediente.lote_materia_prima.numero_lote,
-                    "materia_prima": {
-                        "id": ingrediente.lote_materia_prima.materia_prima.id,
-                        "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                    },
-                },
-                "quant_mg": ingrediente.quant_mg,
-            }
-        )
+        return JsonResponse(_serializar_ingrediente_detalhe(ingrediente))
 
     elif request.method == "PUT":
         data = json.loads(request.body)
@@ -412,21 +450,7 @@ def ingrediente_detail(request, pk):
             ingrediente.quant_mg = float(data.get("quant_mg", ingrediente.quant_mg))
             ingrediente.save()
 
-            return JsonResponse(
-                {
-                    "id": ingrediente.id,
-                    "formula_id": ingrediente.formula.id,
-                    "lote_materia_prima": {
-                        "id": ingrediente.lote_materia_prima.id,
-                        "lote": ingrediente.lote_materia_prima.numero_lote,
-                        "materia_prima": {
-                            "id": ingrediente.lote_materia_prima.materia_prima.id,
-                            "nome": ingrediente.lote_materia_prima.materia_prima.nome,
-                        },
-                    },
-                    "quant_mg": ingrediente.quant_mg,
-                }
-            )
+            return JsonResponse(_serializar_ingrediente_detalhe(ingrediente))
 
         except Exception as e:
             return JsonResponse(
@@ -445,6 +469,33 @@ def ingrediente_detail(request, pk):
             )
 
 
+@csrf_exempt
+def versao_formula_detail(request, hash):
+    """
+    Receita exata de uma versão de fórmula (imutável, então pode ficar em
+    cache no cliente indefinidamente)
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Método não permitido"}, status=405)
+
+    try:
+        versao = VersaoFormula.objects.get(hash=hash)
+    except VersaoFormula.DoesNotExist:
+        return JsonResponse({"error": "Versão de fórmula não encontrada"}, status=404)
+
+    resposta = JsonResponse(
+        {
+            "id": versao.id,
+            "hash": versao.hash,
+            "criada_em": versao.criada_em,
+            **versao.conteudo,
+        }
+    )
+    resposta.headers["ETag"] = f'"{versao.hash}"'
+    patch_cache_control(resposta, public=True, max_age=MAX_AGE_IMUTAVEL, immutable=True)
+    return resposta
+
+
 @csrf_exempt
 def forma_farmaceutica_list(request):
     """Listar todas as formas farmacêuticas disponíveis"""
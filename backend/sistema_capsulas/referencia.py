@@ -0,0 +1,130 @@
+"""
+Dados de referência do frontend (enums, fornecedores, unidades e categorias)
+em uma única resposta, pré-calculada, comprimida e identificada pelo hash do
+conteúdo.
+"""
+
+import gzip
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+
+from sc_fornecedores.models import Fornecedor
+from sc_materiasPrimas.models import (
+    MateriaPrima,
+    TipoMovimentacaoEnum,
+    UnidadeMedidaEnum,
+)
+from sc_produtos.models import ApresentacaoEnum, FormaFarmaceuticaEnum
+from .respostas import MAX_AGE_IMUTAVEL, validadores
+
+PREFIXO_CACHE_REFERENCIA = "referencia:pacote"
+
+
+def _opcoes(enum):
+    return [{"value": valor, "label": rotulo} for valor, rotulo in enum.choices]
+
+
+def dados_referencia():
+    """Monta os dados de referência a partir do banco (três consultas)"""
+    unidades = _opcoes(UnidadeMedidaEnum)
+    conhecidas = set(UnidadeMedidaEnum.values)
+    # Unidades gravadas que não estão no enum também são oferecidas
+    for unidade in (
+        MateriaPrima.objects.exclude(unidade_medida__in=conhecidas)
+        .order_by("unidade_medida")
+        .values_list("unidade_medida", flat=True)
+        .distinct()
+    ):
+        if unidade:
+            unidades.append({"value": unidade, "label": unidade})
+
+    return {
+        "formas_farmaceuticas": _opcoes(FormaFarmaceuticaEnum),
+        "apresentacoes": _opcoes(ApresentacaoEnum),
+        "tipos_movimentacao": _opcoes(TipoMovimentacaoEnum),
+        "unidades_medida": unidades,
+        "categorias": list(
+            MateriaPrima.objects.exclude(categoria__isnull=True)
+            .exclude(categoria="")
+            .order_by("categoria")
+            .values_list("categoria", flat=True)
+            .distinct()
+        ),
+        "fornecedores": list(
+            Fornecedor.objects.order_by("razao_social", "id").values(
+                "id", "cnpj", "razao_social", "fantasia"
+            )
+        ),
+    }
+
+
+def pacote_referencia():
+    """
+    (versão, json, json comprimido) dos dados de referência. O pacote fica em
+    cache enquanto fornecedores e matérias primas não mudarem; a versão é o
+    hash do conteúdo, então só muda quando os dados de referência mudam.
+    """
+    assinatura = validadores([Fornecedor.objects.all(), MateriaPrima.objects.all()])
+    chave = f"{PREFIXO_CACHE_REFERENCIA}:{hashlib.md5(assinatura.encode()).hexdigest()}"
+    pacote = cache.get(chave)
+    if pacote is None:
+        conteudo = json.dumps(
+            dados_referencia(), ensure_ascii=False, sort_keys=True, separators=(",", ":")
+        ).encode()
+        versao = hashlib.sha256(conteudo).hexdigest()[:16]
+        pacote = (versao, conteudo, gzip.compress(conteudo, compresslevel=9, mtime=0))
+        cache.set(chave, pacote, None)
+    return pacote
+
+
+def _resposta(request, conteudo, comprimido):
+    aceita_gzip = "gzip" in request.headers.get("Accept-Encoding", "")
+    resposta = HttpResponse(
+        comprimido if aceita_gzip else conteudo,
+        content_type="application/json; charset=utf-8",
+    )
+    if aceita_gzip:
+        resposta.headers["Content-Encoding"] = "gzip"
+    patch_vary_headers(resposta, ["Accept-Encoding"])
+    return resposta
+
+
+@csrf_exempt
+def referencia(request, versao=None):
+    """
+    Todos os dados de referência em uma requisição.
+
+    /api/referencia/ responde com ETag (a versão) e deve ser revalidada;
+    /api/referencia/<versao>/ é imutável e pode ficar em cache por um ano.
+    Uma versão antiga redireciona para a atual.
+    """
+    if request.method != "GET":
+        return HttpResponse(status=405)
+
+    atual, conteudo, comprimido = pacote_referencia()
+    url_atual = reverse("referencia-versao", args=[atual])
+
+    if versao is not None and versao != atual:
+        return HttpResponseRedirect(url_atual)
+
+    etag = f'"{atual}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        resposta = HttpResponseNotModified()
+    else:
+        resposta = _resposta(request, conteudo, comprimido)
+    resposta.headers["ETag"] = etag
+
+    if versao is None:
+        resposta.headers["Content-Location"] = url_atual
+        patch_cache_control(resposta, private=True, no_cache=True)
+    else:
+        patch_cache_control(
+            resposta, public=True, max_age=MAX_AGE_IMUTAVEL, immutable=True
+        )
+    return resposta
@@ -0,0 +1,116 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import Count, Max, Value
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+# Quantidade de linhas lidas do banco (e enviadas ao cliente) por vez no modo streaming
+STREAMING_CHUNK_SIZE = 2000
+
+# Um ano: respostas identificadas por hash do conteúdo nunca mudam
+MAX_AGE_IMUTAVEL = 365 * 24 * 60 * 60
+
+
+def resposta_json_streaming(queryset, serializar, chunk_size=STREAMING_CHUNK_SIZE):
+    """
+    Gera um array JSON incrementalmente a partir de um queryset.
+    Os objetos são lidos com QuerySet.iterator(), então a memória usada não
+    depende do tamanho da tabela.
+    """
+
+    def gerar():
+        yield "["
+        separador = ""
+        bloco = []
+        for obj in queryset.iterator(chunk_size=chunk_size):
+            bloco.append(separador + json.dumps(serializar(obj), cls=DjangoJSONEncoder))
+            separador = ","
+            if len(bloco) >= chunk_size:
+                yield "".join(bloco)
+                bloco = []
+        if bloco:
+            yield "".join(bloco)
+        yield "]"
+
+    return StreamingHttpResponse(gerar(), content_type="application/json")
+
+
+def resposta_lista(request, queryset, serializar):
+    """
+    Responde uma listagem como array JSON.
+    Com ?stream=true a resposta é enviada em streaming; caso contrário é
+    montada em memória como antes.
+    """
+    if request.GET.get("stream") == "true":
+        return resposta_json_streaming(queryset, serializar)
+    return JsonResponse([serializar(obj) for obj in queryset], safe=False)
+
+
+def validadores(consultas):
+    """
+    ETag de um conjunto de querysets, a partir de COUNT e MAX(atualizado_em) de
+    cada um, calculados em uma única consulta (UNION ALL).
+
+    Não há Last-Modified: MAX(atualizado_em) não muda quando uma linha é
+    excluída (nem quando um ingrediente sai de uma fórmula), e um cliente que
+    enviasse só If-Modified-Since receberia 304 com dados que já não existem.
+    O COUNT no ETag cobre as exclusões.
+    """
+    partes = [
+        consulta.order_by()
+        .annotate(fonte=Value(indice))
+        .values("fonte")
+        .annotate(total=Count("pk", distinct=True), ultima=Max("atualizado_em"))
+        .values_list("fonte", "total", "ultima")
+        for indice, consulta in enumerate(consultas)
+    ]
+    linhas = sorted(partes[0].union(*partes[1:], all=True))
+
+    # O status dos lotes depende da data, então o ETag muda na virada do dia
+    assinatura = repr((timezone.localdate().isoformat(), linhas))
+    return 'W/"%s"' % hashlib.md5(assinatura.encode()).hexdigest()
+
+
+def get_condicional(*fontes):
+    """
+    Decorador de views com suporte a GET condicional (If-None-Match). Se nada
+    mudou nas fontes, responde 304 sem executar a view.
+
+    Cada fonte é um model (a tabela inteira é considerada) ou uma função que
+    recebe os parâmetros da URL e devolve um queryset, para as views de detalhe.
+    """
+
+    def decorador(view):
+        @wraps(view)
+        def view_condicional(request, *args, **kwargs):
+            if request.method != "GET":
+                return view(request, *args, **kwargs)
+
+            consultas = [
+                (
+                    fonte._default_manager.all()
+                    if isinstance(fonte, type) and issubclass(fonte, models.Model)
+                    else fonte(**kwargs)
+                )
+                for fonte in fontes
+            ]
+            etag = validadores(consultas)
+
+            resposta = get_conditional_response(request, etag=etag)
+            if resposta is None:
+                resposta = view(request, *args, **kwargs)
+
+            if resposta.status_code in (200, 304):
+                resposta.headers["ETag"] = etag
+                # O cliente pode guardar a resposta, mas deve sempre revalidar
+                patch_cache_control(resposta, private=True, no_cache=True)
+            return resposta
+
+        return view_condicional
+
+    return decorador
@@ -3,6 +3,7 @@
 from pathlib import Path
 import os
 import socket
+import tempfile
 
 # Caminho base do projeto
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -89,6 +90,7 @@ INSTALLED_APPS = [
     "sc_materiasPrimas",
     "sc_producao",
     "sc_produtos",
+    "sc_busca",
 ]
 
 # O middleware de CORS deve vir o mais alto possível.
@@ -130,6 +132,22 @@ DATABASES = {
     }
 }
 
+# Cache
+# Baseado em arquivos para ser compartilhado entre os workers do gunicorn no
+# mesmo host (a invalidação feita por um worker vale para todos).
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get(
+            "DJANGO_CACHE_DIR",
+            os.path.join(tempfile.gettempdir(), "sistema_capsulas_cache"),
+        ),
+        # As chaves são poucas e fixas (valor do estoque, blocos de custo das
+        # fórmulas, pacote de referência): o corte só descarta pacotes antigos
+        "OPTIONS": {"MAX_ENTRIES": 300},
+    }
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -1,22 +1,27 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
+from . import referencia
 
 # Uma view simples para a raiz da API, para health checks.
 def api_home_view(request):
     return JsonResponse({
         'status': 'ok',
         'message': 'API do Sistema de Cápsulas está no ar!',
-        'apps': ['fornecedores', 'materias-primas', 'producao', 'produtos']
+        'apps': ['busca', 'fornecedores', 'materias-primas', 'producao', 'produtos']
     })
 
 # Agrupando as URLs da API em uma lista separada para organização
 api_urlpatterns = [
     path("", api_home_view, name="api-home"), # Endpoint para /api/
+    # Dados de referência do frontend em uma única requisição
+    path("referencia/", referencia.referencia, name="referencia"),
+    path("referencia/<str:versao>/", referencia.referencia, name="referencia-versao"),
     path("", include("sc_fornecedores.urls")),
     path("", include("sc_materiasPrimas.urls")),
     path("", include("sc_producao.urls")),
     path("", include("sc_produtos.urls")),
+    path("", include("sc_busca.urls")),
 ]
 
 urlpatterns = [